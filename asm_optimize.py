@@ -0,0 +1,524 @@
+"""Peephole optimization of method code for the tiny vm assembler.
+
+The assembler (assemble.py) translates each method into a list of
+code words, in which jump operands are placeholders to be patched
+once all labels are known.  Before patching, with -O, the method
+code is decoded back into instructions, divided into basic blocks,
+and simplified:
+
+  - A jump to an unconditional jump goes directly to its target
+    (jump threading).
+  - "jump_if L1; jump L2; L1:" becomes "jump_ifnot L2", and
+    likewise with jump_if and jump_ifnot exchanged.
+  - A jump to the next instruction is removed (a conditional
+    jump becomes a pop of its condition).
+  - Blocks that cannot be reached from the method entry are
+    removed.
+  - "store x; load x" is removed if variable x is not used
+    again before it is next stored.
+  - Local variables whose lifetimes do not overlap share a
+    frame slot, and alloc reserves only as many slots as are
+    needed (compact_locals).
+
+The simplified code is encoded again with the same placeholders,
+so labels are resolved as if the optimized code had been written
+by hand.  Each removed instruction is one less trip through the
+dispatch loop of the virtual machine.
+
+Whether or not the code is simplified, a call followed by
+"return n" becomes a tail_call, which reuses the frame of the
+calling method instead of pushing another, if we know how many
+arguments the called method takes.  The return is kept only if
+a jump leads to it.
+
+Whether or not the code is simplified, sequences of instructions
+that match a superinstruction in opdefs.txt (like load then
+load_field) are encoded as the superinstruction, unless a label
+would fall in the middle of it.
+
+The assembler also finds the greatest depth of the frame stack
+of each method (stack_depth), before simplifying its code, which
+can only make it shallower.  The fast mode of the virtual machine
+checks for that much room when a method is entered rather than on
+each push.  A call of a method whose number of arguments we do not
+know is taken to leave them on the stack, which can only overestimate.
+
+Each instruction keeps the source line it came from, so the line
+table of the method (see objfile.py) describes the code as encoded.
+In a superinstruction, the operand word of each part has the line
+of that part, so the return address of a fused call is attributed
+to the line of the call.  Likewise each call keeps the class it
+names, which the linker uses to find calls of a single method.
+"""
+
+import collections
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+CONDITIONAL_JUMPS = {"jump_if": "jump_ifnot", "jump_ifnot": "jump_if"}
+JUMPS = ["jump"] + list(CONDITIONAL_JUMPS)
+# Control never continues to the next instruction after these
+NO_FALLTHROUGH = ["jump", "return", "tail_call", "halt"]
+# Frame offset of the first local variable (after this object,
+# return address, and saved frame pointer)
+FIRST_LOCAL = 3
+# Words each operation pushes (or pops, if negative), except alloc
+# and call, whose effects depend on their operands
+STACK_EFFECTS = {"const": 1, "load": 1, "new": 1, "call_native": 1,
+                 "pop": -1, "store": -1, "jump_if": -1, "jump_ifnot": -1,
+                 "store_field": -2}
+
+
+class Op:
+    """One instruction of method code.  The operand is the
+    encoded operand word, or None, and more are the words of any
+    further operands; target is the label a jump refers to.
+    Labels are those of the instruction's address.  Line is the
+    source line, if known.  Receiver is the class a call names,
+    as an index in the imports list, and arity the number of
+    arguments of the method it calls, if known.
+    """
+    def __init__(self, defn, operand: Optional[int] = None,
+                 target: Optional[str] = None,
+                 labels: Optional[List[str]] = None,
+                 line: Optional[int] = None,
+                 receiver: Optional[int] = None,
+                 arity: Optional[int] = None):
+        self.defn = defn
+        self.operand = operand
+        self.more: List[int] = []
+        self.target = target
+        self.labels = labels or []
+        self.line = line
+        self.receiver = receiver
+        self.arity = arity
+
+    @property
+    def name(self) -> str:
+        return self.defn.name
+
+
+class Block:
+    """A basic block, ops[start:end], and the blocks
+    control may pass to from it
+    """
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.successors: List[int] = []
+
+
+class MethodOptimizer:
+    """Decode, simplify, and re-encode the code of one method"""
+
+    def __init__(self, code: List[int], labels: Dict[str, int],
+                 label_patch: Dict[int, str], instrs,
+                 lines: Optional[Dict[int, int]] = None,
+                 receivers: Optional[Dict[int, int]] = None,
+                 arities: Optional[Dict[int, int]] = None):
+        self.instrs = instrs
+        lines = lines or {}
+        receivers = receivers or {}
+        arities = arities or {}
+        by_code = {defn.code: defn for defn in instrs.ops.values()}
+        at: Dict[int, List[str]] = {}
+        for label, addr in labels.items():
+            at.setdefault(addr, []).append(label)
+        self.ops: List[Op] = []
+        pos = 0
+        while pos < len(code):
+            defn = by_code[code[pos]]
+            op = Op(defn, labels=at.pop(pos, []), line=lines.get(pos))
+            if defn.ops:
+                op.operand = code[pos + 1]
+                op.target = label_patch.get(pos + 1)
+                op.more = code[pos + 2:pos + 1 + defn.ops]
+                op.receiver = receivers.get(pos + 1)
+                op.arity = arities.get(pos + 1)
+            self.ops.append(op)
+            pos += defn.size()
+        # Labels after the last instruction
+        self.end_labels = [label for addr in sorted(at) for label in at[addr]]
+
+    def fused(self, i: int) -> Tuple[object, List[Op]]:
+        """The operation to encode at ops[i], and the
+        instructions it performs, fusing as many as we can
+        """
+        fusions = self.instrs.fusions
+        lengths = sorted({len(parts) for parts in fusions}, reverse=True)
+        for length in lengths:
+            run = self.ops[i:i + length]
+            if len(run) < length or any(op.labels for op in run[1:]):
+                continue
+            names = tuple(op.name for op in run)
+            if names in fusions:
+                return fusions[names], run
+        return self.ops[i].defn, self.ops[i:i + 1]
+
+    def encode(self) -> Tuple[List[int], Dict[str, int], Dict[int, str],
+                              Dict[int, int], Dict[int, int]]:
+        """Code words, labels, jump operands to patch, source
+        lines of instructions, and classes named by call operands
+        """
+        code: List[int] = []
+        labels: Dict[str, int] = {}
+        label_patch: Dict[int, str] = {}
+        lines: Dict[int, int] = {}
+        receivers: Dict[int, int] = {}
+        i = 0
+        while i < len(self.ops):
+            defn, run = self.fused(i)
+            for label in run[0].labels:
+                labels[label] = len(code)
+            if run[0].line is not None:
+                lines[len(code)] = run[0].line
+            code.append(defn.code)
+            for op in run:
+                if op.defn.ops:
+                    if op.line is not None:
+                        lines[len(code)] = op.line
+                    if op.target is not None:
+                        label_patch[len(code)] = op.target
+                    if op.receiver is not None:
+                        receivers[len(code)] = op.receiver
+                    code.append(op.operand)
+                    code += op.more
+            i += len(run)
+        for label in self.end_labels:
+            labels[label] = len(code)
+        return code, labels, label_patch, lines, receivers
+
+    def where(self) -> Dict[str, int]:
+        """Index of the instruction at each label"""
+        index = {label: len(self.ops) for label in self.end_labels}
+        for i, op in enumerate(self.ops):
+            for label in op.labels:
+                index[label] = i
+        return index
+
+    def delete(self, doomed: Set[int]):
+        """Remove instructions, moving their labels to
+        whatever instruction follows them
+        """
+        kept: List[Op] = []
+        orphans: List[str] = []
+        for i, op in enumerate(self.ops):
+            if i in doomed:
+                orphans += op.labels
+            else:
+                op.labels = orphans + op.labels
+                orphans = []
+                kept.append(op)
+        self.end_labels = orphans + self.end_labels
+        self.ops = kept
+
+    def blocks(self) -> List[Block]:
+        """Basic blocks, in order"""
+        where = self.where()
+        leaders = {0}
+        for i, op in enumerate(self.ops):
+            if op.labels:
+                leaders.add(i)
+            if op.name in JUMPS or op.name in NO_FALLTHROUGH:
+                leaders.add(i + 1)
+        starts = sorted(leader for leader in leaders if leader < len(self.ops))
+        blocks = [Block(start, end)
+                  for start, end in zip(starts, starts[1:] + [len(self.ops)])]
+        block_at = {block.start: n for n, block in enumerate(blocks)}
+        for n, block in enumerate(blocks):
+            last = self.ops[block.end - 1]
+            if last.name in JUMPS and where.get(last.target) in block_at:
+                block.successors.append(block_at[where[last.target]])
+            if last.name not in NO_FALLTHROUGH and n + 1 < len(blocks):
+                block.successors.append(n + 1)
+        return blocks
+
+    # ---- The individual simplifications; each returns
+    # ---- True if it changed the code.
+
+    def thread_jumps(self) -> bool:
+        where = self.where()
+        changed = False
+        for op in self.ops:
+            if op.name not in JUMPS:
+                continue
+            target = op.target
+            seen = {target}
+            while target in where and where[target] < len(self.ops):
+                dest = self.ops[where[target]]
+                if dest.name != "jump" or dest.target in seen:
+                    break
+                target = dest.target
+                seen.add(target)
+            if target != op.target:
+                log.debug(f"Jump to {op.target} threaded to {target}")
+                op.target = target
+                changed = True
+        return changed
+
+    def invert_branches(self) -> bool:
+        where = self.where()
+        doomed = set()
+        for i, op in enumerate(self.ops[:-1]):
+            following = self.ops[i + 1]
+            if (op.name in CONDITIONAL_JUMPS and i not in doomed
+                    and following.name == "jump" and not following.labels
+                    and where.get(op.target) == i + 2):
+                log.debug(f"{op.name} {op.target} around jump "
+                          f"{following.target} inverted")
+                op.defn = self.instrs[CONDITIONAL_JUMPS[op.name]]
+                op.target = following.target
+                doomed.add(i + 1)
+        self.delete(doomed)
+        return bool(doomed)
+
+    def remove_jumps_to_next(self) -> bool:
+        where = self.where()
+        doomed = set()
+        for i, op in enumerate(self.ops):
+            if op.name in JUMPS and where.get(op.target) == i + 1:
+                if op.name == "jump":
+                    doomed.add(i)
+                else:
+                    # Still must discard the condition
+                    op.defn = self.instrs["pop"]
+                    op.operand = op.target = None
+        self.delete(doomed)
+        return bool(doomed)
+
+    def remove_unreachable(self) -> bool:
+        blocks = self.blocks()
+        reached = set()
+        work = [0] if blocks else []
+        while work:
+            n = work.pop()
+            if n not in reached:
+                reached.add(n)
+                work += blocks[n].successors
+        doomed = set()
+        for n, block in enumerate(blocks):
+            if n not in reached:
+                doomed.update(range(block.start, block.end))
+        if doomed:
+            log.debug(f"Removing {len(doomed)} unreachable instructions")
+        self.delete(doomed)
+        return bool(doomed)
+
+    def liveness(self, blocks: List[Block]) -> List[Set[int]]:
+        """Variables (frame offsets) live on entry to each block"""
+        # Variables used before being stored, and stored, in each block
+        gen: List[Set[int]] = []
+        kill: List[Set[int]] = []
+        for block in blocks:
+            used, stored = set(), set()
+            for op in self.ops[block.start:block.end]:
+                if op.name == "load" and op.operand not in stored:
+                    used.add(op.operand)
+                elif op.name == "store":
+                    stored.add(op.operand)
+            gen.append(used)
+            kill.append(stored)
+        live_in: List[Set[int]] = [set() for _ in blocks]
+        changed = True
+        while changed:
+            changed = False
+            for n in reversed(range(len(blocks))):
+                live_out = set().union(
+                    *(live_in[s] for s in blocks[n].successors))
+                new_in = gen[n] | (live_out - kill[n])
+                if new_in != live_in[n]:
+                    live_in[n] = new_in
+                    changed = True
+        return live_in
+
+    def remove_dead_stores(self) -> bool:
+        """store x; load x  =>  (nothing), where x is dead after"""
+        blocks = self.blocks()
+        live_in = self.liveness(blocks)
+        doomed = set()
+        for n, block in enumerate(blocks):
+            live = set().union(*(live_in[s] for s in block.successors))
+            for i in reversed(range(block.start, block.end)):
+                op = self.ops[i]
+                prev = self.ops[i - 1] if i > block.start else None
+                if (op.name == "load" and prev is not None
+                        and prev.name == "store"
+                        and prev.operand == op.operand
+                        and op.operand not in live
+                        and i not in doomed):
+                    log.debug(f"Removing store/load of dead local "
+                              f"{op.operand}")
+                    doomed.update([i - 1, i])
+                if op.name == "store":
+                    live.discard(op.operand)
+                elif op.name == "load":
+                    live.add(op.operand)
+        self.delete(doomed)
+        return bool(doomed)
+
+    def compact_locals(self) -> bool:
+        """Give local variables that are never live at the same
+        time the same frame slot, and shrink alloc to match.
+        Two locals conflict if one is stored while the other is
+        live, or both are live at entry (holding the nothing that
+        alloc stored).  Each local, in order, gets the lowest slot
+        not used by any local it conflicts with.
+        """
+        allocs = [i for i, op in enumerate(self.ops) if op.name == "alloc"]
+        if len(allocs) != 1:
+            return False
+        alloc = allocs[0]
+        # Locals must be reserved once, before any are used
+        for op in self.ops[:alloc + 1]:
+            if op.labels or (op.name in ["load", "store"]
+                             and op.operand >= FIRST_LOCAL):
+                return False
+        blocks = self.blocks()
+        live_in = self.liveness(blocks)
+        used: Set[int] = set()
+        conflicts: Dict[int, Set[int]] = collections.defaultdict(set)
+
+        def conflict(var: int, others: Set[int]):
+            for other in others:
+                if other != var and other >= FIRST_LOCAL:
+                    conflicts[var].add(other)
+                    conflicts[other].add(var)
+
+        for var in live_in[0] if blocks else []:
+            if var >= FIRST_LOCAL:
+                conflict(var, live_in[0])
+        for block in blocks:
+            live = set().union(*(live_in[s] for s in block.successors))
+            for op in reversed(self.ops[block.start:block.end]):
+                if op.name not in ["load", "store"] \
+                        or op.operand < FIRST_LOCAL:
+                    continue
+                used.add(op.operand)
+                if op.name == "store":
+                    conflict(op.operand, live)
+                    live.discard(op.operand)
+                else:
+                    live.add(op.operand)
+        slot: Dict[int, int] = {}
+        for var in sorted(used):
+            taken = {slot[other] for other in conflicts[var] if other in slot}
+            slot[var] = min(set(range(len(taken) + 1)) - taken)
+        n_slots = max(slot.values()) + 1 if slot else 0
+        renumbered = any(slot[var] != var - FIRST_LOCAL for var in slot)
+        if n_slots == self.ops[alloc].operand and not renumbered:
+            return False
+        log.debug(f"Locals compacted from {self.ops[alloc].operand} "
+                  f"to {n_slots} slots")
+        for op in self.ops:
+            if op.name in ["load", "store"] and op.operand >= FIRST_LOCAL:
+                op.operand = FIRST_LOCAL + slot[op.operand]
+        if n_slots:
+            self.ops[alloc].operand = n_slots
+        else:
+            self.delete({alloc})
+        return True
+
+    def stack_effect(self, op: Op) -> int:
+        """Words op leaves on the stack, less those it takes"""
+        if op.name == "alloc":
+            return op.operand
+        if op.name in ["call", "tail_call"]:
+            # The result replaces the receiver and arguments
+            return -op.arity if op.arity is not None else 0
+        if op.defn.parts:
+            # Superinstructions written by hand; their operands
+            # are not decoded separately
+            return sum(STACK_EFFECTS.get(part, 0) for part in op.defn.parts)
+        return STACK_EFFECTS.get(op.name, 0)
+
+    def stack_depth(self) -> int:
+        """Greatest number of words, locals included, the method
+        pushes above its frame header, along any path from entry.
+        In well-formed code the depth at each instruction is the
+        same on every path, so we follow each block once.
+        """
+        blocks = self.blocks()
+        entry_depth = {0: 0} if blocks else {}
+        work = list(entry_depth)
+        deepest = 0
+        while work:
+            n = work.pop()
+            depth = entry_depth[n]
+            for op in self.ops[blocks[n].start:blocks[n].end]:
+                depth += self.stack_effect(op)
+                deepest = max(deepest, depth)
+            for successor in blocks[n].successors:
+                if successor not in entry_depth:
+                    entry_depth[successor] = depth
+                    work.append(successor)
+        return deepest
+
+    def form_tail_calls(self) -> bool:
+        """call m; return n  =>  tail_call m n arity(m)"""
+        if "tail_call" not in self.instrs.ops:
+            return False
+        doomed = set()
+        for i, op in enumerate(self.ops[:-1]):
+            following = self.ops[i + 1]
+            if (op.name == "call" and op.arity is not None
+                    and following.name == "return"):
+                log.debug(f"Call of slot {op.operand} is a tail call")
+                op.defn = self.instrs["tail_call"]
+                op.more = [following.operand, op.arity]
+                if not following.labels:
+                    doomed.add(i + 1)
+        self.delete(doomed)
+        return bool(doomed)
+
+    def optimize(self):
+        passes = [self.thread_jumps, self.invert_branches,
+                  self.remove_jumps_to_next, self.remove_unreachable,
+                  self.remove_dead_stores]
+        changed = True
+        while changed:
+            changed = False
+            for simplify in passes:
+                if simplify():
+                    changed = True
+        # Once, since it renumbers the locals
+        self.compact_locals()
+
+
+def optimize_method(code: List[int], labels: Dict[str, int],
+                    label_patch: Dict[int, str], instrs,
+                    simplify: bool = True,
+                    lines: Optional[Dict[int, int]] = None,
+                    receivers: Optional[Dict[int, int]] = None,
+                    arities: Optional[Dict[int, int]] = None
+                    ) -> Tuple[List[int], Dict[str, int], Dict[int, str],
+                               Dict[int, int], Dict[int, int]]:
+    """Optimized code words, labels, jump operands to patch,
+    source lines by code offset, and classes named by call
+    operands by code offset, for method code in which jumps are
+    not yet resolved.  instrs is the InstructionSet of the
+    assembler; arities are the numbers of arguments of the
+    methods called, by code offset of the call operand.  Without
+    simplify, we only form tail calls and superinstructions.
+    """
+    optimizer = MethodOptimizer(code, labels, label_patch, instrs, lines,
+                                receivers, arities)
+    optimizer.form_tail_calls()
+    if simplify:
+        optimizer.optimize()
+    result = optimizer.encode()
+    log.debug(f"Optimized method from {len(code)} to {len(result[0])} words")
+    return result
+
+
+def stack_depth(code: List[int], labels: Dict[str, int],
+                label_patch: Dict[int, str], instrs,
+                arities: Optional[Dict[int, int]] = None) -> int:
+    """Greatest depth of the frame stack above the frame header
+    (see MethodOptimizer.stack_depth) for method code in which
+    jumps are not yet resolved, with the numbers of arguments of
+    the methods called, by code offset of the call operand
+    """
+    return MethodOptimizer(code, labels, label_patch, instrs,
+                           arities=arities).stack_depth()
@@ -11,13 +11,27 @@ There are two approaches to "resolving" labels:
     references to labels and "patch them up" at the end.
 """
 
+import io
 import re
+import os
 import sys
 import json
+import hashlib
 from pathlib import Path
 import argparse
 import configparser
-from typing import Dict, List,  Optional, Tuple
+import concurrent.futures
+import collections
+import contextlib
+import signal
+import socketserver
+import threading
+import time
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Set, TextIO, Tuple)
+
+import objfile
+import asm_optimize
 
 import logging
 logging.basicConfig()
@@ -34,20 +48,50 @@ class Configuration:
         except FileExistsError:
             # If no configuration file is present, we will look in ./OBJ
             self.tvmlib = Path("./OBJ")
+        # A server (--serve) may be asked to use other libraries
+        self.default_tvmlib = self.tvmlib
 
 
 CONFIG = Configuration()  # Visible from any code
 
+# Object code formats and the suffixes of their files
+OBJECT_FORMATS = {"json": ".json", "bin": ".tvo"}
+
 
 def cli() -> object:
     parser = argparse.ArgumentParser(
         description="Assemble tiny virtual machine module"
                     "into JSON-formatted object code"
     )
-    parser.add_argument("source", type=argparse.FileType("r"))
-    parser.add_argument("target", type=argparse.FileType("w"),
-                        nargs="?", default=sys.stdout)
-    return parser.parse_args()
+    parser.add_argument("source", type=argparse.FileType("r"),
+                        nargs="?")
+    parser.add_argument("target", type=argparse.FileType("wb"),
+                        nargs="?", default=sys.stdout.buffer)
+    parser.add_argument("--format", choices=OBJECT_FORMATS, default="json",
+                        help="Object code as JSON (default) or compact"
+                             " binary (.tvo)")
+    parser.add_argument("--project", nargs="+", metavar="DIR",
+                        help="Assemble every .asm file in these directories"
+                             " (or these .asm files) into TVMLIB")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Worker processes for --project"
+                             " (default: one per core)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="Simplify jumps and remove dead code")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Assemble even if the build cache has"
+                             " identical object code")
+    parser.add_argument("--serve", nargs="?", const="-", metavar="SOCKET",
+                        help="Assemble requests read as JSON lines from a"
+                             " Unix socket, or stdin (see serve_requests)")
+    parser.add_argument("--module-cache", type=int,
+                        default=DEFAULT_MODULE_CACHE, metavar="N",
+                        help="Imported modules kept in memory with --serve"
+                             " (default 256)")
+    args = parser.parse_args()
+    if not args.project and not args.source and not args.serve:
+        parser.error("a source file, --project, or --serve is required")
+    return args
 
 
 # ----------------
@@ -55,41 +99,285 @@ def cli() -> object:
 #    - Slot numbers for methods, e.g., "print" is
 #      the second slot.
 #    - Field numbers for load and store operations
+#    - Numbers of arguments of methods, for tail calls
 #
+UNKNOWN_ARITY = -1  # In the "arities" of object code
+
+
 class ImportedModule:
     """Imported module uses information from
-    json file
+    object code file (json or binary), by way
+    of the library index
     """
-    def __init__(self, path: Path):
-        with open(path, "r") as source:
-            self.json = json.load(source)
-        # Dict from name to position would be faster, but
-        # number of lookups is very small
-        self.methods: List[str] = self.json["methods"]
-        self.fields:  List[str] = self.json["fields"]
+    def __init__(self, entry: dict):
+        self.method_index: Dict[str, int] = entry["methods"]
+        self.field_index: Dict[str, int] = entry["fields"]
+        # Slots are numbered from 0 in order
+        self.methods: List[str] = list(self.method_index)
+        self.fields:  List[str] = list(self.field_index)
+        # Arguments of each method by slot, UNKNOWN_ARITY if the
+        # object file does not say
+        arities = entry.get("arities", [])
+        self.arities: List[int] = (
+            arities + [UNKNOWN_ARITY] * (len(self.methods) - len(arities)))
 
     def method_slot(self, name: str) -> int:
-        if name in self.methods:
-            return self.methods.index(name)
+        if name in self.method_index:
+            return self.method_index[name]
         log.error(f"Method {name} not defined")
         return 0
 
+    def method_arity(self, name: str) -> int:
+        if name in self.method_index:
+            return self.arities[self.method_index[name]]
+        return UNKNOWN_ARITY
+
     def n_methods(self) -> int:
         return len(self.methods)
 
     def field_slot(self, name: str) -> int:
-        return self.fields.index(name)
+        return self.field_index[name]
+
 
+class ImportTable:
+    """The modules imported by one class being assembled, in
+    the order of the "imports" list of its object code, each
+    found by lookup (class name -> ImportedModule).
+    """
+    def __init__(self, lookup: Callable[[str], ImportedModule]):
+        self.lookup = lookup
+        # $ will be replaced by current class name in output .json file
+        self.modules: Dict[str, Optional[ImportedModule]] = {"$": None}
+        # Position of each module, which is its index in the
+        # "imports" list of the object file
+        self.index: Dict[str, int] = {"$": 0}
 
-IMPORTS: Dict[str, Optional[ImportedModule]] = { "$": None }
-# $ will be replaced by current class name in output .json file
+    def module(self, name: str) -> ImportedModule:
+        if name not in self.modules:
+            self.modules[name] = self.lookup(name)
+            self.index[name] = len(self.index)
+        return self.modules[name]
+
+    def names(self, class_name: str) -> List[str]:
+        return [class_name] + list(self.modules)[1:]
+
+    def reset(self):
+        self.modules.clear()
+        self.modules["$"] = None
+        self.index.clear()
+        self.index["$"] = 0
+
+
+# The import table of the command line assembler, which assembles
+# one class at a time (see Assembler for other uses)
+IMPORT_TABLE = ImportTable(lambda name: imported(name))
+IMPORTS = IMPORT_TABLE.modules
+IMPORT_INDEX = IMPORT_TABLE.index
 
 
 def import_module(module: str) -> ImportedModule:
-    if module not in IMPORTS:
-        path = CONFIG.tvmlib.joinpath(module).with_suffix(".json")
-        IMPORTS[module] = ImportedModule(path)
-    return IMPORTS[module]
+    return IMPORT_TABLE.module(module)
+
+
+def reset_imports():
+    """Start a fresh import table for the next class"""
+    IMPORT_TABLE.reset()
+
+
+# ----------------
+#  Library index.  Nearly every class we assemble imports
+#  the same few modules (Obj, Int, String, its superclasses),
+#  and we need only the slot numbers of their methods and
+#  fields, so we keep those in an index file in the library
+#  directory instead of loading the full object code of each
+#  module on every run.  An entry is refreshed whenever the
+#  object file it was made from changes.
+#
+
+INDEX_NAME = ".tvmlib_index.json"
+INDEX_VERSION = 2
+
+
+def file_signature(path: Path) -> Optional[List[int]]:
+    """Changes whenever the file is rewritten, or None if it is missing"""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+class LibraryIndex:
+    """Methods, fields, and superclasses of the classes
+    in an object code library.  Each entry looks like
+        {"file": "Int.json", "signature": [mtime, size, inode],
+         "super": "Obj", "chain": ["Obj"],
+         "methods": {"$constructor": 0, ...}, "fields": {...},
+         "arities": [0, ...]}
+    where chain is the list of superclasses, nearest first, and
+    arities the number of arguments of each method.
+    """
+    def __init__(self, lib: Path):
+        self.lib = lib
+        self.path = lib.joinpath(INDEX_NAME)
+        self.classes: Dict[str, dict] = {}
+        self.changed = False
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+            if saved.get("version") == INDEX_VERSION:
+                self.classes = saved["classes"]
+        except (OSError, ValueError, KeyError):
+            log.debug(f"Rebuilding library index {self.path}")
+        self.refresh()
+
+    def refresh(self):
+        """Bring every entry up to date with the library directory"""
+        present = set()
+        if self.lib.is_dir():
+            for path in self.lib.iterdir():
+                if path.suffix in objfile.SUFFIXES and path.name != INDEX_NAME:
+                    present.add(path.stem)
+        for class_name in list(self.classes):
+            if class_name not in present:
+                del self.classes[class_name]
+                self.changed = True
+        for class_name in sorted(present):
+            try:
+                self.entry(class_name)
+            except (OSError, ValueError, KeyError) as e:
+                # Perhaps being written right now; index it when needed
+                log.debug(f"Not indexing {class_name}: {e}")
+
+    def entry(self, class_name: str) -> Optional[dict]:
+        """Index entry for a class, re-read from its object
+        file if that has changed since it was indexed
+        """
+        path = objfile.find(self.lib, class_name)
+        signature = file_signature(path)
+        entry = self.classes.get(class_name)
+        if (entry and entry["file"] == path.name
+                and entry["signature"] == signature):
+            return entry
+        if signature is None:
+            if entry:
+                del self.classes[class_name]
+                self.changed = True
+            return None
+        log.debug(f"Indexing {path}")
+        entry = index_entry(path, signature)
+        self.classes[class_name] = entry
+        self.changed = True
+        return entry
+
+    def chain(self, class_name: str) -> List[str]:
+        """Superclasses of class_name, nearest first"""
+        supers = []
+        entry = self.classes.get(class_name)
+        while entry and entry["super"] != class_name \
+                and entry["super"] not in supers:
+            class_name = entry["super"]
+            supers.append(class_name)
+            entry = self.classes.get(class_name)
+        return supers
+
+    def module(self, class_name: str) -> ImportedModule:
+        entry = self.entry(class_name)
+        if entry is None:
+            raise FileNotFoundError(
+                f"No object code for {class_name} in {self.lib}")
+        return ImportedModule(entry)
+
+    def save(self):
+        """Write the index if any entry has changed"""
+        if not self.changed:
+            return
+        for class_name, entry in self.classes.items():
+            entry["chain"] = self.chain(class_name)
+        index = {"version": INDEX_VERSION, "classes": self.classes}
+        try:
+            write_atomic(self.path, json.dumps(index, indent=1).encode())
+        except OSError as e:
+            log.warning(f"Could not write library index: {e}")
+        self.changed = False
+
+
+def index_entry(path: Path, signature: List[int]) -> dict:
+    """Library index entry for an object file"""
+    obj = objfile.load(path)
+    return {"file": path.name, "signature": signature,
+            "super": obj["super"],
+            "methods": {name: slot
+                        for slot, name in enumerate(obj["methods"])},
+            "fields": {name: slot
+                       for slot, name in enumerate(obj["fields"])},
+            "arities": obj.get("arities", [])}
+
+
+LIBRARY: Optional[LibraryIndex] = None
+
+
+def library() -> LibraryIndex:
+    """The index of CONFIG.tvmlib, loaded once per run"""
+    global LIBRARY
+    if LIBRARY is None or LIBRARY.lib != CONFIG.tvmlib:
+        LIBRARY = LibraryIndex(CONFIG.tvmlib)
+    return LIBRARY
+
+
+DEFAULT_MODULE_CACHE = 256  # Entries
+
+
+class ModuleCache:
+    """Imported modules of the most recently used classes, in
+    any library, kept in memory by a long-running assembler
+    (--serve, or Assembler sessions) instead of the library
+    index.  An entry is re-read whenever its object file changes,
+    and the least recently used entries are dropped beyond
+    capacity.  Several threads may use one cache; the modules
+    it returns must not be modified.
+    """
+    def __init__(self, capacity: int = DEFAULT_MODULE_CACHE):
+        self.capacity = capacity
+        # (library, class name) -> (file, signature, module)
+        self.entries: "collections.OrderedDict[Tuple[str, str], tuple]" = \
+            collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def module(self, lib: Path, class_name: str) -> ImportedModule:
+        key = (str(lib), class_name)
+        path = objfile.find(lib, class_name)
+        signature = file_signature(path)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached and cached[:2] == (path.name, signature):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+            if signature is None:
+                self.entries.pop(key, None)
+        if signature is None:
+            raise FileNotFoundError(f"No object code for {class_name} in {lib}")
+        # Read outside the lock; if two threads both read it, either will do
+        module = ImportedModule(index_entry(path, signature))
+        with self.lock:
+            self.entries[key] = (path.name, signature, module)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return module
+
+
+# Shared by the sessions of a server; set by serve
+MODULE_CACHE: Optional[ModuleCache] = None
+
+
+def imported(class_name: str) -> ImportedModule:
+    """Methods and fields of a class in CONFIG.tvmlib"""
+    return library().module(class_name)
 
 
 # The named literals MUST match the definitions
@@ -118,10 +406,13 @@ NAMED_LITERALS = {
 #
 
 class InstructionDef:
-    def __init__(self, name: str, code: int, ops: int):
+    def __init__(self, name: str, code: int, ops: int,
+                 parts: Optional[List[str]] = None):
         self.name = name
         self.code = code
-        self.ops = ops
+        self.ops = int(ops)
+        # A superinstruction is a sequence of other operations
+        self.parts: List[str] = parts or []
 
     def size(self) -> int:
         """An instruction without an operand
@@ -144,19 +435,27 @@ class InstructionSet:
     def __init__(self, path: str):
         self.ops: Dict[str, InstructionDef] = {}
         """Instruction set initialized from text table"""
+        # Superinstructions, by the sequence of operations they fuse
+        self.fusions: Dict[Tuple[str, ...], InstructionDef] = {}
         opcode = 0
         with open(path, "r") as f:
-            for line in f:
-                # Strip comments, discard empty lines
-                line = line.split("#")[0].strip()
-                if not line:
-                    continue
-                # What remains should be an instruction definition
-                parts = line.split(",")
-                name, code, ops = parts
-                instr = InstructionDef(name, opcode, ops)
-                self.ops[name] = instr
-                opcode += 1
+            text = f.read()
+        # Object code is only reusable with the same instruction set
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        for line in text.splitlines():
+            # Strip comments, discard empty lines
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            # What remains should be an instruction definition
+            parts = line.split(",")
+            name, code, ops = parts[:3]
+            fused = parts[3].split("+") if len(parts) > 3 else []
+            instr = InstructionDef(name, opcode, ops, fused)
+            self.ops[name] = instr
+            if fused:
+                self.fusions[tuple(fused)] = instr
+            opcode += 1
 
     def __getitem__(self, name: str):
         return self.ops[name]
@@ -170,11 +469,13 @@ class Instruction:
     """Object code instruction, including operand if any."""
     def __init__(self, label: Optional[str],
                  operation: InstructionDef,
-                 operand: Optional[str]):
+                 operand: Optional[str],
+                 line_num: Optional[int] = None):
         self.label = label
         self.operation = operation
         self.operand = operand
-        if operation.ops == '0':
+        self.line_num = line_num  # In the assembly source
+        if operation.ops == 0:
             assert operand is None
         else:
             assert operand is not None
@@ -199,23 +500,66 @@ class Instruction:
 UNRESOLVED_ADDRESS = -42  # Just an easily recognized value
 
 
+class SymbolTable:
+    """Names numbered from 0 in the order they are first
+    added, like a list without duplicates, but with constant
+    time lookup of the number of a name.
+    """
+    def __init__(self, names: Iterable[str] = ()):
+        self.slots: Dict[str, int] = {}
+        self.names: List[str] = []
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> int:
+        """Number of name, adding it if it is new"""
+        if name not in self.slots:
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def index(self, name: str) -> int:
+        """Number of name; KeyError if it is not present"""
+        return self.slots[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.slots
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+
 class ObjectCode:
-    def __init__(self):
+    def __init__(self, optimize: bool = False,
+                 imports: Optional[ImportTable] = None):
+        # Simplify the code of each method before resolving jumps
+        self.optimize = optimize
+        self.imports = imports or IMPORT_TABLE
+        # Errors logged while translating (see Assembler)
+        self.errors: List[str] = []
         # The following are initialized in declare_class
         self.class_name: str = ""
         self.super_name: str = ""
-        self.method_list: List[str] = []
-        self.field_list: List[str] = []
-        # Constant pool
-        self.constants: List[Tuple[str, int]] = []
+        self.n_inherited = 0
+        self.method_list = SymbolTable()
+        self.field_list = SymbolTable()
+        # Number of arguments of each method, by slot
+        self.method_arities: List[int] = []
+        # Constant pool, each (kind, value) stored once
+        self.constants: List[Dict[str, str]] = []
+        self.constant_index: Dict[Tuple[str, str], int] = {}
         # Method code (instructions)
         self.code = []  # Will expand to code per method
         # For each method defined here, we want its
         # name, its slot# (position in vtable), its
         # local variable names, and its code.
         self.method_code: List[dict] = []
-        self.method_locals: List[str] = []
-        self.method_args: List[str] = []
+        self.method_locals = SymbolTable()
+        self.method_args = SymbolTable()
+        self.n_args = 0
         # Things to be resolved
         # Labels resolve to addresses within the code
         # of a method.
@@ -223,17 +567,45 @@ class ObjectCode:
         self.labels: Dict[str, int] = {}
         # address -> unresolved label
         self.label_patch: Dict[int, str] = {}
+        # address -> source line, for the line table
+        self.code_lines: Dict[int, int] = {}
+        # address of call operand -> imports index of the class
+        # it names, for the linker
+        self.call_receivers: Dict[int, int] = {}
+        # address of call operand -> arguments of the method called,
+        # where known, to make tail calls
+        self.call_arities: Dict[int, int] = {}
+        # What the object code depends on in each imported module,
+        # for the build cache:  module -> {"methods": {name: slot},
+        # "fields": {name: slot}, "arities": {name: arity}}, and for
+        # the superclass its whole "layout" of methods, fields, and
+        # arities.
+        self.dependencies: Dict[str, dict] = {}
+
+    def depend_on(self, module: str) -> dict:
+        if module == "$":
+            return {"methods": {}, "fields": {}, "arities": {}}
+        if module not in self.dependencies:
+            self.dependencies[module] = {"methods": {}, "fields": {},
+                                         "arities": {}}
+        return self.dependencies[module]
 
     def declare_class(self, name: str, super_name: str):
         self.class_name = name
         self.super_name = super_name
-        super_module = import_module(super_name)
+        super_module = self.imports.module(super_name)
+        # Inherited methods and fields are copied into our object
+        # code, so any change to them changes our object code.
+        self.depend_on(super_name)["layout"] = [
+            list(super_module.methods), list(super_module.fields),
+            list(super_module.arities)]
         # Methods and field list are initially those
         # we inherit, but may be extended elsewhere
         # in the assembly code
-        self.method_list = super_module.methods
+        self.method_list = SymbolTable(super_module.methods)
+        self.method_arities = list(super_module.arities)
         self.n_inherited = len(super_module.methods)
-        self.field_list = super_module.fields
+        self.field_list = SymbolTable(super_module.fields)
         # AND we need to be able to refer to this class in NEW
 
     def declare_field(self, name: str):
@@ -241,7 +613,7 @@ class ObjectCode:
         do this before methods.
         """
         assert name not in self.field_list, "Field already exists"
-        self.field_list.append(name)
+        self.field_list.add(name)
 
     def declare_method(self, method_name: str):
         """If we need calls to a method before we
@@ -250,8 +622,7 @@ class ObjectCode:
         we define before (or without) calling from within
         the same class.
         """
-        if method_name not in self.method_list:
-            self.method_list.append(method_name)
+        self.add_method(method_name)
         # That's all!  We're just reserving a spot
         # in the vtable.  Bad things will happen if
         # it's not filled in later in the code.
@@ -263,23 +634,39 @@ class ObjectCode:
         self.labels: Dict[str, int] = {}
         # address -> unresolved label
         self.label_patch: Dict[int, str] = {}
+        self.code_lines: Dict[int, int] = {}
+        self.call_receivers: Dict[int, int] = {}
+        self.call_arities: Dict[int, int] = {}
         ###
-        if method_name not in self.method_list:
-            self.method_list.append(method_name)
-        method_slot = self.method_list.index(method_name)
+        method_slot = self.add_method(method_name)
+        # Without .args, the method takes no arguments
+        self.method_arities[method_slot] = 0
         # Initialize code block
-        self.method_locals = []
+        self.method_locals = SymbolTable()
+        self.method_args = SymbolTable()
+        self.n_args = 0
         self.code = []  # We will append instructions to this list
         self.method_code.append({"name": method_name, "slot": method_slot,
                                  "code": self.code})
 
+    def add_method(self, method_name: str) -> int:
+        """Slot of a method, adding it (with arity not yet
+        known) if it is new
+        """
+        method_slot = self.method_list.add(method_name)
+        if method_slot == len(self.method_arities):
+            self.method_arities.append(UNKNOWN_ARITY)
+        return method_slot
+
     def declare_locals(self, method_locals: List[str]):
         """Map local variable names to position in activation record"""
-        self.method_locals = method_locals
+        self.method_locals = SymbolTable(method_locals)
 
     def declare_args(self, args: List[str]):
         """Map argument names to offsets *before* the frame pointer"""
-        self.method_args = args
+        self.method_args = SymbolTable(args)
+        self.n_args = len(args)
+        self.method_arities[self.method_code[-1]["slot"]] = len(args)
 
     def resolve_local(self, var: str) -> int:
         """Map local variable to position in activation record.
@@ -294,7 +681,7 @@ class ObjectCode:
             return 0
         if var in self.method_args:
             arg_num = self.method_args.index(var)
-            return arg_num - len(self.method_args)
+            return arg_num - self.n_args
         if var in self.method_locals:
             local_num = self.method_locals.index(var)
             return 3 + local_num
@@ -310,13 +697,30 @@ class ObjectCode:
                 method_slot = self.method_list.index(method_name)
             else:
                 # Imported class
-                module_record = import_module(class_name)
+                module_record = self.imports.module(class_name)
                 method_slot = module_record.method_slot(method_name)
+                self.depend_on(class_name)["methods"][method_name] = method_slot
         except LookupError:
             log.error(f"No such method '{full_name}'")
             method_slot = 0xBAD  # 2989 decimal
         return method_slot
 
+    def resolve_arity(self, full_name: str) -> int:
+        """Number of arguments of "Class:method", or
+        UNKNOWN_ARITY (like a method declared but not yet defined)
+        """
+        class_name, method_name = full_name.split(":")
+        if class_name == "$":
+            if method_name not in self.method_list:
+                return UNKNOWN_ARITY
+            return self.method_arities[self.method_list.index(method_name)]
+        try:
+            arity = self.imports.module(class_name).method_arity(method_name)
+        except LookupError:
+            return UNKNOWN_ARITY
+        self.depend_on(class_name)["arities"][method_name] = arity
+        return arity
+
     def resolve_field(self, full_name: str) -> int:
         """Resolve Class:field to slot number"""
         class_name, field_name = full_name.split(":")
@@ -326,20 +730,40 @@ class ObjectCode:
                 field_slot = self.field_list.index(field_name)
             else:
                 # Imported class (is that legal in Quack?)
-                module_record = import_module(class_name)
+                module_record = self.imports.module(class_name)
                 field_slot = module_record.field_slot(field_name)
+                self.depend_on(class_name)["fields"][field_name] = field_slot
         except LookupError:
             log.error(f"No such field '{full_name}'")
             field_slot = 0xBAD  # 2989 decimal
         return field_slot
 
     def resolve_class(self, class_name: str) -> int:
-        import_module(class_name)  # In case we need to
-        index = list(IMPORTS).index(class_name)
+        self.imports.module(class_name)  # In case we need to
+        self.depend_on(class_name)
+        index = self.imports.index[class_name]
         return index
 
     def resolve_jumps(self):
         """Patch up references to code labels"""
+        if self.method_code:
+            # Before simplifying, which can only make it shallower
+            self.method_code[-1]["depth"] = asm_optimize.stack_depth(
+                self.code, self.labels, self.label_patch, INSTRS,
+                self.call_arities)
+        if self.code and (self.optimize or INSTRS.fusions
+                          or "tail_call" in INSTRS.ops):
+            (code, self.labels, self.label_patch, self.code_lines,
+             self.call_receivers) = asm_optimize.optimize_method(
+                self.code, self.labels, self.label_patch, INSTRS,
+                simplify=self.optimize, lines=self.code_lines,
+                receivers=self.call_receivers, arities=self.call_arities)
+            self.code[:] = code  # Same list is in method_code
+        if self.method_code:
+            self.method_code[-1]["lines"] = objfile.line_table(
+                self.code_lines)
+            self.method_code[-1]["receivers"] = objfile.receiver_table(
+                self.call_receivers)
         for (patch_loc, patch_label) in self.label_patch.items():
             assert self.code[patch_loc] == UNRESOLVED_ADDRESS
             try:
@@ -349,7 +773,7 @@ class ObjectCode:
                 self.code[patch_loc] = jump_span
                 log.debug(f"Jump from loc {patch_loc} to {patch_label} "
                           f"({label_loc}) is {jump_span} words")
-            except IndexError:
+            except KeyError:
                 log.error(f"Unresolved label '{patch_label}'")
 
     def add_int_constant(self, literal: str) -> int:
@@ -370,6 +794,8 @@ class ObjectCode:
         if instr.label:
             # Address of next instruction
             self.labels[instr.label] = len(self.code)
+        if instr.line_num:
+            self.code_lines[len(self.code)] = instr.line_num
         self.code.append(instr.operation.code)
         if instr.operand:
             # Many operands require interpretation
@@ -391,19 +817,29 @@ class ObjectCode:
             # in the loader.
             if operand in NAMED_LITERALS:
                 return NAMED_LITERALS[operand]
-            if re.match("[0-9]+", operand):
+            if INT_LITERAL_PAT.match(operand):
                 kind = "i"
-            elif re.match('["][^"]*["]', operand):
+            elif STRING_LITERAL_PAT.match(operand):
                 kind = "s"
                 operand = operand.strip("\"").\
                     encode("utf-8").decode("unicode_escape")
             else:
                 log.error(f"Could not type operand '{operand}'")
                 kind = "BOGUS CONSTANT"
-            self.constants.append({"kind": kind, "value": operand})
-            return len(self.constants) - 1
+            key = (kind, operand)
+            if key not in self.constant_index:
+                self.constant_index[key] = len(self.constants)
+                self.constants.append({"kind": kind, "value": operand})
+            return self.constant_index[key]
         if op == "call":
             slot = self.resolve_call(operand)
+            class_name = operand.split(":")[0]
+            if class_name in self.imports.index:
+                self.call_receivers[len(self.code)] = \
+                    self.imports.index[class_name]
+            arity = self.resolve_arity(operand)
+            if arity != UNKNOWN_ARITY:
+                self.call_arities[len(self.code)] = arity
             return slot
         if op in ["load_field", "store_field"]:
             # These operations use indexes into the fields of an object
@@ -424,16 +860,22 @@ class ObjectCode:
             # Leave it to be patched in the final label resolution step
             self.label_patch[len(self.code)] = operand
             return UNRESOLVED_ADDRESS
+        if op in ["call_direct", "tail_call"]:
+            # Written in place of call, by the linker or the optimizer
+            log.error(f"{op} is not written in assembly code")
+            return 0
         # Match should be exhaustive
         log.error(f"Unhandled operand type for {instr}")
 
-    def json(self) -> str:
-        struct = {
+    def struct(self) -> dict:
+        """Object code structure, as described in objfile.py"""
+        return {
             "class_name": self.class_name,
             "super": self.super_name,
-            "imports": [self.class_name] + list(IMPORTS)[1:],
-            "methods": self.method_list,
-            "fields": self.field_list,
+            "imports": self.imports.names(self.class_name),
+            "methods": self.method_list.names,
+            "fields": self.field_list.names,
+            "arities": self.method_arities,
             # It's just simpler to count fields and methods
             # in the assembler than in the loader, so we'll add
             # some redundant information here.
@@ -443,16 +885,30 @@ class ObjectCode:
             "constants": self.constants,
             "code": self.method_code
         }
-        return json.dumps(struct, indent=4)
+
+    def json(self) -> str:
+        return json.dumps(self.struct(), indent=4)
+
+    def binary(self) -> bytes:
+        return objfile.encode(self.struct())
+
+    def encode(self, object_format: str) -> bytes:
+        """Contents of an object file in the chosen format"""
+        if object_format == "bin":
+            return self.binary()
+        return (self.json() + "\n").encode("utf-8")
 
     def __str__(self) -> str:
         return self.json()
 
 
 # ----------------
-#  Assembly code is line-oriented and can be parsed
-#  with regular expressions.  We strip away comments
-#  and then scan for label, operation, and operand fields.
+#  Assembly code is line-oriented.  We strip away comments, then
+#  the first token of each line tells us what kind of line it is:
+#  a directive (.class, .method, ...), a label (name:), or the
+#  name of an operation.  Each kind of line has its own parser,
+#  so we never try more than one pattern on a line, and we read
+#  lines one at a time as they are needed.
 #
 
 def strip_comments(line: str) -> str:
@@ -461,180 +917,705 @@ def strip_comments(line: str) -> str:
     # as will blank lines.
 
 
-# Instruction pattern (single operation of vm)
-INSTR_PAT = re.compile(r"""
-    ((?P<label> \w+) [:] )?   # Optional label
-    \s*
-    (?P<opname> [a-zA-Z_]+)      # Operation name is required
-    (\s+ (?P<operand>     # Operands are integers, quoted strings, or names
-             [0-9]+           # Integers are strings of digits
-           |
-             ["](             # String begins and ends with quote 
-               ([\\].)  |           # Anything escaped
-               [^"\\]               # Anything but a quote or escape
-             )*["]
-           |
-             (\w|[:$])+         # name, which may be part:part or $:part
-             )
-    )?                # Operand is optional
-   \s*
+# Operands are integers, quoted strings, or names
+OPERAND_PAT = re.compile(r"""
+      [0-9]+           # Integers are strings of digits
+    |
+      ["](             # String begins and ends with quote
+        ([\\].)  |           # Anything escaped
+        [^"\\]               # Anything but a quote or escape
+      )*["]
+    |
+      (\w|[:$])+         # name, which may be part:part or $:part
     """, re.VERBOSE)
 
-# Bare labels
-LABEL_PAT = re.compile(r"""
-    ((?P<label> \w+):)   # Nothing but the label
-   \s*
-    """, re.VERBOSE)
+NAME_PAT = re.compile(r"\w+")
+INT_LITERAL_PAT = re.compile(r"[0-9]+")
+STRING_LITERAL_PAT = re.compile(r'["][^"]*["]')
+OPNAME_PAT = re.compile(r"[a-zA-Z_]+")
+METHOD_NAME_PAT = re.compile(r"[$]?\w+")
+NAME_LIST_PAT = re.compile(r"\w+(,\w+)*")
 
-# Directive:  Name this class
+# Directive operand:  Name this class, .class Name:Super
 CLASS_DECL_PAT = re.compile(r"""
-[.]class \s+ 
 (?P<class_name> [\w$]+ )[:](?P<super_name> \w+)
-\s*
 """, re.VERBOSE)
 
-# Directive: Name this method
-#   (Starts a new method entry in the code object)
-METHOD_DEF_PAT = re.compile(r"""
-[.]method \s+
-(?P<method_name> [$]?\w+ )
-\s*
-""", re.VERBOSE)
 
-# Directive:  Declare a method to be defined
-# later in this class, so we can call it before
-# we define it.
-METHOD_DECL_PAT = re.compile(r"""
-[.]method \s+ 
-(?P<method_name> [$]?\w+ )
-\s+ forward
-\s*
-""", re.VERBOSE)
+class AsmSyntaxError(Exception):
+    """A line we cannot parse; column is 0-based within the line"""
+    def __init__(self, message: str, column: int):
+        super().__init__(message)
+        self.column = column
 
 
-# Directive: Add a field to the objects of this class
-FIELD_DECL_PAT = re.compile(r"""
-[.]field \s+
-(?P<field_name> \w+ )
-\s*
-""", re.VERBOSE)
+class Statement:
+    """One parsed line of assembly code.  The kind is a directive
+    ("class", "method", "forward", "field", "local", "args"),
+    "label", or "instr", and args depend on the kind.
+    """
+    __slots__ = ("kind", "args", "line_num")
 
-# Local variable:  The assembler emits an "alloc" instruction
-#   and records the positions of local variables so that they
-#   can be used within method code.
-LOCALS_DECL_PAT = re.compile(r"""
-[.]local \s+
-(?P<local_var_name> (\w+)(,\w+)*)
-\s*
-""", re.VERBOSE)
+    def __init__(self, kind: str, args: tuple, line_num: int):
+        self.kind = kind
+        self.args = args
+        self.line_num = line_num
 
-# Method argument:
-#    These will have addresses that are at a negative
-#    offset from the frame pointer
-ARGS_DECL_PAT = re.compile(r"""
-[.]args \s+
-(?P<arg_var_name> (\w+)(,\w+)*)
-\s*
-""", re.VERBOSE)
 
+def parse_class(operands: str, col: int) -> Tuple[str, tuple]:
+    match = CLASS_DECL_PAT.fullmatch(operands)
+    if not match:
+        raise AsmSyntaxError("Expecting .class Name:Super", col)
+    return "class", (match.group("class_name"), match.group("super_name"))
 
-def translate(lines: List[str]) -> ObjectCode:
-    code = ObjectCode()
-    for line in lines:
-        line = strip_comments(line)
-        if not line:
-            continue
 
-        # Kinds of assembly language line:
-        # Class declaration (.class)
-        match = CLASS_DECL_PAT.match(line)
-        if match:
-            class_name = match.groupdict()["class_name"]
-            superclass_name = match.groupdict()["super_name"]
-            code.declare_class(class_name, superclass_name)
-            continue
+def parse_method(operands: str, col: int) -> Tuple[str, tuple]:
+    parts = operands.split()
+    if parts and METHOD_NAME_PAT.fullmatch(parts[0]):
+        if len(parts) == 1:
+            return "method", (parts[0],)
+        if len(parts) == 2 and parts[1] == "forward":
+            return "forward", (parts[0],)
+    raise AsmSyntaxError("Expecting .method name or .method name forward",
+                         col)
 
-        # Method (.method f forward) to be filled in later
-        match = METHOD_DECL_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.declare_method(method_name)
-            continue
 
-        # Method (.method) followed immediately by body
-        match = METHOD_DEF_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.begin_method(method_name)
-            continue
+def parse_field(operands: str, col: int) -> Tuple[str, tuple]:
+    if not NAME_PAT.fullmatch(operands):
+        raise AsmSyntaxError("Expecting .field name", col)
+    return "field", (operands,)
 
-        # Field declaration, ".field name"
-        match = FIELD_DECL_PAT.match(line)
-        if match:
-            field_name = match.groupdict()["field_name"]
-            code.declare_field(field_name)
+
+def parse_name_list(kind: str) -> Callable[[str, int], Tuple[str, tuple]]:
+    def parse(operands: str, col: int) -> Tuple[str, tuple]:
+        if not NAME_LIST_PAT.fullmatch(operands):
+            raise AsmSyntaxError(f"Expecting .{kind} name,name,...", col)
+        return kind, (operands.split(","),)
+    return parse
+
+
+DIRECTIVES = {
+    ".class": parse_class,
+    ".method": parse_method,
+    ".field": parse_field,
+    ".local": parse_name_list("local"),
+    ".args": parse_name_list("args")
+}
+
+
+def parse_instruction(label: Optional[str], text: str, col: int
+                      ) -> Tuple[str, tuple]:
+    """An operation and its operand, e.g., 'load_field $:x'"""
+    parts = text.split(None, 1)
+    opname = parts[0]
+    operation = INSTRS.ops.get(opname)
+    if operation is None:
+        if OPNAME_PAT.fullmatch(opname):
+            raise AsmSyntaxError(f"Unknown operation '{opname}'", col)
+        raise AsmSyntaxError(f"Cannot parse '{text}'", col)
+    operand = None
+    if len(parts) > 1:
+        operand = parts[1]
+        col += text.index(operand, len(opname))
+        if not OPERAND_PAT.fullmatch(operand):
+            raise AsmSyntaxError(f"Malformed operand '{operand}'", col)
+    if (operand is None) != (operation.ops == 0):
+        raise AsmSyntaxError(
+            f"'{opname}' takes {operation.ops} operand(s)", col)
+    return "instr", (label, operation, operand)
+
+
+def parse(lines: Iterable[str]) -> Iterator[Statement]:
+    """Statements of assembly code, read lazily from lines.
+    Lines that cannot be parsed are reported (with line
+    and column) and skipped.
+    """
+    for line_num, line in enumerate(lines, start=1):
+        text = strip_comments(line)
+        if not text:
+            continue
+        col = len(line) - len(line.lstrip())
+        try:
+            first = text.split(None, 1)[0]
+            if first[0] == ".":
+                directive = DIRECTIVES.get(first)
+                if directive is None:
+                    raise AsmSyntaxError(f"Unknown directive '{first}'", col)
+                operands = text[len(first):].strip()
+                kind, args = directive(
+                    operands, col + text.index(operands, len(first))
+                    if operands else col + len(first))
+            elif ":" in first:
+                # Label, possibly followed by an instruction
+                label, _, rest = text.partition(":")
+                if not NAME_PAT.fullmatch(label):
+                    raise AsmSyntaxError(f"Cannot parse '{text}'", col)
+                rest_text = rest.strip()
+                if not rest_text:
+                    kind, args = "label", (label,)
+                else:
+                    kind, args = parse_instruction(
+                        label, rest_text,
+                        col + text.index(rest_text, len(label) + 1))
+            else:
+                kind, args = parse_instruction(None, text, col)
+        except AsmSyntaxError as e:
+            log.error(f"Line {line_num}, column {e.column + 1}: {e}")
             continue
+        yield Statement(kind, args, line_num)
+
 
+def translate(lines: Iterable[str], optimize: bool = False,
+              imports: Optional[ImportTable] = None) -> ObjectCode:
+    code = ObjectCode(optimize, imports)
+    for statement in parse(lines):
+        kind = statement.kind
+        # Kinds of assembly language line, most common first:
+        # An operation (label: operation operand)
+        if kind == "instr":
+            label, operation, operand = statement.args
+            code.add_instruction(Instruction(label, operation, operand,
+                                             statement.line_num))
+        # A label with no instruction
+        elif kind == "label":
+            code.add_label(statement.args[0])
+        # Method (.method) followed immediately by body
+        elif kind == "method":
+            code.begin_method(statement.args[0])
         # Local variable declaration, ".local name,name,name"
-        match = LOCALS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["local_var_name"]
-            method_locals = locals_name_list.split(",")
+        elif kind == "local":
+            method_locals = statement.args[0]
             n_locals = len(method_locals)
             # Allocate space on stack for local variables
             code.add_instruction(Instruction(
                 label=None,
                 operation=INSTRS["alloc"],
-                operand=n_locals))
+                operand=n_locals,
+                line_num=statement.line_num))
             # Now set up locals symbol table information
             code.declare_locals(method_locals)
-            continue
-
-        # Local variable declaration, ".local name,name,name"
-        match = ARGS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["arg_var_name"]
-            args = locals_name_list.split(",")
+        # Argument declaration, ".args name,name,name"
+        elif kind == "args":
             # No space allocation needed, unlike local variables,
             # because these are *before* (at negative offsets from)
             # the frame pointer.
             # Set up locals symbol table information
-            code.declare_args(args)
-            continue
+            code.declare_args(statement.args[0])
+        # Field declaration, ".field name"
+        elif kind == "field":
+            code.declare_field(statement.args[0])
+        # Method (.method f forward) to be filled in later
+        elif kind == "forward":
+            code.declare_method(statement.args[0])
+        # Class declaration (.class)
+        elif kind == "class":
+            class_name, superclass_name = statement.args
+            code.declare_class(class_name, superclass_name)
 
-        # An operation (label: operation operand)
-        match = INSTR_PAT.fullmatch(line)
-        if match:
-            parts = match.groupdict()
-            label = parts["label"]
-            opname = parts["opname"]
-            operand = parts["operand"]
-            instruction = Instruction(label, INSTRS[opname], operand)
-            code.add_instruction(instruction)
-            continue
+    if not code.class_name:
+        log.error("No .class declaration")
+    code.resolve_jumps()  # Of the last method entered
+    return code
 
-        # A label with no instruction
-        # An operation (label: operation operand)
-        match = LABEL_PAT.match(line)
-        if not match:
-            log.error(f"NO MATCH on '{line}'")
-            continue
-        parts = match.groupdict()
-        label = parts["label"]
-        code.add_label(label)
 
+# ----------------
+#  Build cache.  Most runs of the assembler produce exactly the object
+#  code they produced last time.  Object code depends only on the
+#  source, the instruction set, and the slot numbers of methods and
+#  fields looked up in imported modules, so we keep object code in
+#  a cache directory next to TVMLIB, keyed by a hash of the source
+#  and instruction set, along with the slot numbers each entry used.
+#  An entry is reused only if those slot numbers are unchanged.
+#  The cache directory may be deleted at any time.
+#
+CACHE_VERSION = 7  # Change when object code format changes
 
 
-    code.resolve_jumps()  # Of the last method entered
-    return code
+class ErrorCount(logging.Handler):
+    """Counts errors logged by the assembler in each thread, so
+    that we never cache object code it complained about, and
+    collects their messages on request.
+    """
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.local = threading.local()
+
+    @property
+    def count(self) -> int:
+        return getattr(self.local, "count", 0)
+
+    def emit(self, record: logging.LogRecord):
+        self.local.count = self.count + 1
+        messages = getattr(self.local, "messages", None)
+        if messages is not None:
+            messages.append(record.getMessage())
+
+    @contextlib.contextmanager
+    def collecting(self) -> Iterator[List[str]]:
+        """Messages of the errors this thread logs meanwhile"""
+        outer = getattr(self.local, "messages", None)
+        self.local.messages = []
+        try:
+            yield self.local.messages
+        finally:
+            if outer is not None:
+                outer.extend(self.local.messages)
+            self.local.messages = outer
+
+
+ERRORS = ErrorCount()
+log.addHandler(ERRORS)
+
+
+def write_atomic(path: Path, contents: bytes):
+    """Concurrent readers see the old file or the new, never part"""
+    temp = path.with_name(
+        f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temp, "wb") as f:
+        f.write(contents)
+    os.replace(temp, path)
+
+
+def dependencies_unchanged(
+        dependencies: Dict[str, dict],
+        lookup: Callable[[str], ImportedModule] = imported) -> bool:
+    """Do imported modules (found by lookup) still have the slot
+    numbers that cached object code was assembled with?
+    """
+    for module, used in dependencies.items():
+        try:
+            current = lookup(module)
+        except (OSError, ValueError, KeyError):
+            return False
+        if "layout" in used:
+            if used["layout"] != [current.methods, current.fields,
+                                  current.arities]:
+                return False
+        for name, slot in used["methods"].items():
+            if current.method_index.get(name) != slot:
+                return False
+        for name, slot in used["fields"].items():
+            if current.field_index.get(name) != slot:
+                return False
+        for name, arity in used.get("arities", {}).items():
+            if current.method_arity(name) != arity:
+                return False
+    return True
+
+
+class BuildCache:
+    """Object code from earlier runs of the assembler, for
+    classes importing modules found by lookup in tvmlib
+    """
+    def __init__(self, tvmlib: Path,
+                 lookup: Callable[[str], ImportedModule] = imported):
+        self.dir = tvmlib.with_name(tvmlib.name + ".asmcache")
+        self.imported = lookup
+
+    def key(self, source: str, object_format: str,
+            optimize: bool = False) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION} {object_format} {INSTRS.digest}"
+                      f" {int(optimize)}\n".encode("utf-8"))
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def lookup(self, key: str) -> Optional[bytes]:
+        """Cached object code, or None if absent or out of date"""
+        try:
+            with open(self.dir.joinpath(f"{key}.json"), "r") as f:
+                entry = json.load(f)
+            with open(self.dir.joinpath(f"{key}.obj"), "rb") as f:
+                object_code = f.read()
+        except (OSError, ValueError):
+            return None
+        if not dependencies_unchanged(entry["dependencies"], self.imported):
+            return None
+        return object_code
+
+    def store(self, key: str, objcode: ObjectCode, object_code: bytes):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # The .obj is written first, since lookup needs both
+        write_atomic(self.dir.joinpath(f"{key}.obj"), object_code)
+        entry = {"class_name": objcode.class_name,
+                 "dependencies": objcode.dependencies}
+        write_atomic(self.dir.joinpath(f"{key}.json"),
+                     json.dumps(entry).encode("utf-8"))
+
+
+def assemble_source(source: TextIO, cache: Optional[BuildCache],
+                    object_format: str = "json",
+                    optimize: bool = False) -> bytes:
+    """Contents of the object file for assembly source,
+    reused from the build cache if possible.
+    """
+    if cache:
+        # We must read the whole source to know whether it changed
+        source_text = source.read()
+        key = cache.key(source_text, object_format, optimize)
+        object_code = cache.lookup(key)
+        if object_code is not None:
+            log.debug("Object code unchanged, using build cache")
+            return object_code
+        source = io.StringIO(source_text)
+    errors_before = ERRORS.count
+    objcode = translate(source, optimize)
+    object_code = objcode.encode(object_format)
+    if cache and ERRORS.count == errors_before:
+        cache.store(key, objcode, object_code)
+    return object_code
+
+
+# ----------------
+#  Library interface.  The command line assembler keeps its import
+#  table and configuration in module globals, one class at a time.
+#  A program that assembles classes in-process (like a compiler),
+#  perhaps from several threads at once, uses Assembler sessions
+#  instead.
+#
+
+class Assembler:
+    """An assembler session with its own object code library and
+    options.  Each class it assembles gets a fresh import table,
+    so one session may be used from several threads.  Sessions
+    may share a ModuleCache of the classes they import, and with
+    use_cache, reuse object code from the build cache next to lib.
+
+        asm = Assembler(Path("OBJ"), optimize=True)
+        objcode = asm.assemble_file(Path("Foo.asm"), Path("OBJ/Foo.json"))
+        if objcode.errors:
+            ...
+    """
+    def __init__(self, lib: Optional[Path] = None, optimize: bool = False,
+                 object_format: str = "json",
+                 modules: Optional[ModuleCache] = None,
+                 use_cache: bool = False):
+        if object_format not in OBJECT_FORMATS:
+            raise ValueError(f"Unknown object format {object_format}")
+        self.lib = Path(lib) if lib is not None else CONFIG.default_tvmlib
+        self.optimize = optimize
+        self.object_format = object_format
+        self.modules = modules if modules is not None else ModuleCache()
+        self.cache = BuildCache(self.lib, self.module) if use_cache else None
+
+    def module(self, class_name: str) -> ImportedModule:
+        return self.modules.module(self.lib, class_name)
+
+    def assemble_text(self, source: str) -> ObjectCode:
+        """Object code for assembly source text, with the
+        messages of any errors in its errors list
+        """
+        with ERRORS.collecting() as errors:
+            objcode = translate(io.StringIO(source), self.optimize,
+                                ImportTable(self.module))
+        objcode.errors = errors
+        return objcode
+
+    def object_code(self, source: str) -> Tuple[bytes, List[str]]:
+        """Contents of the object file for assembly source text,
+        reused from the build cache if possible, and the messages
+        of any errors
+        """
+        if self.cache:
+            key = self.cache.key(source, self.object_format, self.optimize)
+            object_code = self.cache.lookup(key)
+            if object_code is not None:
+                log.debug("Object code unchanged, using build cache")
+                return object_code, []
+        objcode = self.assemble_text(source)
+        object_code = objcode.encode(self.object_format)
+        if self.cache and not objcode.errors:
+            self.cache.store(key, objcode, object_code)
+        return object_code, objcode.errors
+
+    def assemble_file(self, source: Path,
+                      target: Optional[Path] = None) -> ObjectCode:
+        """Object code for an assembly source file, also written
+        to target (if given) when there are no errors
+        """
+        with open(source, "r") as f:
+            objcode = self.assemble_text(f.read())
+        if target is not None and not objcode.errors:
+            write_atomic(Path(target), objcode.encode(self.object_format))
+        return objcode
+
+
+# ----------------
+#  Whole-project assembly.  Each class imports the object code of
+#  its superclass and of every class it calls, allocates, or
+#  accesses fields of, so those object files must be written before
+#  the class that refers to them can be assembled.  We find that
+#  dependency graph from the sources, then assemble each class in a
+#  pool of worker processes as soon as everything it imports has
+#  been written.  Independent classes are assembled concurrently.
+#
+
+# Operations whose operand names another class
+CLASS_OPERAND_OPS = ["new", "is_instance"]
+# Operations whose operand is Class:member
+MEMBER_OPERAND_OPS = ["call", "load_field", "store_field"]
+
+
+class ProjectClass:
+    """A class defined by a source file in the project,
+    and the names of the classes it imports.
+    """
+    def __init__(self, source: Path):
+        self.source = source
+        self.class_name: str = ""
+        self.super_name: str = ""
+        self.references: Set[str] = set()
+        with open(source, "r") as lines:
+            for statement in parse(lines):
+                if statement.kind == "class":
+                    self.class_name, self.super_name = statement.args
+                    self.references.add(self.super_name)
+                    continue
+                if statement.kind != "instr":
+                    continue
+                _, operation, operand = statement.args
+                if operation.name in CLASS_OPERAND_OPS:
+                    self.references.add(operand)
+                elif operation.name in MEMBER_OPERAND_OPS:
+                    self.references.add(operand.split(":")[0])
+        self.references.discard("$")
+        self.references.discard(self.class_name)
+
+
+def project_sources(paths: List[str]) -> List[Path]:
+    """The .asm files named directly or found in the named directories"""
+    sources = []
+    for name in paths:
+        path = Path(name)
+        if path.is_dir():
+            sources.extend(sorted(path.glob("*.asm")))
+        else:
+            sources.append(path)
+    return sources
+
+
+def assemble_file(source: Path, target: Path, use_cache: bool = True,
+                  object_format: str = "json", optimize: bool = False):
+    """Assemble one source file into one object file.
+    Runs in a worker process, which may be reused for
+    several classes, so the import table must start fresh.
+    Raises ValueError, writing nothing, if the assembler
+    logged errors, so that no class is built on broken code.
+    """
+    reset_imports()
+    cache = BuildCache(CONFIG.tvmlib) if use_cache else None
+    errors_before = ERRORS.count
+    with open(source, "r") as f:
+        object_code = assemble_source(f, cache, object_format, optimize)
+    errors = ERRORS.count - errors_before
+    if errors:
+        raise ValueError(f"{errors} error{'s' if errors > 1 else ''}")
+    with open(target, "wb") as f:
+        f.write(object_code)
+    library().save()
+
+
+def assemble_project(paths: List[str], jobs: Optional[int] = None,
+                     use_cache: bool = True,
+                     object_format: str = "json",
+                     optimize: bool = False) -> bool:
+    """Assemble every class in the project into CONFIG.tvmlib,
+    each one after all the project classes it imports.
+    Returns True iff every class was assembled.
+    """
+    classes: Dict[str, ProjectClass] = {}
+    for source in project_sources(paths):
+        defined = ProjectClass(source)
+        if not defined.class_name:
+            log.error(f"No .class declaration in {source}")
+            return False
+        if defined.class_name in classes:
+            log.error(f"Class {defined.class_name} is defined in both "
+                      f"{classes[defined.class_name].source} and {source}")
+            return False
+        classes[defined.class_name] = defined
+    # Classes that are not part of the project must already be in TVMLIB
+    waiting_on: Dict[str, Set[str]] = {
+        name: defined.references & classes.keys()
+        for name, defined in classes.items()}
+    done: Set[str] = set()
+    failed: Set[str] = set()
+    ok = True
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        running: Dict[concurrent.futures.Future, str] = {}
+        while waiting_on or running:
+            ready = [name for name, needs in waiting_on.items()
+                     if needs <= done]
+            for name in ready:
+                del waiting_on[name]
+                target = CONFIG.tvmlib.joinpath(name).with_suffix(
+                    OBJECT_FORMATS[object_format])
+                future = pool.submit(assemble_file,
+                                     classes[name].source, target,
+                                     use_cache, object_format, optimize)
+                running[future] = name
+            if not running:
+                # Whatever is still waiting is waiting on a failed
+                # class or on a circular chain of imports
+                for name, needs in waiting_on.items():
+                    log.error(f"Cannot assemble {name}; it imports "
+                              f"{', '.join(sorted(needs - done))}")
+                return False
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    log.info(f"Assembled {classes[name].source} as {name}")
+                    done.add(name)
+                except Exception as e:
+                    log.error(f"Failed to assemble "
+                              f"{classes[name].source}: {e}")
+                    failed.add(name)
+                    ok = False
+            # Nothing that imports a failed class can be assembled
+            for name in [name for name, needs in waiting_on.items()
+                         if needs & failed]:
+                log.error(f"Skipping {name}, which imports "
+                          f"{', '.join(sorted(waiting_on[name] & failed))}")
+                del waiting_on[name]
+                failed.add(name)
+    # Index what the workers wrote, so the next run need not
+    library().refresh()
+    library().save()
+    return ok
+
+
+# ----------------
+#  Server mode.  A compiler that runs the assembler once per class
+#  pays for starting Python and reading opdefs.txt and asm.conf
+#  each time, which costs more than assembling a typical class.
+#  With --serve, one process assembles a stream of requests, keeping
+#  the instruction set and imported modules in memory between them.
+#  Each request is one line of JSON:
+#      {"source": "<assembly text>", "target": "OBJ/Foo.json",
+#       "lib": "OBJ", "format": "json", "optimize": false,
+#       "no_cache": false, "id": 17}
+#  of which only source and target are required (lib defaults to
+#  TVMLIB from asm.conf).  Each reply is one line of JSON:
+#      {"id": 17, "ok": true, "errors": [], "time": 0.0012}
+#  Each request is assembled by its own Assembler session, sharing
+#  the server's ModuleCache, so requests for different libraries do
+#  not disturb one another.  The requests of one connection are
+#  handled in order; each connection has its own thread.
+#
+
+def handle_request(request: dict) -> dict:
+    """Assemble the source of one request into its target"""
+    start = time.perf_counter()
+    reply = {"id": request.get("id"), "ok": False, "errors": []}
+    with ERRORS.collecting() as errors:
+        reply["ok"] = assemble_request(request)
+    reply["errors"] = errors
+    reply["time"] = round(time.perf_counter() - start, 6)
+    return reply
+
+
+def assemble_request(request: dict) -> bool:
+    """Assemble the source of one request into its target,
+    logging any errors.  Returns True iff there were none.
+    """
+    try:
+        missing = [field for field in ["source", "target"]
+                   if not isinstance(request.get(field), str)]
+        if missing:
+            raise ValueError(f"Bad request, no {' or '.join(missing)}")
+        source, target = request["source"], Path(request["target"])
+        session = Assembler(request.get("lib"),
+                            bool(request.get("optimize")),
+                            request.get("format", "json"),
+                            modules=MODULE_CACHE,
+                            use_cache=not request.get("no_cache"))
+        object_code, errors = session.object_code(source)
+        if errors:
+            return False
+        write_atomic(target, object_code)
+        return True
+    except (OSError, ValueError) as e:
+        log.error(str(e))
+    except Exception as e:
+        # The assembler gave up on this source; keep serving
+        log.error(f"Assembler failed: {type(e).__name__}: {e}")
+    return False
+
+
+def serve_requests(requests: TextIO, replies: TextIO):
+    """Reply to each line of requests until end of file"""
+    for line in requests:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            request = f"not JSON: {e}"
+        if isinstance(request, dict):
+            reply = handle_request(request)
+        else:
+            reply = {"id": None, "ok": False,
+                     "errors": [f"Bad request, {request}"]}
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """One connection to the server, which may send any
+    number of requests
+    """
+    def handle(self):
+        serve_requests(io.TextIOWrapper(self.rfile, encoding="utf-8"),
+                       io.TextIOWrapper(self.wfile, encoding="utf-8",
+                                        write_through=True))
+
+
+class AssemblyServer(socketserver.ThreadingUnixStreamServer):
+    """Serves each connection in its own thread"""
+    daemon_threads = True  # Stopping need not wait for open connections
+
+
+def serve(socket_path: str, module_cache: int):
+    """Assemble requests from stdin ("-") or a Unix socket"""
+    global MODULE_CACHE
+    MODULE_CACHE = ModuleCache(module_cache)
+    if socket_path == "-":
+        serve_requests(sys.stdin, sys.stdout)
+        return
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # Remove the socket when stopped by kill as well as by ^C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with AssemblyServer(socket_path, RequestHandler) as server:
+        log.info(f"Serving assembly requests on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
 
 
 def main():
-    """Assemble one file into object code in json format"""
+    """Assemble one file into object code in json format,
+    or a whole project into the object code library.
+    """
     args = cli()
-    source = [line for line in args.source]
-    objcode = translate(source)
-    print(objcode.json(), file=args.target)
+    if args.serve:
+        serve(args.serve, args.module_cache)
+        return
+    if args.project:
+        ok = assemble_project(args.project, args.jobs, not args.no_cache,
+                              args.format, args.optimize)
+        sys.exit(0 if ok else 1)
+    cache = None if args.no_cache else BuildCache(CONFIG.tvmlib)
+    object_code = assemble_source(args.source, cache, args.format,
+                                  args.optimize)
+    args.target.write(object_code)
+    library().save()
 
 
 if __name__ == "__main__":
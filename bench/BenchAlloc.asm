@@ -0,0 +1,32 @@
+# Allocation in a loop:  a new Cell on every iteration, several
+# heap chunks in all, so the collector runs
+.class BenchAlloc:Obj
+.method $constructor
+.local i,cell
+    enter
+    const 0
+    store i
+loop:
+    const 200000
+    load i
+    call Int:less
+    jump_ifnot done
+    load i
+    new Cell
+    call Cell:$constructor
+    store cell
+    const 1
+    load cell
+    load_field Cell:value
+    call Int:plus
+    store i
+    jump loop
+done:
+    load i
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
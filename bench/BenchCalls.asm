@@ -0,0 +1,57 @@
+# Deep chains of recursive calls:  climb(i) calls climb(i+1)
+# until i reaches the depth, and each chain is repeated.
+# (The frame stack holds 1024 words, so chains must stay short.)
+.class BenchCalls:Obj
+.method climb forward
+.method $constructor
+.local round,total
+    enter
+    const 0
+    store round
+    const 0
+    store total
+loop:
+    const 300
+    load round
+    call Int:less
+    jump_ifnot done
+    const 0
+    load $
+    call $:climb
+    load total
+    call Int:plus
+    store total
+    const 1
+    load round
+    call Int:plus
+    store round
+    jump loop
+done:
+    load total
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
+
+# Depth of the chain below i
+.method climb
+.args i
+    enter
+    const 40
+    load i
+    call Int:less
+    jump_if deeper
+    const 0
+    return 1
+deeper:
+    const 1
+    load i
+    call Int:plus
+    load $
+    call $:climb
+    const 1
+    call Int:plus
+    return 1
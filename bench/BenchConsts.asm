@@ -0,0 +1,280 @@
+# A large constant pool:  sum() adds 120 distinct integer
+# constants, and is called repeatedly
+.class BenchConsts:Obj
+.method sum forward
+.method $constructor
+.local round,total
+    enter
+    const 0
+    store round
+    const 0
+    store total
+loop:
+    const 200
+    load round
+    call Int:less
+    jump_ifnot done
+    load $
+    call $:sum
+    load total
+    call Int:plus
+    store total
+    const 1
+    load round
+    call Int:plus
+    store round
+    jump loop
+done:
+    load total
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
+
+.method sum
+    enter
+    const 0
+    const 1000
+    call Int:plus
+    const 1001
+    call Int:plus
+    const 1002
+    call Int:plus
+    const 1003
+    call Int:plus
+    const 1004
+    call Int:plus
+    const 1005
+    call Int:plus
+    const 1006
+    call Int:plus
+    const 1007
+    call Int:plus
+    const 1008
+    call Int:plus
+    const 1009
+    call Int:plus
+    const 1010
+    call Int:plus
+    const 1011
+    call Int:plus
+    const 1012
+    call Int:plus
+    const 1013
+    call Int:plus
+    const 1014
+    call Int:plus
+    const 1015
+    call Int:plus
+    const 1016
+    call Int:plus
+    const 1017
+    call Int:plus
+    const 1018
+    call Int:plus
+    const 1019
+    call Int:plus
+    const 1020
+    call Int:plus
+    const 1021
+    call Int:plus
+    const 1022
+    call Int:plus
+    const 1023
+    call Int:plus
+    const 1024
+    call Int:plus
+    const 1025
+    call Int:plus
+    const 1026
+    call Int:plus
+    const 1027
+    call Int:plus
+    const 1028
+    call Int:plus
+    const 1029
+    call Int:plus
+    const 1030
+    call Int:plus
+    const 1031
+    call Int:plus
+    const 1032
+    call Int:plus
+    const 1033
+    call Int:plus
+    const 1034
+    call Int:plus
+    const 1035
+    call Int:plus
+    const 1036
+    call Int:plus
+    const 1037
+    call Int:plus
+    const 1038
+    call Int:plus
+    const 1039
+    call Int:plus
+    const 1040
+    call Int:plus
+    const 1041
+    call Int:plus
+    const 1042
+    call Int:plus
+    const 1043
+    call Int:plus
+    const 1044
+    call Int:plus
+    const 1045
+    call Int:plus
+    const 1046
+    call Int:plus
+    const 1047
+    call Int:plus
+    const 1048
+    call Int:plus
+    const 1049
+    call Int:plus
+    const 1050
+    call Int:plus
+    const 1051
+    call Int:plus
+    const 1052
+    call Int:plus
+    const 1053
+    call Int:plus
+    const 1054
+    call Int:plus
+    const 1055
+    call Int:plus
+    const 1056
+    call Int:plus
+    const 1057
+    call Int:plus
+    const 1058
+    call Int:plus
+    const 1059
+    call Int:plus
+    const 1060
+    call Int:plus
+    const 1061
+    call Int:plus
+    const 1062
+    call Int:plus
+    const 1063
+    call Int:plus
+    const 1064
+    call Int:plus
+    const 1065
+    call Int:plus
+    const 1066
+    call Int:plus
+    const 1067
+    call Int:plus
+    const 1068
+    call Int:plus
+    const 1069
+    call Int:plus
+    const 1070
+    call Int:plus
+    const 1071
+    call Int:plus
+    const 1072
+    call Int:plus
+    const 1073
+    call Int:plus
+    const 1074
+    call Int:plus
+    const 1075
+    call Int:plus
+    const 1076
+    call Int:plus
+    const 1077
+    call Int:plus
+    const 1078
+    call Int:plus
+    const 1079
+    call Int:plus
+    const 1080
+    call Int:plus
+    const 1081
+    call Int:plus
+    const 1082
+    call Int:plus
+    const 1083
+    call Int:plus
+    const 1084
+    call Int:plus
+    const 1085
+    call Int:plus
+    const 1086
+    call Int:plus
+    const 1087
+    call Int:plus
+    const 1088
+    call Int:plus
+    const 1089
+    call Int:plus
+    const 1090
+    call Int:plus
+    const 1091
+    call Int:plus
+    const 1092
+    call Int:plus
+    const 1093
+    call Int:plus
+    const 1094
+    call Int:plus
+    const 1095
+    call Int:plus
+    const 1096
+    call Int:plus
+    const 1097
+    call Int:plus
+    const 1098
+    call Int:plus
+    const 1099
+    call Int:plus
+    const 1100
+    call Int:plus
+    const 1101
+    call Int:plus
+    const 1102
+    call Int:plus
+    const 1103
+    call Int:plus
+    const 1104
+    call Int:plus
+    const 1105
+    call Int:plus
+    const 1106
+    call Int:plus
+    const 1107
+    call Int:plus
+    const 1108
+    call Int:plus
+    const 1109
+    call Int:plus
+    const 1110
+    call Int:plus
+    const 1111
+    call Int:plus
+    const 1112
+    call Int:plus
+    const 1113
+    call Int:plus
+    const 1114
+    call Int:plus
+    const 1115
+    call Int:plus
+    const 1116
+    call Int:plus
+    const 1117
+    call Int:plus
+    const 1118
+    call Int:plus
+    const 1119
+    call Int:plus
+    return 0
@@ -0,0 +1,57 @@
+# Field churn:  swap the values of two cells and
+# increment one of them, through load_field and store_field
+.class BenchFields:Obj
+.method $constructor
+.local a,b,i
+    enter
+    const 0
+    new Cell
+    call Cell:$constructor
+    store a
+    const 0
+    new Cell
+    call Cell:$constructor
+    store b
+    const 0
+    store i
+loop:
+    const 20000
+    load i
+    call Int:less
+    jump_ifnot done
+    load a
+    load_field Cell:value
+    load b
+    load_field Cell:value
+    load a
+    store_field Cell:value
+    load b
+    store_field Cell:value
+    const 1
+    load a
+    load_field Cell:value
+    call Int:plus
+    load a
+    store_field Cell:value
+    const 1
+    load i
+    call Int:plus
+    store i
+    jump loop
+done:
+    load a
+    load_field Cell:value
+    call Int:print
+    pop
+    const " "
+    call String:print
+    pop
+    load b
+    load_field Cell:value
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
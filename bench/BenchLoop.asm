@@ -0,0 +1,27 @@
+# Tight counting loop on jump_ifnot, in the style of Looper.asm
+# but without printing in the loop
+.class BenchLoop:Obj
+.method $constructor
+.local i
+    enter
+    const 0
+    store i
+loop:
+    const 20000
+    load i
+    call Int:less
+    jump_ifnot done
+    const 1
+    load i
+    call Int:plus
+    store i
+    jump loop
+done:
+    load i
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
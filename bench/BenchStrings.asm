@@ -0,0 +1,46 @@
+# String concatenation:  grow a string by appending to it,
+# comparing it with the previous value each time
+.class BenchStrings:Obj
+.method $constructor
+.local s,longer,i,n_less
+    enter
+    const ""
+    store s
+    const 0
+    store i
+    const 0
+    store n_less
+loop:
+    const 3000
+    load i
+    call Int:less
+    jump_ifnot done
+    const "ab"
+    load s
+    call String:plus
+    store longer
+    load longer
+    load s
+    call String:less
+    jump_ifnot next
+    const 1
+    load n_less
+    call Int:plus
+    store n_less
+next:
+    load longer
+    store s
+    const 1
+    load i
+    call Int:plus
+    store i
+    jump loop
+done:
+    load n_less
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
@@ -0,0 +1,12 @@
+# A mutable cell holding one value; used by the
+# allocation and field benchmarks (not itself a benchmark)
+.class Cell:Obj
+.field value
+.method $constructor
+.args v
+    enter
+    load v
+    load $
+    store_field $:value
+    load $
+    return 1
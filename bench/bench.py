@@ -0,0 +1,242 @@
+"""
+Benchmarks of the tiny vm.  Each Bench*.asm in this directory
+is a workload that stresses one path through the virtual machine
+(other .asm files, like Cell.asm, are classes they use):
+
+    BenchLoop       tight counting loop on jump_ifnot
+    BenchCalls      deep chains of recursive calls
+    BenchAlloc      new objects in a loop, and garbage collection
+    BenchFields     load_field and store_field churn
+    BenchStrings    string concatenation and comparison
+    BenchConsts     a large constant pool
+
+The driver assembles them all (as a project, in build/), runs
+bin/tiny_vm -t on each several times, and reports the median run
+time, operations executed per second, wall time of the whole
+process, and peak resident set size (and records how many boxed
+integers came from the small-integer table, and the collections and
+total pause of the garbage collector).  Each session is appended
+to a JSON history (history.json by default).  A workload whose
+median run time is more than --threshold (a fraction) slower
+than its median over the last few comparable sessions is flagged
+as a regression, and the driver exits with status 1.
+
+    python3 bench/bench.py                 # all workloads
+    python3 bench/bench.py BenchCalls -n 9 --label "inline call"
+    python3 bench/bench.py -F              # the fast mode, tiny_vm -F
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+BENCH = pathlib.Path(__file__).resolve().parent
+ROOT = BENCH.parent
+VM = ROOT.joinpath("bin", "tiny_vm")
+ASM = ROOT.joinpath("assemble.py")
+BUILD = BENCH.joinpath("build")
+BUILTINS = ["Bool.json", "Int.json", "Nothing.json", "Obj.json", "String.json"]
+BASELINE_SESSIONS = 5  # Compare with the median over this many past sessions
+
+# Printed on stderr by the virtual machine with -t
+TIMES_PAT = re.compile(
+    r"^time load ([0-9.]+) run ([0-9.]+) steps ([0-9]+) rss ([0-9]+)$",
+    re.MULTILINE)
+INTS_PAT = re.compile(r"^small ints ([0-9]+) allocated ints ([0-9]+)$",
+                      re.MULTILINE)
+GC_PAT = re.compile(r"^gc collections ([0-9]+) pause ([0-9.]+) ",
+                    re.MULTILINE)
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Benchmark the tiny vm")
+    parser.add_argument("workloads", nargs="*",
+                        help="Workloads to run (default all Bench*.asm)")
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="Runs of each workload (default 5)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="Assemble with -O")
+    parser.add_argument("-F", "--fast", action="store_true",
+                        help="Run the virtual machine with -F")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown (fraction) flagged as a regression"
+                             " (default 0.10)")
+    parser.add_argument("--history", type=pathlib.Path,
+                        default=BENCH.joinpath("history.json"),
+                        help="JSON history of benchmark sessions")
+    parser.add_argument("--label", default="",
+                        help="Note describing this session")
+    parser.add_argument("--no-record", action="store_true",
+                        help="Compare with the history, but do not add"
+                             " this session to it")
+    return parser.parse_args()
+
+
+def build(optimize: bool) -> bool:
+    """Assemble every class in BENCH into build/OBJ"""
+    shutil.rmtree(BUILD, ignore_errors=True)
+    lib = BUILD.joinpath("OBJ")
+    lib.mkdir(parents=True)
+    for objfile in BUILTINS:
+        shutil.copyfile(ROOT.joinpath("OBJ", objfile), lib.joinpath(objfile))
+    shutil.copyfile(ROOT.joinpath("opdefs.txt"), BUILD.joinpath("opdefs.txt"))
+    BUILD.joinpath("asm.conf").write_text("[DEFAULT]\nTVMLIB = OBJ\n")
+    command = [sys.executable, str(ASM), "--project", str(BENCH),
+               "--no-cache"]
+    if optimize:
+        command.append("-O")
+    proc = subprocess.run(command, cwd=BUILD, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        return False
+    return True
+
+
+def run_once(workload: str, fast: bool) -> dict:
+    """Run the virtual machine once, measuring it.  With -t it
+    reports its load and run times, operations executed, and peak
+    resident set size (which we could not get from wait4, since
+    that would include the Python process forked to start it).
+    """
+    with tempfile.TemporaryFile("w+") as err:
+        start = time.perf_counter()
+        command = [str(VM), "-t"] + (["-F"] if fast else []) + [workload]
+        proc = subprocess.run(command, cwd=BUILD,
+                              stdout=subprocess.DEVNULL, stderr=err)
+        wall = time.perf_counter() - start
+        err.seek(0)
+        stderr = err.read()
+    times = TIMES_PAT.search(stderr)
+    if proc.returncode != 0 or not times:
+        raise RuntimeError(f"{workload} failed with status "
+                           f"{proc.returncode}:\n{stderr[-2000:]}")
+    result = {"wall": wall, "load": float(times.group(1)),
+              "run": float(times.group(2)), "steps": int(times.group(3)),
+              "rss_kb": int(times.group(4))}
+    ints = INTS_PAT.search(stderr)
+    if ints:
+        result["small_ints"] = int(ints.group(1))
+        result["allocated_ints"] = int(ints.group(2))
+    gc = GC_PAT.search(stderr)
+    if gc:
+        result["gc_collections"] = int(gc.group(1))
+        result["gc_pause"] = float(gc.group(2))
+    return result
+
+
+def measure(workload: str, repeat: int, fast: bool) -> dict:
+    """Summary of several runs of a workload"""
+    runs = [run_once(workload, fast) for _ in range(repeat)]
+    run = statistics.median(r["run"] for r in runs)
+    steps = runs[0]["steps"]
+    summary = {"run": run,
+               "load": statistics.median(r["load"] for r in runs),
+               "wall": statistics.median(r["wall"] for r in runs),
+               "steps": steps,
+               "ops_per_sec": steps / run if run > 0 else 0.0,
+               "rss_kb": max(r["rss_kb"] for r in runs),
+               "runs": [r["run"] for r in runs]}
+    # Every run boxes the same integers and collects as often
+    for key in ["small_ints", "allocated_ints", "gc_collections"]:
+        if key in runs[0]:
+            summary[key] = runs[0][key]
+    if "gc_pause" in runs[0]:
+        summary["gc_pause"] = statistics.median(r["gc_pause"] for r in runs)
+    return summary
+
+
+def load_history(path: pathlib.Path) -> List[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)["sessions"]
+    except FileNotFoundError:
+        return []
+
+
+def save_history(path: pathlib.Path, sessions: List[dict]):
+    temp = path.with_name(f".{path.name}.tmp")
+    with open(temp, "w") as f:
+        json.dump({"sessions": sessions}, f, indent=2)
+    os.replace(temp, path)
+
+
+def baseline(sessions: List[dict], workload: str,
+             optimize: bool, fast: bool) -> Optional[float]:
+    """Median run time of a workload over recent sessions
+    assembled and run the same way, or None if there are none
+    """
+    past = [session["results"][workload]["run"]
+            for session in sessions
+            if session["optimize"] == optimize
+            and session.get("fast", False) == fast
+            and workload in session["results"]]
+    if not past:
+        return None
+    return statistics.median(past[-BASELINE_SESSIONS:])
+
+
+def git_revision() -> str:
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=ROOT, capture_output=True, text=True)
+        return proc.stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    args = cli()
+    workloads = args.workloads or sorted(
+        path.stem for path in BENCH.glob("Bench*.asm"))
+    if not VM.exists():
+        print(f"No virtual machine at {VM}; build it first", file=sys.stderr)
+        sys.exit(2)
+    if not build(args.optimize):
+        print("Assembling the benchmarks failed", file=sys.stderr)
+        sys.exit(2)
+    sessions = load_history(args.history)
+    results: Dict[str, dict] = {}
+    regressions = []
+    print(f"{'workload':14} {'run (s)':>9} {'Mops/s':>7} {'wall (s)':>9}"
+          f" {'RSS (MB)':>9} {'vs base':>8}")
+    for workload in workloads:
+        result = measure(workload, args.repeat, args.fast)
+        results[workload] = result
+        base = baseline(sessions, workload, args.optimize, args.fast)
+        change = ""
+        if base:
+            ratio = result["run"] / base - 1
+            change = f"{100 * ratio:+7.1f}%"
+            if ratio > args.threshold:
+                change += " !"
+                regressions.append(workload)
+        print(f"{workload:14} {result['run']:9.4f}"
+              f" {result['ops_per_sec'] / 1e6:7.2f} {result['wall']:9.4f}"
+              f" {result['rss_kb'] / 1024:9.1f} {change:>8}")
+    if not args.no_record:
+        sessions.append({
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(), "label": args.label,
+            "optimize": args.optimize, "fast": args.fast,
+            "repeat": args.repeat,
+            "results": results})
+        save_history(args.history, sessions)
+    if regressions:
+        print(f"Regressions (more than {100 * args.threshold:.0f}% slower"
+              f" than baseline): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,30 @@
 """Build table mapping integer byte codes to function pointers.
 Machine operations, their names, and the number of operands
 for each are given in opdefs.txt.
+
+An operation may also be a "superinstruction" that fuses a
+sequence of other operations, listed as a fourth field like
+load+load_field.  We generate its function, which performs
+each of those operations in turn (each fetching its own
+operands), so that the sequence is dispatched once instead
+of once per operation.
+
+For the fast mode of the virtual machine (vm_fast.c), in which
+the top of the evaluation stack is kept in the register vm_tos,
+each operation also has a fast version.  Those in FAST_OPS are
+written by hand in vm_fast.c; for each other operation we generate
+one that stores vm_tos on the stack, performs the operation, and
+takes the new top of the stack back into vm_tos.  The fast version
+of a superinstruction performs the fast versions of its parts.
+They are listed, by byte code, in vm_fast_bytecodes.
+
+We also generate the release dispatch loop, vm_run_release,
+which only fetches and calls each operation.  (Code words are
+the addresses of the functions in this table, including those
+of native method trampolines in builtins.c, so the loop calls
+through them rather than jumping to labels with computed goto.)
+The checked loop, vm_run in vm_state.c, also logs each step and
+checks the health of the built-in classes after it.
 """
 import argparse
 import datetime
@@ -26,15 +50,40 @@ PROLOGUE = f"""
  */
  
 #include "vm_code_table.h"
+"""
+
+TABLE_START = f"""
 op_tbl_entry vm_op_bytecodes[] = {LB}
 """
 
 # Fixed code at end of generated file
 CODA = """
-    { 0, 0, 0}  // SENTRY
+    { 0, 0, 0 }  // SENTRY
+};
+
+/* Release dispatch loop:  nothing between operations but
+ * fetching the next one and counting it.
+ */
+void vm_run_release(void) {
+    vm_run_state = VM_RUNNING;
+    while (vm_run_state == VM_RUNNING) {
+        vm_Instr instr = vm_pc->instr;
+        ++vm_pc;
+        instr();
+        ++vm_steps;
+    }
+}
+"""
+
+FAST_TABLE_START = f"""
+/* Fast versions of the operations, by byte code */
+vm_Instr vm_fast_bytecodes[] = {LB}"""
+
+FAST_TABLE_END = """    0  // SENTRY
 };
 """
 
+
 def cli() -> object:
     """Command line interface"""
     parser = argparse.ArgumentParser(prog=__name__,
@@ -49,12 +98,24 @@ def cli() -> object:
     return args
 
 
-def main():
-    log.info("Bytecode table generation")
-    args = cli()
-    print(PROLOGUE, file=args.outfile)
-    next_byte_code = 0;
-    for line in args.infile:
+# Operations that transfer control elsewhere.  In a superinstruction
+# they may only come last, since the operations after them would
+# run at the wrong place.
+CONTROL_OPS = ["halt", "call", "call_direct", "tail_call", "return",
+               "jump", "jump_if", "jump_ifnot"]
+
+MAX_FUSED_PARTS = 3  # Must match vm_code_table.h
+
+# Operations with a fast version vm_fast_<name> in vm_fast.c
+FAST_OPS = ["const", "call", "call_direct", "call_native", "enter",
+            "return", "new", "pop", "alloc", "load", "store",
+            "load_field", "store_field", "jump", "jump_if", "jump_ifnot"]
+
+
+def read_opdefs(infile) -> list:
+    """(name, func, n_operands, parts, comment) for each operation"""
+    opdefs = []
+    for line in infile:
         line = line.strip()
         # Strip off comments
         parts = line.split("#")
@@ -66,14 +127,91 @@ def main():
         if len(line) == 0:
             continue
         parts = line.split(",")
-        assert len(parts) == 3, f"Couldn't parse {line}"
-        name, func, inlines = parts
-        print(f'\t {LB} "{name}", {func}, {inlines} {RB}, //{next_byte_code} {comment}',
+        assert len(parts) in [3, 4], f"Couldn't parse {line}"
+        name, func, inlines = parts[:3]
+        fused = parts[3].split("+") if len(parts) == 4 else []
+        opdefs.append((name, func, int(inlines), fused, comment))
+    return opdefs
+
+
+def fused_function(name: str, func: str, fused: list, funcs: dict) -> str:
+    """C function for a superinstruction"""
+    calls = "\n".join(f"    {funcs[part]}();" for part in fused)
+    return f"""
+/* {name}: {' then '.join(fused)} */
+void {func}(void) {LB}
+{calls}
+{RB}
+"""
+
+
+def fast_function(name: str, func: str, fused: list) -> str:
+    """C function for the fast version of an operation
+    that is not in FAST_OPS
+    """
+    if fused:
+        calls = "\n".join(f"    vm_fast_{part}();" for part in fused)
+        return f"""
+/* {name} (fast): {' then '.join(fused)} */
+static void vm_fast_{name}(void) {LB}
+{calls}
+{RB}
+"""
+    return f"""
+/* {name} (fast), with the top of the stack in memory */
+static void vm_fast_{name}(void) {LB}
+    *vm_sp = vm_tos;
+    {func}();
+    vm_tos = *vm_sp;
+{RB}
+"""
+
+
+def main():
+    log.info("Bytecode table generation")
+    args = cli()
+    opdefs = read_opdefs(args.infile)
+    byte_codes = {name: code for code, (name, *_) in enumerate(opdefs)}
+    n_operands = {name: inlines for name, _, inlines, _, _ in opdefs}
+    funcs = {name: func for name, func, *_ in opdefs}
+    superinstructions = [name for name, _, _, fused, _ in opdefs if fused]
+    print(PROLOGUE, file=args.outfile)
+    for name, func, inlines, fused, _ in opdefs:
+        if not fused:
+            continue
+        assert 2 <= len(fused) <= MAX_FUSED_PARTS, \
+            f"{name} must fuse 2 to {MAX_FUSED_PARTS} operations"
+        for part in fused:
+            assert part in byte_codes, f"{name}: No operation {part}"
+            assert part not in superinstructions, \
+                f"{name}: Cannot fuse superinstruction {part}"
+        assert not any(part in CONTROL_OPS for part in fused[:-1]), \
+            f"{name}: Only the last operation may transfer control"
+        assert inlines == sum(n_operands[part] for part in fused), \
+            f"{name}: Operand count does not match {'+'.join(fused)}"
+        print(fused_function(name, func, fused, funcs), file=args.outfile)
+    # Superinstructions last, since they call the others
+    for name, func, _, fused, _ in sorted(opdefs, key=lambda op: bool(op[3])):
+        if name not in FAST_OPS:
+            print(fast_function(name, func, fused), file=args.outfile)
+    print(TABLE_START, file=args.outfile)
+    for next_byte_code, (name, func, inlines, fused, comment) \
+            in enumerate(opdefs):
+        if fused:
+            codes = ", ".join(str(byte_codes[part]) for part in fused)
+            parts = f", {len(fused)}, {LB}{codes}{RB}"
+        else:
+            parts = ""
+        print(f'\t {LB} "{name}", {func}, {inlines}{parts} {RB}, //{next_byte_code} {comment}',
               file=args.outfile)
-        next_byte_code += 1
     print(CODA, file=args.outfile)
+    print(FAST_TABLE_START, file=args.outfile)
+    for next_byte_code, (name, *_) in enumerate(opdefs):
+        print(f"\t vm_fast_{name},  //{next_byte_code}", file=args.outfile)
+    print(FAST_TABLE_END, file=args.outfile)
     log.info("Finished bytecode table generation")
 
+
 if __name__ == "__main__":
     main()
 
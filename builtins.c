@@ -188,7 +188,8 @@ struct  class_struct  the_class_Obj_struct = {
                    .healthy_class_tag = HEALTHY,
                    .super = 0,
                    .n_fields = 0,
-                   .object_size = sizeof(struct obj_Obj_struct) },
+                   .object_size = sizeof(struct obj_Obj_struct),
+                   .n_methods = 4 },
         .vtable =
                 {method_Obj_constructor, // constructor
                  method_Obj_string, // STRING
@@ -209,7 +210,8 @@ const class_ref the_class_Obj = &the_class_Obj_struct;
  *    STRING
  *    PRINT
  *    EQUALS
- *    FIXME: (Incomplete for now.)
+ *    LESS
+ *    PLUS
  * ==================
  */
 
@@ -219,6 +221,9 @@ const class_ref the_class_Obj = &the_class_Obj_struct;
  * like Int in Java, not like int in Java).
  * Used by built-in vm methods, not
  * available directly to the interpreted program.
+ * The string object owns s, which must be allocated with
+ * malloc; the garbage collector frees it with the object.
+ * (Constants are never collected, so their text may be static.)
  */
 obj_ref new_string(char *s) {
     obj_String boxed = (obj_String) vm_new_obj(the_class_String);
@@ -231,12 +236,12 @@ obj_ref new_string(char *s) {
  * Quack programs.
  */
 int str_literal_const(char *s_lit) {
-    int const_index = lookup_const_index(s_lit);
+    int const_index = lookup_const_index('s', s_lit);
     if (const_index) {
         return const_index;
     }
     obj_ref boxed = new_string(s_lit);
-    const_index = create_const_value(s_lit, boxed);
+    const_index = create_const_value('s', s_lit, boxed);
     return const_index;
 }
 
@@ -245,7 +250,7 @@ obj_ref native_String_constructor(void ) {
     obj_ref this = vm_fp->obj;
     assert_is_type(this, the_class_String);
     obj_String this_str = (obj_String) this;
-    this_str->text = "";
+    this_str->text = strdup("");  // Owned, as in new_string
     return this;
 }
 
@@ -315,17 +320,65 @@ vm_Word method_String_equals[] = {
 };
 
 
+/* String:less (in code point order) */
+obj_ref native_String_less(void ) {
+    obj_ref this = vm_fp->obj;
+    assert_is_type(this, the_class_String);
+    obj_String this_str = (obj_String) this;
+    obj_ref other = (vm_fp - 1)->obj;
+    assert_is_type(other, the_class_String);
+    obj_String other_str = (obj_String) other;
+    if (strcmp(this_str->text, other_str->text) < 0) {
+        return lit_true;
+    } else {
+        return lit_false;
+    }
+}
+
+vm_Word method_String_less[] = {
+        {.instr = vm_op_enter},
+        {.instr = vm_op_call_native},
+        {.native = native_String_less},
+        {.instr = vm_op_return},
+        {.intval = 1}
+};
+
+/* String:plus (concatenation) */
+obj_ref native_String_plus(void ) {
+    obj_ref this = vm_fp->obj;
+    assert_is_type(this, the_class_String);
+    obj_String this_str = (obj_String) this;
+    obj_ref other = (vm_fp - 1)->obj;
+    assert_is_type(other, the_class_String);
+    obj_String other_str = (obj_String) other;
+    char *s;
+    asprintf(&s, "%s%s", this_str->text, other_str->text);
+    return new_string(s);
+}
+
+vm_Word method_String_plus[] = {
+        {.instr = vm_op_enter},
+        {.instr = vm_op_call_native},
+        {.native = native_String_plus},
+        {.instr = vm_op_return},
+        {.intval = 1}
+};
+
+
 /* The String Class (a singleton) */
 struct  class_struct  the_class_String_struct = {
         .header = {.class_name="String",
                    .healthy_class_tag = HEALTHY,
                    .n_fields = 0,
                    .object_size = sizeof(struct obj_String_struct),
+                   .n_methods = 6,
                    .super=the_class_Obj},
         method_String_constructor,     /* Constructor */
         method_String_string,
         method_String_print,
-        method_String_equals
+        method_String_equals,
+        method_String_less,
+        method_String_plus
 };
 
 class_ref the_class_String = &the_class_String_struct;
@@ -392,7 +445,8 @@ struct  class_struct  the_class_Boolean_struct = {
                    .healthy_class_tag = HEALTHY,
                    .super = the_class_Obj,
                    .n_fields = 0,
-                   .object_size = sizeof (struct obj_Boolean_struct) },
+                   .object_size = sizeof (struct obj_Boolean_struct),
+                   .n_methods = 4 },
         .vtable =
                 {
                  method_Boolean_constructor, // constructor
@@ -476,7 +530,8 @@ struct  class_struct  the_class_Nothing_struct = {
                 .healthy_class_tag = HEALTHY,
                 .super = the_class_Obj,
                 .n_fields = 0,
-                .object_size = sizeof (struct class_Nothing_struct) },
+                .object_size = sizeof (struct class_Nothing_struct),
+                .n_methods = 4 },
         .vtable =
                 {method_Nothing_constructor, // constructor
                  method_Nothing_string, // STRING
@@ -640,6 +695,7 @@ struct  class_struct  the_class_Int_struct = {
                 .super = the_class_Obj,
                 .n_fields = 0,
                 .object_size = sizeof(struct obj_Int_struct),
+                .n_methods = 6
         },
         .vtable = {
                 method_int_constructor,  // constructor
@@ -653,6 +709,22 @@ struct  class_struct  the_class_Int_struct = {
 
 class_ref the_class_Int = &the_class_Int_struct;
 
+/* Boxed small integers, shared by every new_int of their value.
+ * (new Int still allocates, since the constructor sets the value.)
+ */
+static struct obj_Int_struct small_ints[SMALL_INT_MAX - SMALL_INT_MIN + 1];
+long small_int_hits = 0;
+long small_int_misses = 0;
+
+void init_small_ints(void) {
+    for (int n = SMALL_INT_MIN; n <= SMALL_INT_MAX; ++n) {
+        small_ints[n - SMALL_INT_MIN] = (struct obj_Int_struct) {
+                .header = {.clazz = the_class_Int, .tag = GOOD_OBJ_TAG},
+                .value = n
+        };
+    }
+}
+
 /* Construct an integer object containing
  * a particular value  (aka "boxed",
  * like Int in Java, not like int in Java).
@@ -660,6 +732,11 @@ class_ref the_class_Int = &the_class_Int_struct;
  * available directly to the interpreted program.
  */
 obj_ref new_int(int n) {
+    if (SMALL_INT_MIN <= n && n <= SMALL_INT_MAX) {
+        ++small_int_hits;
+        return (obj_ref) &small_ints[n - SMALL_INT_MIN];
+    }
+    ++small_int_misses;
     obj_Int boxed = (obj_Int) vm_new_obj(the_class_Int);
     boxed->value = n;
     return (obj_ref) boxed;
@@ -673,13 +750,13 @@ obj_ref new_int(int n) {
  * e.g., Int.add.
  */
 int int_literal_const(char *n_lit) {
-    int const_index = lookup_const_index(n_lit);
+    int const_index = lookup_const_index('i', n_lit);
     if (const_index) {
         return const_index;
     }
     int as_int = atoi(n_lit);
     obj_ref boxed = new_int(as_int);
-    const_index = create_const_value(n_lit, boxed);
+    const_index = create_const_value('i', n_lit, boxed);
     return const_index;
 }
 
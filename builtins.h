@@ -257,6 +257,22 @@ extern class_ref the_class_Int;
 extern int int_literal_const(char *n_lit);  // Index to constants table
 extern obj_ref new_int(int n);  // An object reference, not a literal
 
+/* Int objects are immutable, so new_int returns a shared object
+ * from a preallocated table for values in this range (which may
+ * be changed when building, e.g., -DSMALL_INT_MAX=4095), and
+ * allocates others.  init_small_ints fills the table; the loader
+ * calls it before creating any constant.
+ */
+#ifndef SMALL_INT_MIN
+#define SMALL_INT_MIN (-128)
+#endif
+#ifndef SMALL_INT_MAX
+#define SMALL_INT_MAX 1023
+#endif
+extern void init_small_ints(void);
+extern long small_int_hits;    // new_int calls answered from the table
+extern long small_int_misses;  // new_int calls that allocated
+
 extern int str_literal_const(char *s_lit); // Index to constants table
 extern obj_ref new_string(char *s);  // An object reference, not a literal
 
@@ -0,0 +1,353 @@
+"""Static linker for the tiny virtual machine.
+
+Starting from a main class, the linker finds every class it
+uses (through the "imports" and "super" of each object file,
+transitively) in the object code library, and combines them
+into a single program image that the virtual machine can load
+in one pass, with no further object files to find and parse:
+
+    python3 link.py Main            # writes Main.tvi
+    bin/tiny_vm Main.tvi
+
+In the image, constants of all classes are in one global pool,
+classes are numbered in the order the virtual machine creates
+them (each after its superclass), and the vtable of each class
+is laid out with the position of each method in one block of
+code.  Built-in classes (whose object files are stubs with no
+code) are listed by name only.
+
+The image is a sequence of little-endian 32-bit integers:
+
+    Header:     magic "TVMI", version, n_strings, string_bytes,
+                n_constants, n_classes, n_code_words, main class
+    Strings:    as in binary object files (see objfile.py)
+    Constants:  n_constants pairs (kind character, string index)
+    Classes:    n_classes records of
+                  (name string index, flags, superclass,
+                   n_fields, n_methods, n_inherited,
+                   n_methods vtable entries)
+                flags is 1 for a built-in class, which has no
+                superclass, fields, or methods in the image.
+                A vtable entry is a word offset in the code,
+                or -1 for a method inherited from the superclass.
+    Code:       n_code_words words of method code, in which
+                constant operands are indexes in the global pool
+                and class operands are indexes in the class list
+    Sections:   zero or more optional sections (tag, n_words, words)
+                that a loader may skip
+
+The greatest stack depth of any method in the image (see objfile.py)
+is in a section tagged "DPTH" of one word, present only if the
+object code of every method gave its depth.
+
+Since the image holds every class the program can instantiate,
+the linker also knows every method a call can reach.  A call
+names the class of its receiver ("call Counter:inc"; the object
+code lists these as "receivers"), so it can only reach the
+method in that slot of the vtable of that class or one of its
+subclasses.  Where all of them have the same method (and it is
+not built in), the linker replaces call with call_direct, whose
+operand is the offset of the method in the code, and likewise
+load_call and const_call with load_call_direct and
+const_call_direct.  The virtual machine then jumps straight to
+the method without looking in the vtable of the receiver.  This
+relies on each receiver being an instance of the class its call
+names, which the compiler ensures; --no-direct-calls leaves every
+call as it was.
+
+The format must agree with vm_load_image in vm_loader.c.
+"""
+
+import argparse
+import logging
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import objfile
+import assemble
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MAGIC = b"TVMI"
+VERSION = 1
+HEADER = struct.Struct("<4s7i")
+BUILTIN = 1   # Class flag
+INHERITED = -1  # Vtable entry
+# Operations whose operand is an index in the imports list
+CLASS_OPERAND_OPS = ["new", "is_instance"]
+
+
+class LinkError(Exception):
+    pass
+
+
+def is_builtin(module: dict) -> bool:
+    """Built-in classes are implemented in the virtual machine;
+    their object files are stubs without code.
+    """
+    return "code" not in module
+
+
+class Linker:
+    """Gathers the classes of a program and lays them out in an image"""
+    def __init__(self, lib: Path, instrs: assemble.InstructionSet):
+        self.lib = lib
+        self.instrs = instrs
+        self.by_code = {defn.code: defn for defn in instrs.ops.values()}
+        self.modules: Dict[str, dict] = {}
+        self.order: List[str] = []   # Superclasses before subclasses
+        self.class_index: Dict[str, int] = {}
+        self.strings = objfile.StringTable()
+        self.constants: Dict[Tuple[str, str], int] = {}
+        self.code: List[int] = []
+        self.vtables: Dict[str, List[int]] = {}
+        # The classes that extend each class directly
+        self.subclasses: Dict[str, List[str]] = {}
+        # (class, slot) -> the result of only_method
+        self.only_methods: Dict[Tuple[str, int], Optional[int]] = {}
+        # Position of each call operand in the code -> the class
+        # it names
+        self.receivers: Dict[int, str] = {}
+        self.main_class = ""
+        # Greatest stack depth of a method, or None if any is unknown
+        self.depth: Optional[int] = 0
+
+    def load(self, class_name: str) -> dict:
+        path = objfile.find(self.lib, class_name)
+        if not path.exists():
+            raise LinkError(f"No object code for {class_name} in {self.lib}")
+        log.debug(f"Reading {path}")
+        return objfile.load(path)
+
+    def visit(self, class_name: str):
+        """Include a class and all the classes it uses"""
+        if class_name in self.modules:
+            return
+        module = self.load(class_name)
+        self.modules[class_name] = module
+        if not is_builtin(module):
+            super_name = module["super"]
+            self.visit(super_name)
+            if super_name not in self.class_index:
+                raise LinkError(f"Circular inheritance: {class_name} "
+                                f"extends {super_name}")
+        self.class_index[class_name] = len(self.order)
+        self.order.append(class_name)
+        for imported in module.get("imports", []):
+            self.visit(imported)
+
+    def constant(self, kind: str, value: str) -> int:
+        """Index of a constant in the global pool"""
+        key = (kind, value)
+        if key not in self.constants:
+            self.constants[key] = len(self.constants)
+        return self.constants[key]
+
+    def relocate_operand(self, op: str, operand: int, module: dict) -> int:
+        if op == "const" and operand >= 0:
+            # (Negative operands are named literals like nothing)
+            constant = module["constants"][operand]
+            return self.constant(constant["kind"], constant["value"])
+        if op in CLASS_OPERAND_OPS:
+            return self.class_index[module["imports"][operand]]
+        return operand
+
+    def relocate(self, words: List[int], module: dict) -> List[int]:
+        """Method code with operands renumbered for the image"""
+        words = list(words)
+        pos = 0
+        while pos < len(words):
+            defn = self.by_code[words[pos]]
+            pos += 1
+            # A superinstruction has the operands of its parts
+            for part in defn.parts or [defn.name]:
+                for _ in range(self.instrs[part].ops):
+                    words[pos] = self.relocate_operand(part, words[pos],
+                                                       module)
+                    pos += 1
+        return words
+
+    def link(self, main_class: str):
+        self.main_class = main_class
+        self.visit(main_class)
+        if is_builtin(self.modules[main_class]):
+            raise LinkError(f"Main class {main_class} is built in")
+        for class_name in self.order:
+            self.subclasses[class_name] = []
+            module = self.modules[class_name]
+            if is_builtin(module):
+                continue
+            self.subclasses[module["super"]].append(class_name)
+            vtable = [INHERITED] * module["n_methods"]
+            for method in module["code"]:
+                start = len(self.code)
+                vtable[method["slot"]] = start
+                self.code += self.relocate(method["code"], module)
+                if "depth" not in method:
+                    self.depth = None
+                elif self.depth is not None:
+                    self.depth = max(self.depth, method["depth"])
+                table = method.get("receivers", [])
+                for i in range(0, len(table), 2):
+                    self.receivers[start + table[i]] = \
+                        module["imports"][table[i + 1]]
+            for slot in range(module["n_inherited"], module["n_methods"]):
+                if vtable[slot] == INHERITED:
+                    log.warning(f"Method {module['methods'][slot]} of "
+                                f"{class_name} is declared but not defined")
+            self.vtables[class_name] = vtable
+        log.info(f"Linked {len(self.order)} classes, "
+                 f"{len(self.constants)} constants, "
+                 f"{len(self.code)} words of code")
+
+    def method_at(self, class_name: str, slot: int) -> Optional[int]:
+        """Code offset of the method in a vtable slot of a class,
+        or None if it is built in or not defined
+        """
+        module = self.modules[class_name]
+        while not is_builtin(module):
+            vtable = self.vtables[class_name]
+            if not 0 <= slot < len(vtable):
+                return None
+            if vtable[slot] != INHERITED:
+                return vtable[slot]
+            if slot >= module["n_inherited"]:
+                return None  # Declared but not defined
+            class_name = module["super"]
+            module = self.modules[class_name]
+        return None
+
+    def only_method(self, class_name: str, slot: int) -> Optional[int]:
+        """Code offset of the one method that a call of a slot
+        on an instance of class_name can reach, or None
+        """
+        key = (class_name, slot)
+        if key not in self.only_methods:
+            self.only_methods[key] = self.find_only_method(class_name, slot)
+        return self.only_methods[key]
+
+    def find_only_method(self, class_name: str, slot: int) -> Optional[int]:
+        """only_method, found by walking down from class_name
+        through its subclasses, each of which must inherit the
+        method or define the same one
+        """
+        if class_name not in self.modules:
+            return None
+        method = self.method_at(class_name, slot)
+        if method is None:
+            return None
+        work = [class_name]
+        while work:
+            for subclass in self.subclasses[work.pop()]:
+                vtable = self.vtables[subclass]
+                if not 0 <= slot < len(vtable):
+                    return None
+                if vtable[slot] == INHERITED:
+                    if slot >= self.modules[subclass]["n_inherited"]:
+                        return None  # Declared but not defined
+                elif vtable[slot] != method:
+                    return None
+                work.append(subclass)
+        return method
+
+    def direct_call(self, defn: assemble.InstructionDef
+                    ) -> Optional[assemble.InstructionDef]:
+        """The operation like defn but with call_direct in place
+        of call, or None if there is none
+        """
+        parts = tuple("call_direct" if part == "call" else part
+                      for part in defn.parts or [defn.name])
+        if len(parts) == 1:
+            return self.instrs.ops.get(parts[0])
+        return self.instrs.fusions.get(parts)
+
+    def devirtualize(self):
+        """Replace calls that can reach only one method with
+        direct calls of that method
+        """
+        n_direct = 0
+        pos = 0
+        while pos < len(self.code):
+            start = pos
+            defn = self.by_code[self.code[pos]]
+            pos += 1
+            for part in defn.parts or [defn.name]:
+                if part == "call" and pos in self.receivers:
+                    method = self.only_method(self.receivers[pos],
+                                              self.code[pos])
+                    direct = self.direct_call(defn)
+                    if method is not None and direct is not None:
+                        self.code[start] = direct.code
+                        self.code[pos] = method
+                        n_direct += 1
+                pos += self.instrs[part].ops
+        log.info(f"{n_direct} of {len(self.receivers)} calls are direct")
+
+    def image(self) -> bytes:
+        classes = []
+        for class_name in self.order:
+            module = self.modules[class_name]
+            name = self.strings(class_name)
+            if is_builtin(module):
+                classes.append(objfile.words([name, BUILTIN, -1, 0, 0, 0]))
+                continue
+            classes.append(objfile.words(
+                [name, 0, self.class_index[module["super"]],
+                 module["n_fields"], module["n_methods"],
+                 module["n_inherited"]] + self.vtables[class_name]))
+        constants = [objfile.words([ord(kind[0]), self.strings(value)])
+                     for kind, value in self.constants]
+        string_table = self.strings.encode()
+        n_strings = len(self.strings.strings)
+        header = HEADER.pack(MAGIC, VERSION,
+                             n_strings, len(string_table) - 4 * n_strings,
+                             len(self.constants), len(self.order),
+                             len(self.code),
+                             self.class_index[self.main_class])
+        sections = []
+        if self.depth is not None:
+            sections.append(objfile.words([objfile.DEPTHS_TAG, 1,
+                                           self.depth]))
+        return (header + string_table + b"".join(constants)
+                + b"".join(classes) + objfile.words(self.code)
+                + b"".join(sections))
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Link a main class and the classes it uses"
+                    " into a program image")
+    parser.add_argument("main_class", help="Name of the main class")
+    parser.add_argument("-L", "--lib", type=Path, default=None,
+                        help="Object code library (default TVMLIB"
+                             " from asm.conf)")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="Image file (default main_class.tvi)")
+    parser.add_argument("--no-direct-calls", action="store_true",
+                        help="Call every method through the vtable")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    lib = args.lib or assemble.CONFIG.tvmlib
+    output = args.output or Path(f"{args.main_class}.tvi")
+    linker = Linker(lib, assemble.INSTRS)
+    try:
+        linker.link(args.main_class)
+        if not args.no_direct_calls:
+            linker.devirtualize()
+    except (LinkError, OSError, ValueError, KeyError, IndexError) as e:
+        log.error(f"Link failed: {e}")
+        sys.exit(1)
+    with open(output, "wb") as f:
+        f.write(linker.image())
+
+
+if __name__ == "__main__":
+    main()
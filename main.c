@@ -1,12 +1,75 @@
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
 #include <assert.h>
 #include <unistd.h>
+#include <time.h>
+#include <sys/resource.h>
 #include "vm_state.h"
+#include "vm_code_table.h"
 #include "vm_loader.h"
+#include "vm_profile.h"
+#include "builtins.h"
+#include "vm_heap.h"
+#include "vm_fast.h"
 #include "logger.h"
 
 #define PATHBUFSIZE 1000
+
+/* Seconds since some fixed time, for -t */
+static double seconds(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+}
+
+/* Peak resident set size in kilobytes, for -t.  On Linux,
+ * getrusage includes memory the process used before exec
+ * (i.e., whatever started us), so we ask /proc for our own.
+ */
+static long peak_rss_kb(void) {
+    FILE *status = fopen("/proc/self/status", "r");
+    if (status) {
+        char line[256];
+        long kb = -1;
+        while (fgets(line, sizeof line, status)) {
+            if (sscanf(line, "VmHWM: %ld kB", &kb) == 1) {
+                break;
+            }
+        }
+        fclose(status);
+        if (kb >= 0) {
+            return kb;
+        }
+    }
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+#ifdef __APPLE__
+    return usage.ru_maxrss / 1024;  // Bytes on MacOS
+#else
+    return usage.ru_maxrss;
+#endif
+}
+
+/* Size in bytes from a number with an optional suffix K, M, or G,
+ * or 0 if it is not one
+ */
+static size_t parse_size(char *text) {
+    char *end;
+    unsigned long long n = strtoull(text, &end, 10);
+    switch (*end) {
+        case 'G': case 'g':
+            n <<= 10;  // Fall through
+        case 'M': case 'm':
+            n <<= 10;  // Fall through
+        case 'K': case 'k':
+            n <<= 10;
+            ++end;
+            break;
+    }
+    return *end ? 0 : (size_t) n;
+}
+
 int main(int argc, char *argv[]) {
     set_log_level(INFO);
     log_info("This is the tiny VM\n");
@@ -15,7 +78,13 @@ int main(int argc, char *argv[]) {
     char load_path[PATHBUFSIZE];
     int ok = 1;
     char *load_library = "./OBJ";
-    while ((opt = getopt(argc, argv, ":DL:")) != -1) {
+    int timing = 0;
+    char *profile_path = 0;
+    char *samples_path = 0;
+    int written = 1;  // The profile and samples asked for, if any
+    int checked = 0;  // Log and check each step (vm_run)
+    int fast = 0;     // Top of stack in a register (vm_run_fast)
+    while ((opt = getopt(argc, argv, ":CDFH:L:tp:s:")) != -1) {
         switch (opt) {
             case 'L':
                 load_library = optarg;
@@ -25,6 +94,31 @@ int main(int argc, char *argv[]) {
                 fprintf(stderr, "Noisy debugging selected with -%c\n", opt);
                 set_log_level(DEBUG);
                 vm_logging = DEBUG;
+                checked = 1;
+                break;
+            case 'C':
+                checked = 1;
+                break;
+            case 'F':
+                fast = 1;
+                break;
+            case 'H':
+                if (parse_size(optarg)) {
+                    vm_heap_init(parse_size(optarg));
+                } else {
+                    fprintf(stderr, "Heap size '%s' is not a size like 64M\n",
+                            optarg);
+                    ok = 0;
+                }
+                break;
+            case 't':
+                timing = 1;
+                break;
+            case 'p':
+                profile_path = optarg;
+                break;
+            case 's':
+                samples_path = optarg;
                 break;
             case ':':
                 fprintf(stderr, "Option %s requires a value\n", optarg);
@@ -37,22 +131,53 @@ int main(int argc, char *argv[]) {
         }
     }
     log_debug("Finished options, load library is %s\n", load_library);
+    double start = seconds();
     if (ok && optind < argc) {
         log_debug("There is at least one non-option argument\n");
         vm_loader_init(load_library);
         for (; ok && optind < argc; ++optind) {
             log_debug("Processing command line argument %d\n", optind);
             main_class = argv[optind];
-            ok = vm_load_class(main_class);
+            if (vm_is_image(main_class)) {
+                ok = vm_load_image(main_class, &main_class);
+            } else {
+                ok = vm_load_class(main_class);
+            }
         }
         vm_loader_set_main(main_class);
     }
+    double loaded = seconds();
     if (ok) {
         log_info("Executing %s\n", main_class);
-        vm_run();
+        if (samples_path) {
+            vm_sample_start();
+        }
+        if (profile_path) {
+            vm_run_profiled();
+            written = vm_profile_write(profile_path);
+        } else if (checked) {
+            vm_run();
+        } else if (fast) {
+            vm_run_fast();
+        } else {
+            vm_run_release();
+        }
+        if (samples_path) {
+            vm_sample_stop();
+            written = vm_samples_write(samples_path) && written;
+        }
         log_info("Ran");
+        if (timing) {
+            // Read by tests/tester.py
+            fprintf(stderr, "time load %.6f run %.6f steps %ld rss %ld\n",
+                    loaded - start, seconds() - loaded, vm_steps,
+                    peak_rss_kb());
+            fprintf(stderr, "small ints %ld allocated ints %ld\n",
+                    small_int_hits, small_int_misses);
+            vm_heap_report(stderr);
+        }
     } else {
         fprintf(stderr, "Errors, will not run\n");
     }
-    return 0;
+    return written ? 0 : 1;
 }
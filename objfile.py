@@ -0,0 +1,270 @@
+"""Object code files for the tiny virtual machine.
+
+Object code for a class is a structure like this (see ObjectCode in
+assemble.py):
+
+    {"class_name": "Looper", "super": "Obj",
+     "imports": ["Looper", "Obj", ...],
+     "methods": [...], "fields": [...], "arities": [0, 0, 0, 1],
+     "n_fields": 0, "n_methods": 4, "n_inherited": 4,
+     "constants": [{"kind": "i", "value": "1"}, ...],
+     "code": [{"name": "$constructor", "slot": 0, "code": [...],
+               "lines": [0, 12, 3, 13, ...],
+               "receivers": [5, 0, 12, 3, ...], "depth": 4}, ...]}
+
+The "lines" of a method are its line table:  pairs of a code
+offset and the line of the assembly source of the code words
+from that offset on, in order of offset, with a pair only where
+the line changes (see line_table).
+Tools use it to attribute execution to source lines; the
+virtual machine does not need it.
+
+The "arities" are the number of arguments of each method, by
+slot, or -1 where unknown (a method declared but never defined).
+The assembler makes a call of a method whose arity it knows into
+a tail call where it can (see asm_optimize.py); the virtual
+machine does not need them.
+
+The "depth" of a method is the greatest number of words it pushes
+on the frame stack above its frame header, locals included (see
+asm_optimize.py).  The fast mode of the virtual machine makes sure
+of that much room when the method is entered.
+
+The "receivers" of a method are pairs of the code offset of the
+operand of a call (a method slot) and the class named in the
+call ("Counter" in "call Counter:inc"), as an index in the
+imports list.  The linker uses them to find calls that can only
+reach one method (see link.py); the virtual machine does not
+need them.
+
+It may be stored as JSON (.json), which is easy to read and debug,
+or in a compact binary format (.tvo), which the loader can use
+directly from memory without parsing.  The binary format is a
+sequence of little-endian 32-bit integers:
+
+    Header:     magic "TVMO", version, class_name, super,
+                n_fields, n_methods, n_inherited,
+                n_strings, string_bytes, n_constants, n_imports,
+                n_code_blocks
+    Strings:    n_strings offsets into the string data, then
+                string_bytes of NUL-terminated UTF-8 text
+                (padded to a whole number of words)
+    Methods:    n_methods string indexes (method names)
+    Fields:     n_fields string indexes (field names)
+    Constants:  n_constants pairs (kind character, string index)
+    Imports:    n_imports string indexes (class names)
+    Code:       n_code_blocks blocks of
+                  (name string index, slot, n_words, n_words words)
+    Sections:   zero or more optional sections (tag, n_words, words)
+                that a loader may skip
+
+The line tables of methods are in a section tagged "LINE", and
+the receivers in a section tagged "RCVR", each with for each code
+block (in order) the number of words of its table followed by
+the table.  The arities are in a section tagged "ARTY", with a
+word for each method, and the depths in a section tagged "DPTH",
+with a word for each code block (in order), -1 where unknown.
+
+Names in the header (class_name, super) are string indexes.  The
+format must agree with the loader in vm_loader.c.
+"""
+
+import json
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional
+
+MAGIC = b"TVMO"
+VERSION = 1
+HEADER = struct.Struct("<4s11i")
+
+# Tags of optional sections holding a table for each method,
+# and the key of the table in the method
+LINES_TAG = struct.unpack("<i", b"LINE")[0]
+RECEIVERS_TAG = struct.unpack("<i", b"RCVR")[0]
+METHOD_SECTIONS = {LINES_TAG: "lines", RECEIVERS_TAG: "receivers"}
+# Tag of the optional section of arities
+ARITIES_TAG = struct.unpack("<i", b"ARTY")[0]
+# Tag of the optional section of stack depths; the loader
+# (vm_loader.c) must agree
+DEPTHS_TAG = struct.unpack("<i", b"DPTH")[0]
+UNKNOWN_DEPTH = -1
+
+# Suffixes of object files, in the order the loader prefers them
+SUFFIXES = [".tvo", ".json"]
+
+
+class StringTable:
+    """Distinct strings, each stored once"""
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def __call__(self, s: str) -> int:
+        if s not in self.index:
+            self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return self.index[s]
+
+    def encode(self) -> bytes:
+        offsets = []
+        data = bytearray()
+        for s in self.strings:
+            offsets.append(len(data))
+            data += s.encode("utf-8") + b"\0"
+        data += b"\0" * (-len(data) % 4)
+        return words(offsets) + bytes(data)
+
+
+def words(values: List[int]) -> bytes:
+    return struct.pack(f"<{len(values)}i", *values)
+
+
+def line_table(lines: Dict[int, int]) -> List[int]:
+    """Compact line table from the source line of each
+    instruction, by code offset:  [offset, line, offset, line...]
+    with an entry only where the line changes.
+    """
+    table: List[int] = []
+    for offset in sorted(lines):
+        if not table or table[-1] != lines[offset]:
+            table += [offset, lines[offset]]
+    return table
+
+
+def receiver_table(receivers: Dict[int, int]) -> List[int]:
+    """Receivers table from the class named by each call,
+    by code offset of its operand:  [offset, class, ...]
+    """
+    table: List[int] = []
+    for offset in sorted(receivers):
+        table += [offset, receivers[offset]]
+    return table
+
+
+def source_line(table: List[int], offset: int) -> Optional[int]:
+    """Source line of the instruction at a code offset,
+    from a line table, or None if there is none
+    """
+    line = None
+    for i in range(0, len(table), 2):
+        if table[i] > offset:
+            break
+        line = table[i + 1]
+    return line
+
+
+def encode(obj: dict) -> bytes:
+    """Binary object code for an object code structure"""
+    strings = StringTable()
+    class_name, super_name = strings(obj["class_name"]), strings(obj["super"])
+    body = [words([strings(name) for name in obj["methods"]]),
+            words([strings(name) for name in obj["fields"]])]
+    for constant in obj["constants"]:
+        body.append(words([ord(constant["kind"][0]),
+                           strings(constant["value"])]))
+    body.append(words([strings(name) for name in obj["imports"]]))
+    for method in obj["code"]:
+        body.append(words([strings(method["name"]), method["slot"],
+                           len(method["code"])] + method["code"]))
+    for tag, key in METHOD_SECTIONS.items():
+        if any(key in method for method in obj["code"]):
+            tables = []
+            for method in obj["code"]:
+                table = method.get(key, [])
+                tables += [len(table)] + table
+            body.append(words([tag, len(tables)] + tables))
+    if "arities" in obj:
+        body.append(words([ARITIES_TAG, len(obj["arities"])]
+                          + obj["arities"]))
+    if any("depth" in method for method in obj["code"]):
+        body.append(words([DEPTHS_TAG, len(obj["code"])]
+                          + [method.get("depth", UNKNOWN_DEPTH)
+                             for method in obj["code"]]))
+    string_table = strings.encode()
+    n_strings = len(strings.strings)
+    header = HEADER.pack(MAGIC, VERSION, class_name, super_name,
+                         obj["n_fields"], obj["n_methods"],
+                         obj["n_inherited"],
+                         n_strings, len(string_table) - 4 * n_strings,
+                         len(obj["constants"]), len(obj["imports"]),
+                         len(obj["code"]))
+    return header + string_table + b"".join(body)
+
+
+def decode(data: bytes) -> dict:
+    """Object code structure from binary object code"""
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated object file")
+    (magic, version, class_name, super_name,
+     n_fields, n_methods, n_inherited,
+     n_strings, string_bytes, n_constants, n_imports,
+     n_code_blocks) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} object file")
+    pos = HEADER.size
+
+    def take(n: int) -> List[int]:
+        nonlocal pos
+        values = list(struct.unpack_from(f"<{n}i", data, pos))
+        pos += 4 * n
+        return values
+
+    offsets = take(n_strings)
+    text = data[pos:pos + string_bytes]
+    pos += string_bytes
+    strings = [text[offset:text.index(b"\0", offset)].decode("utf-8")
+               for offset in offsets]
+    methods = [strings[i] for i in take(n_methods)]
+    fields = [strings[i] for i in take(n_fields)]
+    constants = []
+    for _ in range(n_constants):
+        kind, value = take(2)
+        constants.append({"kind": chr(kind), "value": strings[value]})
+    imports = [strings[i] for i in take(n_imports)]
+    code = []
+    for _ in range(n_code_blocks):
+        name, slot, n_words = take(3)
+        code.append({"name": strings[name], "slot": slot,
+                     "code": take(n_words)})
+    arities = None
+    while pos + 8 <= len(data):
+        tag, n_words = take(2)
+        section = take(n_words)
+        if tag == ARITIES_TAG:
+            arities = section
+        elif tag == DEPTHS_TAG:
+            for method, depth in zip(code, section):
+                if depth != UNKNOWN_DEPTH:
+                    method["depth"] = depth
+        elif tag in METHOD_SECTIONS:
+            for method in code:
+                n_table = section.pop(0)
+                method[METHOD_SECTIONS[tag]] = section[:n_table]
+                del section[:n_table]
+    obj = {"class_name": strings[class_name], "super": strings[super_name],
+           "imports": imports, "methods": methods, "fields": fields,
+           "n_fields": n_fields, "n_methods": n_methods,
+           "n_inherited": n_inherited,
+           "constants": constants, "code": code}
+    if arities is not None:
+        obj["arities"] = arities
+    return obj
+
+
+def load(path: Path) -> dict:
+    """Object code structure from a .json or .tvo file"""
+    if path.suffix == ".tvo":
+        with open(path, "rb") as f:
+            return decode(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def find(lib: Path, class_name: str) -> Path:
+    """The object file for a class, preferring binary as the loader does"""
+    for suffix in SUFFIXES:
+        path = lib.joinpath(class_name).with_suffix(suffix)
+        if path.exists():
+            return path
+    return lib.joinpath(class_name).with_suffix(".json")
@@ -0,0 +1,605 @@
+"""Reference interpreter for tiny vm object code, in Python.
+
+Loads object files written by the assembler (or the structure
+of ObjectCode, without writing it to a file) and executes them
+in the same way as the virtual machine in C:  method code is
+threaded, each operation word being the Python function that
+performs it, and activation records are laid out on a single
+frame stack with the receiver at fp, the return address at fp+1,
+the caller's fp at fp+2, local variables above and arguments
+below.  The operations come from the instruction set in
+opdefs.txt, including superinstructions, which perform their
+parts in order.  The built-in classes Obj, String, Boolean, Int,
+and Nothing are made of the same short method bodies as in
+builtins.c, with native methods written in Python.  String also
+has the less and plus methods listed in OBJ/String.json.
+
+Since nothing is compiled and no process is started, assembling
+and running a class takes only a few milliseconds:
+
+    python3 pyvm.py Main            # like bin/tiny_vm Main
+
+or from Python, with output to any text stream:
+
+    vm = pyvm.Machine(lib, out=buffer)
+    vm.load_module(objcode.struct())
+    vm.run("Main")
+
+The C virtual machine aborts on a failed type check or a call
+of a missing method; here they raise VMError.
+"""
+
+import argparse
+import io
+import logging
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import objfile
+import assemble
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+FRAME_CAPACITY = 1024   # Procedure call stack words, as in vm_state.h
+MAIN_CODE_WORDS = 16    # Room for the main program at address 0
+# Named literals in const operands, as in assemble.NAMED_LITERALS
+CODE_NOTHING = -1
+CODE_FALSE = -2
+CODE_TRUE = -3
+# Operations whose operand is an index in the imports list
+CLASS_OPERAND_OPS = ["new", "is_instance"]
+
+
+class VMError(Exception):
+    """The program did something the virtual machine cannot do"""
+    pass
+
+
+class VMClass:
+    def __init__(self, name: str, super_class: Optional["VMClass"],
+                 n_fields: int, n_methods: int, n_inherited: int = 0):
+        self.name = name
+        self.super = super_class
+        self.n_fields = n_fields
+        # Code addresses of methods; None if not defined
+        self.vtable: List[Optional[int]] = [None] * n_methods
+        for slot in range(n_inherited):
+            self.vtable[slot] = super_class.vtable[slot]
+
+    def __repr__(self):
+        return f"<class {self.name}>"
+
+
+class VMObject:
+    """An object; built-in classes keep a Python value
+    (an int or str) in place of the C struct's hidden field.
+    """
+    __slots__ = ("clazz", "fields", "value")
+
+    def __init__(self, clazz: VMClass, value=None):
+        self.clazz = clazz
+        self.value = value
+        self.fields: List["VMObject"] = []
+
+
+def int32(n: int) -> int:
+    """Wrap around like the int of the C virtual machine"""
+    return (n + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+class Machine:
+    """Classes, code, and the frame stack of one program"""
+
+    def __init__(self, lib: Path,
+                 instrs: assemble.InstructionSet = assemble.INSTRS,
+                 out=None):
+        self.lib = Path(lib)
+        self.out = out or sys.stdout
+        self.code: List = [None] * MAIN_CODE_WORDS
+        self.pc = 0
+        self.fp = 0
+        self.stack: List = []
+        self.running = False
+        self.constants: Dict[tuple, VMObject] = {}
+        self.classes: Dict[str, VMClass] = {}
+        self.dispatch: Dict[int, Callable[[], None]] = {}
+        for defn in instrs.ops.values():
+            self.dispatch[defn.code] = self.operation(defn, instrs)
+        self.instrs = instrs
+        self.by_code = {defn.code: defn for defn in instrs.ops.values()}
+        self.builtin_classes()
+        # Named literals are shared, like the C constants
+        self.named = {CODE_NOTHING: self.nothing,
+                      CODE_FALSE: self.lit_false,
+                      CODE_TRUE: self.lit_true}
+
+    def operation(self, defn: assemble.InstructionDef,
+                  instrs: assemble.InstructionSet) -> Callable[[], None]:
+        """The function that performs an operation"""
+        if defn.parts:
+            parts = tuple(self.operation(instrs[part], instrs)
+                          for part in defn.parts)
+
+            def fused():
+                for part in parts:
+                    part()
+            fused.__name__ = f"op_{defn.name}"
+            return fused
+        perform = getattr(self, f"op_{defn.name}", None)
+        if perform is None:
+            raise VMError(f"No implementation of operation {defn.name}")
+        return perform
+
+    # ---- Loading ----
+
+    def emit(self, words: list) -> int:
+        """Append code words, returning the address of the first"""
+        address = len(self.code)
+        self.code += words
+        return address
+
+    def constant(self, kind: str, value: str) -> VMObject:
+        """Literals are created once and shared"""
+        key = (kind, value)
+        if key not in self.constants:
+            if kind == "i":
+                self.constants[key] = self.new_int(int(value))
+            elif kind == "s":
+                self.constants[key] = self.new_string(value)
+            else:
+                raise VMError(f"Constant of unknown type {kind}")
+        return self.constants[key]
+
+    def find_loaded(self, class_name: str) -> Optional[VMClass]:
+        return self.classes.get(class_name)
+
+    def ensure_loaded(self, class_name: str) -> VMClass:
+        if class_name not in self.classes:
+            log.debug(f"Requires loading {class_name}")
+            path = objfile.find(self.lib, class_name)
+            if not path.exists():
+                raise VMError(f"No object code for {class_name} "
+                              f"in {self.lib}")
+            self.load_module(objfile.load(path))
+        return self.classes[class_name]
+
+    def load_module(self, module: dict) -> VMClass:
+        """Load the structure of an object file,
+        loading the classes it refers to as needed.
+        """
+        class_name = module["class_name"]
+        if "code" not in module:
+            # A stub for a built-in class
+            return self.ensure_builtin(class_name)
+        constants = [self.constant(const["kind"], const["value"])
+                     for const in module["constants"]]
+        the_super = self.ensure_loaded(module["super"])
+        clazz = VMClass(class_name, the_super, module["n_fields"],
+                        module["n_methods"], module["n_inherited"])
+        self.classes[class_name] = clazz
+        # After this class, so that it can refer to itself
+        class_map = [self.ensure_loaded(imported)
+                     for imported in module["imports"]]
+        for method in module["code"]:
+            clazz.vtable[method["slot"]] = self.emit(
+                self.translate(method["code"], constants, class_map,
+                               len(self.code)))
+        return clazz
+
+    def ensure_builtin(self, class_name: str) -> VMClass:
+        clazz = self.find_loaded(class_name)
+        if clazz is None:
+            raise VMError(f"No built-in class {class_name}")
+        return clazz
+
+    def translate(self, words: List[int], constants: List[VMObject],
+                  class_map: List[VMClass], address: int) -> list:
+        """Threaded code for method code from an object file,
+        to be placed at address
+        """
+        code = []
+        pos = 0
+        while pos < len(words):
+            defn = self.by_code[words[pos]]
+            pos += 1
+            code.append(self.dispatch[defn.code])
+            # Operands of a superinstruction are those of its parts
+            for part in defn.parts or [defn.name]:
+                for _ in range(self.instrs[part].ops):
+                    code.append(self.translate_operand(
+                        part, words[pos], constants, class_map, address))
+                    pos += 1
+        return code
+
+    def translate_operand(self, op: str, operand: int,
+                          constants: List[VMObject],
+                          class_map: List[VMClass], address: int):
+        if op == "const":
+            if operand < 0:
+                return self.named[operand]
+            return constants[operand]
+        if op in CLASS_OPERAND_OPS:
+            return class_map[operand]
+        if op == "call_direct":
+            # An offset from the start of the code being translated
+            return address + operand
+        return operand
+
+    # ---- Running ----
+
+    def run(self, main_class: str, max_steps: Optional[int] = None):
+        """Create an instance of the main class, which does
+        all its work in its constructor
+        """
+        clazz = self.ensure_loaded(main_class)
+        self.code[0:6] = [self.op_new, clazz,
+                          self.op_call, 0,    # Constructor
+                          self.op_pop, self.op_halt]
+        self.pc = 0
+        self.fp = 0
+        self.stack = [self.nothing]
+        self.running = True
+        code = self.code
+        if max_steps is None:
+            while self.running:
+                pc = self.pc
+                self.pc = pc + 1
+                code[pc]()
+            return
+        for _ in range(max_steps):
+            pc = self.pc
+            self.pc = pc + 1
+            code[pc]()
+            if not self.running:
+                return
+        raise VMError(f"Stopped after {max_steps} steps")
+
+    def fetch(self):
+        """Next word of code, advancing the program counter"""
+        pc = self.pc
+        self.pc = pc + 1
+        return self.code[pc]
+
+    def pop_bool(self) -> VMObject:
+        cond = self.stack.pop()
+        self.assert_is_type(cond, self.the_class_Boolean)
+        return cond
+
+    # ---- The operations, as in vm_ops.c ----
+
+    def op_halt(self):
+        self.running = False
+
+    def op_const(self):
+        self.stack.append(self.fetch())
+
+    def op_call(self):
+        method_index = self.fetch()
+        stack = self.stack
+        new_fp = len(stack) - 1
+        if new_fp + 2 >= FRAME_CAPACITY:
+            raise VMError("Frame stack overflow")
+        stack.append(self.pc)
+        stack.append(self.fp)
+        self.fp = new_fp
+        receiver = stack[new_fp]
+        method = receiver.clazz.vtable[method_index]
+        if method is None:
+            raise VMError(f"Method {method_index} of class "
+                          f"{receiver.clazz.name} is not defined")
+        self.pc = method
+
+    def op_call_direct(self):
+        method = self.fetch()
+        stack = self.stack
+        new_fp = len(stack) - 1
+        if new_fp + 2 >= FRAME_CAPACITY:
+            raise VMError("Frame stack overflow")
+        stack.append(self.pc)
+        stack.append(self.fp)
+        self.fp = new_fp
+        self.pc = method
+
+    def op_tail_call(self):
+        method_index = self.fetch()
+        caller_arity = self.fetch()
+        callee_arity = self.fetch()
+        stack = self.stack
+        fp = self.fp
+        return_pc, saved_fp = stack[fp + 1], stack[fp + 2]
+        # Arguments and receiver replace those of the caller
+        new_fp = fp - caller_arity + callee_arity
+        stack[fp - caller_arity:] = stack[-callee_arity - 1:]
+        stack.append(return_pc)
+        stack.append(saved_fp)
+        self.fp = new_fp
+        receiver = stack[new_fp]
+        method = receiver.clazz.vtable[method_index]
+        if method is None:
+            raise VMError(f"Method {method_index} of class "
+                          f"{receiver.clazz.name} is not defined")
+        self.pc = method
+
+    def op_call_native(self):
+        native = self.fetch()
+        self.stack.append(native())
+
+    def op_enter(self):
+        pass
+
+    def op_return(self):
+        arity = self.fetch()
+        stack = self.stack
+        fp = self.fp
+        return_value = stack.pop()
+        self.fp = stack[fp + 2]
+        self.pc = stack[fp + 1]
+        del stack[fp - arity + 1:]
+        stack[fp - arity] = return_value
+
+    def op_new(self):
+        clazz = self.fetch()
+        self.stack.append(self.new_obj(clazz))
+
+    def op_pop(self):
+        self.stack.pop()
+
+    def op_alloc(self):
+        self.stack += [self.nothing] * self.fetch()
+
+    def op_load(self):
+        index = self.fetch()
+        self.stack.append(self.stack[self.fp + index])
+
+    def op_store(self):
+        index = self.fetch()
+        self.stack[self.fp + index] = self.stack.pop()
+
+    def op_load_field(self):
+        slot = self.fetch()
+        stack = self.stack
+        stack[-1] = stack[-1].fields[slot]
+
+    def op_store_field(self):
+        slot = self.fetch()
+        target = self.stack.pop()
+        value = self.stack.pop()
+        if slot >= len(target.fields):
+            raise VMError(f"No field {slot} in {target.clazz.name} object")
+        target.fields[slot] = value
+
+    def op_roll(self):
+        k = self.fetch()
+        stack = self.stack
+        stack.append(stack.pop(-1 - k))
+
+    def op_jump(self):
+        span = self.fetch()
+        self.pc += span
+
+    def op_jump_if(self):
+        span = self.fetch()
+        if self.pop_bool() is self.lit_true:
+            self.pc += span
+
+    def op_jump_ifnot(self):
+        span = self.fetch()
+        if self.pop_bool() is self.lit_false:
+            self.pc += span
+
+    def op_is_instance(self):
+        clazz = self.fetch()
+        thing = self.stack.pop()
+        self.stack.append(self.boolean(self.is_instance(thing, clazz)))
+
+    # ---- Objects ----
+
+    def new_obj(self, clazz: VMClass) -> VMObject:
+        thing = VMObject(clazz)
+        thing.fields = [self.nothing] * clazz.n_fields
+        return thing
+
+    def new_int(self, n: int) -> VMObject:
+        return VMObject(self.the_class_Int, int32(n))
+
+    def new_string(self, s: str) -> VMObject:
+        return VMObject(self.the_class_String, s)
+
+    def boolean(self, truth: bool) -> VMObject:
+        return self.lit_true if truth else self.lit_false
+
+    @staticmethod
+    def is_instance(thing: VMObject, clazz: VMClass) -> bool:
+        thing_class = thing.clazz
+        while thing_class is not None:
+            if thing_class is clazz:
+                return True
+            thing_class = thing_class.super
+        return False
+
+    def assert_is_type(self, thing: VMObject, expected: VMClass):
+        if not self.is_instance(thing, expected):
+            raise VMError(f"Type check failure: {thing.clazz.name} "
+                          f"is not subclass of {expected.name}")
+
+    # ---- Built-in classes, as in builtins.c ----
+
+    def native_method(self, native: Callable[[], VMObject],
+                      arity: int) -> int:
+        return self.emit([self.op_enter,
+                          self.op_call_native, native,
+                          self.op_return, arity])
+
+    def this(self, expected: VMClass) -> VMObject:
+        this = self.stack[self.fp]
+        self.assert_is_type(this, expected)
+        return this
+
+    def other(self, expected: VMClass) -> VMObject:
+        other = self.stack[self.fp - 1]
+        self.assert_is_type(other, expected)
+        return other
+
+    def builtin_classes(self):
+        def builtin(name: str, super_class: Optional[VMClass],
+                    methods: List[int]) -> VMClass:
+            clazz = VMClass(name, super_class, 0, len(methods))
+            clazz.vtable[:] = methods
+            self.classes[name] = clazz
+            return clazz
+
+        # Obj
+        obj_constructor = self.emit([self.op_enter, self.op_return, 0])
+        obj_print = self.emit([self.op_enter,
+                               self.op_load, 0,
+                               self.op_call, 1,   # string method
+                               self.op_call, 2,   # String:print
+                               self.op_return, 0])
+
+        def obj_string():
+            this = self.this(self.the_class_Obj)
+            return self.new_string(f"<Object at 0x{id(this):#x}>")
+
+        def obj_equals():
+            this = self.this(self.the_class_Obj)
+            other = self.other(self.the_class_Obj)
+            return self.boolean(this is other)
+
+        obj_equals_method = self.emit([self.op_enter,
+                                       self.op_load, 0,
+                                       self.op_load, -1,
+                                       self.op_call_native, obj_equals,
+                                       self.op_return, 1])
+        self.the_class_Obj = builtin("Obj", None, [
+            obj_constructor, self.native_method(obj_string, 0),
+            obj_print, obj_equals_method])
+
+        # Nothing, Boolean, and their singletons
+        self.the_class_Nothing = builtin("Nothing", self.the_class_Obj, [
+            self.native_method(lambda: self.nothing, 0),
+            self.native_method(lambda: self.constant("s", "nothing"), 0),
+            obj_print, obj_equals_method])
+        self.nothing = VMObject(self.the_class_Nothing)
+
+        def boolean_string():
+            this = self.stack[self.fp]
+            if this is self.lit_true:
+                return self.constant("s", "true")
+            if this is self.lit_false:
+                return self.constant("s", "false")
+            return self.constant("s", "!!!BOGUS BOOLEAN")
+
+        self.the_class_Boolean = builtin("Boolean", self.the_class_Obj, [
+            self.native_method(lambda: self.lit_false, 0),
+            self.native_method(boolean_string, 0),
+            obj_print, obj_equals_method])
+        # The object code library calls it Bool
+        self.classes["Bool"] = self.the_class_Boolean
+        self.lit_false = VMObject(self.the_class_Boolean, 0)
+        self.lit_true = VMObject(self.the_class_Boolean, -1)
+
+        # String
+        def string_constructor():
+            this = self.this(self.the_class_String)
+            this.value = ""
+            return this
+
+        def string_print():
+            this = self.this(self.the_class_String)
+            self.out.write(this.value)
+            return self.nothing
+
+        def string_equals():
+            this = self.this(self.the_class_String)
+            other = self.other(self.the_class_String)
+            return self.boolean(this.value == other.value)
+
+        def string_less():
+            this = self.this(self.the_class_String)
+            other = self.other(self.the_class_String)
+            return self.boolean(this.value < other.value)
+
+        def string_plus():
+            this = self.this(self.the_class_String)
+            other = self.other(self.the_class_String)
+            return self.new_string(this.value + other.value)
+
+        string_string = self.emit([self.op_enter,
+                                   self.op_load, 0,
+                                   self.op_return, 0])
+        self.the_class_String = builtin("String", self.the_class_Obj, [
+            self.native_method(string_constructor, 0), string_string,
+            self.native_method(string_print, 0),
+            self.native_method(string_equals, 1),
+            self.native_method(string_less, 1),
+            self.native_method(string_plus, 1)])
+
+        # Int
+        def int_constructor():
+            this = self.this(self.the_class_Int)
+            this.value = 0
+            return this
+
+        def int_string():
+            return self.new_string(str(self.this(self.the_class_Int).value))
+
+        def int_equals():
+            this = self.this(self.the_class_Int)
+            other = self.other(self.the_class_Int)
+            return self.boolean(this.value == other.value)
+
+        def int_less():
+            this = self.this(self.the_class_Int)
+            other = self.other(self.the_class_Int)
+            return self.boolean(this.value < other.value)
+
+        def int_plus():
+            this = self.this(self.the_class_Int)
+            other = self.other(self.the_class_Int)
+            return self.new_int(this.value + other.value)
+
+        self.the_class_Int = builtin("Int", self.the_class_Obj, [
+            self.native_method(int_constructor, 0),
+            self.native_method(int_string, 0),
+            obj_print,
+            self.native_method(int_equals, 1),
+            self.native_method(int_less, 1),
+            self.native_method(int_plus, 1)])
+
+
+def run_class(main_class: str, lib: Path,
+              max_steps: Optional[int] = None) -> str:
+    """Output of running a main class from the object code library"""
+    out = io.StringIO()
+    Machine(lib, out=out).run(main_class, max_steps)
+    return out.getvalue()
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Run object code in the reference interpreter")
+    parser.add_argument("main_class", help="Name of the main class")
+    parser.add_argument("-L", "--lib", type=Path, default=None,
+                        help="Object code library (default TVMLIB"
+                             " from asm.conf)")
+    parser.add_argument("--max-steps", type=int, default=None,
+                        help="Stop after this many operations")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    lib = args.lib or assemble.CONFIG.tvmlib
+    try:
+        Machine(lib).run(args.main_class, args.max_steps)
+    except (VMError, OSError, ValueError, KeyError) as e:
+        log.error(f"{args.main_class}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
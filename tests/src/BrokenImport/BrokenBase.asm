@@ -0,0 +1,13 @@
+#  A project with a class that cannot be assembled:
+#  it calls a method it does not define.
+.class BrokenBase:Obj
+.method $constructor
+    enter
+    load $
+    return 0
+
+.method speak
+    enter
+    load $
+    call $:nosuch
+    return 0
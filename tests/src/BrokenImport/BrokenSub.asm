@@ -0,0 +1,7 @@
+#  Extends BrokenBase, so it cannot be assembled either,
+#  although there is nothing wrong with it.
+.class BrokenSub:BrokenBase
+.method $constructor
+    enter
+    load $
+    return 0
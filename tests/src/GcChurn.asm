@@ -0,0 +1,54 @@
+# Garbage in a loop, many times the size of the heap when run with
+# a small heap (-H):  a Counter, a String, and boxed Ints on every
+# iteration.  A Counter and a String made before the loop must
+# survive every collection.
+.class GcChurn:Obj
+.method $constructor
+.local i,keep,kept,s
+    enter
+    const 0
+    new Counter
+    call Counter:$constructor
+    store keep
+    const "!"
+    const "kept"
+    call String:plus
+    store kept
+    const 0
+    store i
+loop:
+    const 60000
+    load i
+    call Int:less
+    jump_ifnot done
+    load i
+    new Counter
+    call Counter:$constructor
+    pop
+    load keep
+    call Counter:inc
+    pop
+    const "tail"
+    const "head"
+    call String:plus
+    store s
+    const 1
+    load i
+    call Int:plus
+    store i
+    jump loop
+done:
+    load keep
+    call Counter:print
+    pop
+    const " "
+    call String:print
+    pop
+    load kept
+    call String:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
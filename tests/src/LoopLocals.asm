@@ -0,0 +1,47 @@
+# Local step is last used at the head of the loop, before t is
+# stored in the body, but the jump back to the head keeps step
+# live while t is, so with -O (see compact_locals in
+# asm_optimize.py) they must not share a frame slot.
+.class LoopLocals:Obj
+.method $constructor
+.local i,step,t
+    enter
+    const 0
+    store i
+    const 3
+    store step
+loop:
+    load step
+    load i
+    call Int:plus
+    store i
+    const 10
+    load i
+    call Int:less
+    jump_ifnot done
+    const 1000
+    load i
+    call Int:plus
+    store t         # step is not dead here: it is used next time around
+    const "i = "
+    call String:print
+    pop
+    load i
+    call Int:print
+    pop
+    const ", t = "
+    call String:print
+    pop
+    load t
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    jump loop
+done:
+    const "Exit loop\n"
+    call String:print
+    pop
+    const nothing
+    return 0
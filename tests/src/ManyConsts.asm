@@ -0,0 +1,253 @@
+# More distinct constants than the loader once had room for
+# in a class (30), some used more than once, and an integer
+# and a string with the same text, which are different constants.
+#
+.class ManyConsts:Obj
+
+.method $constructor
+    enter
+    const "alpha "
+    call String:print
+    pop
+    const 0
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "beta "
+    call String:print
+    pop
+    const 1
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "gamma "
+    call String:print
+    pop
+    const 2
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "delta "
+    call String:print
+    pop
+    const 3
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "epsilon "
+    call String:print
+    pop
+    const 4
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "zeta "
+    call String:print
+    pop
+    const 5
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "eta "
+    call String:print
+    pop
+    const 6
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "theta "
+    call String:print
+    pop
+    const 7
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "iota "
+    call String:print
+    pop
+    const 8
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "kappa "
+    call String:print
+    pop
+    const 9
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "lambda "
+    call String:print
+    pop
+    const 10
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "mu "
+    call String:print
+    pop
+    const 11
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "nu "
+    call String:print
+    pop
+    const 12
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "xi "
+    call String:print
+    pop
+    const 13
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "omicron "
+    call String:print
+    pop
+    const 14
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "pi "
+    call String:print
+    pop
+    const 15
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "rho "
+    call String:print
+    pop
+    const 16
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "sigma "
+    call String:print
+    pop
+    const 17
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "tau "
+    call String:print
+    pop
+    const 18
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "upsilon "
+    call String:print
+    pop
+    const 19
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "phi "
+    call String:print
+    pop
+    const 20
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "chi "
+    call String:print
+    pop
+    const 21
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "psi "
+    call String:print
+    pop
+    const 22
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "omega "
+    call String:print
+    pop
+    const 23
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "alpha "
+    call String:print
+    pop
+    const "beta "
+    call String:print
+    pop
+    const "gamma "
+    call String:print
+    pop
+    const "delta "
+    call String:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 5
+    call Int:print
+    pop
+    const " "
+    call String:print
+    pop
+    const "5"
+    call String:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const nothing
+    return 0
@@ -0,0 +1,45 @@
+# Loop as a naive compiler might generate it, with the
+# patterns the assembler's -O pass simplifies:  conditional
+# jumps around unconditional jumps, jumps to jumps, jumps to
+# the next instruction, unreachable code, and temporaries
+# stored only to be loaded again.
+.class NaiveLoop:Obj
+.method $constructor
+.local i,t
+    enter
+    const 0
+    store i
+    jump test
+test:
+    const 5
+    load i
+    call Int:less
+    store t         # temporary, used once
+    load t
+    jump_if body
+    jump exit
+body:
+    load i
+    call Int:print
+    pop
+    const " "
+    call String:print
+    pop
+    const 1
+    load i
+    call Int:plus
+    store t
+    load t
+    store i
+    jump again
+    const "never printed\n"
+    call String:print
+    pop
+again:
+    jump test
+exit:
+    const "\n"
+    call String:print
+    pop
+    const nothing
+    return 0
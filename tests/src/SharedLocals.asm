@@ -0,0 +1,40 @@
+# Locals each used only after the one before is dead, so with
+# -O (see compact_locals in asm_optimize.py) all three share one
+# frame slot.  Each value is printed from its own local.
+.class SharedLocals:Obj
+.method $constructor
+.local a,b,c
+    enter
+    const 1
+    store a
+    const "a = "
+    call String:print
+    pop
+    load a
+    call Int:print
+    pop
+    const 10
+    load a
+    call Int:plus
+    store b         # a is dead from here
+    const "\nb = a + 10 = "
+    call String:print
+    pop
+    load b
+    call Int:print
+    pop
+    const 100
+    load b
+    call Int:plus
+    store c         # b is dead from here
+    const "\nc = b + 100 = "
+    call String:print
+    pop
+    load c
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const nothing
+    return 0
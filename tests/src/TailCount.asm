@@ -0,0 +1,52 @@
+# Recursion in tail position:  each call of sum is followed by
+# return, so the assembler makes it a tail_call that reuses the
+# frame of the caller.  Without that, 20000 nested activations
+# would overflow the frame stack.  The last call, of report,
+# takes fewer arguments than sum, so the frame shrinks.
+.class TailCount:Obj
+.method sum forward
+.method $constructor
+    enter
+    const 1
+    const 0
+    load $
+    call $:sum
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
+
+.method report
+.args total
+    enter
+    const "Sum is "
+    call String:print
+    pop
+    load total
+    return 1
+
+# acc + i + (i+1) + ... + 20000
+.method sum
+.args i,acc
+    enter
+    const 20001
+    load i
+    call Int:less
+    jump_ifnot done
+    const 1
+    load i
+    call Int:plus
+    load i
+    load acc
+    call Int:plus
+    load $
+    call $:sum
+    return 2
+done:
+    load acc
+    load $
+    call $:report
+    return 2
@@ -1,13 +1,43 @@
-"""Simple test script for Ori (tiny vm) asm files.
+"""Test script for Ori (tiny vm) asm files.
 (Extend later to work with Quack compilation)
 
-FIXME: There must be better ways to handle file dependencies
+Each case in src/TESTS.csv names a class and an action: "assemble"
+(the class must assemble), "run" (it must also run, printing
+expect/Class_stdout.txt), or "reject" (the project of classes in
+directory src/Class must fail to assemble with --project, writing
+no object code), and optionally options for the virtual machine,
+like "-H 1M" for a small heap (the reference interpreter ignores
+them), or "-O" to assemble the class with the assembler's
+optimizer.  Classes that other cases import, like
+Counter, are assembled once into OBJ before the cases start.
+Each case then gets its own scratch directory, scratch/Class,
+with its own asm.conf, opdefs.txt, and OBJ (holding links to the
+shared object files), so that cases can be assembled and run at
+the same time in a pool of workers:
+
+    python3 tester.py -j 32 --timeout 10 --json report.json
+    python3 tester.py --fast     # the virtual machine's fast mode (-F)
+    python3 tester.py -O         # every case assembled with -O
+
+The report gives the outcome of each case and the wall time of
+each phase:  assembling, loading (the virtual machine reports
+this with -t), and running.  Observed output is written to out/.
 """
-import subprocess
+import argparse
+import concurrent.futures
+import csv
+import filecmp
+import io
+import json
+import os
 import pathlib
+import re
+import shlex
 import shutil
-import filecmp
-import csv
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Set, Tuple
 
 import logging
 import sys
@@ -24,6 +54,42 @@ ASM = f"{ROOT}/assemble.py"
 VM = f"{ROOT}/bin/tiny_vm"
 BUILTINS = ["Bool.json", "Int.json", "Nothing.json", "Obj.json", "String.json"]
 ASMREQS = ["asm.conf", "opdefs.txt"]
+SCRATCH = pathlib.Path("scratch")
+DEFAULT_TIMEOUT = 30  # Seconds for each phase of a case
+
+# Printed on stderr by the virtual machine with -t
+TIMES_PAT = re.compile(r"^time load ([0-9.]+) run ([0-9.]+)", re.MULTILINE)
+
+# Outcomes of a case
+PASS = "pass"
+FAIL = "fail"        # Ran, but not with the expected output
+ERROR = "error"      # Assembler or virtual machine failed
+TIMEOUT = "timeout"
+
+# Actions of a case in TESTS.csv
+ACTIONS = ["assemble", "run", "reject"]
+# Options of a case that are for the assembler, not the virtual machine
+ASM_OPTIONS = ["-O"]
+
+
+class CaseResult:
+    """Outcome and phase times (in seconds) of one case"""
+    def __init__(self, class_name: str, action: str):
+        self.class_name = class_name
+        self.action = action
+        self.status = PASS
+        self.message = ""
+        self.times: Dict[str, float] = {}
+
+    def fail(self, status: str, message: str):
+        self.status = status
+        self.message = message
+
+    def json(self) -> dict:
+        return {"class": self.class_name, "action": self.action,
+                "status": self.status, "message": self.message,
+                "times": self.times}
+
 
 def install_prereqs():
     """Copy pre-requisite files.
@@ -40,73 +106,368 @@ def install_prereqs():
         log.debug(f"Copying {origin} to {copied}")
         shutil.copyfile(origin, copied)
 
-def assemble(class_name: str) -> bool:
-    """Translate src/Class.asm to OBJ/Class.json.
-    Separated because some classes (e.g., Counter) cannot
-    be run as main programs.  (Main program class constructors
-    cannot have arguments.)
+
+def source_path(class_name: str) -> pathlib.Path:
+    return pathlib.Path("./src/" + class_name + ".asm")
+
+
+def project_path(name: str) -> pathlib.Path:
+    return pathlib.Path("./src/" + name)
+
+
+def written_objects(lib: pathlib.Path, before: Set[str]) -> List[str]:
+    """Object files in lib that are not in before"""
+    return sorted(path.name for path in lib.iterdir()
+                  if path.suffix in [".json", ".tvo"]
+                  and not path.name.startswith(".")
+                  and path.name not in before)
+
+
+def import_tools():
+    """The assembler and reference interpreter, imported from ROOT
+    (after install_prereqs, since the assembler reads asm.conf and
+    opdefs.txt as it is imported).
     """
-    src = pathlib.Path("./src/" + class_name + ".asm")
-    obj = pathlib.Path("./OBJ/" + class_name + ".json")
-    try:
-        proc = subprocess.run([PY, ASM, src, obj], text=True)
-        proc.check_returncode() # May throw CalledProcessError
-    except subprocess.CalledProcessError:
-        log.warning(f"Assembler crashed on {src}")
-        return False
-    return True
-
-
-def test_class(class_name: str) -> bool:
-    """Assemble, run, and check a single test case
-    for a class C, in src/C.asm, with expected output
-    in expect/C_stdout.txt.  Returns True iff test case
-    has expected outcome.
+    sys.path.insert(0, str(pathlib.Path(ROOT).resolve()))
+    import assemble
+    import pyvm
+    assemble.log.setLevel(logging.WARNING)
+    return argparse.Namespace(assemble=assemble, pyvm=pyvm)
+
+
+def shared_classes(cases: List[dict], tools) -> List[str]:
+    """Classes of test cases that other cases import, each
+    after the classes it imports
+    """
+    names = {case["Class"] for case in cases}
+    references: Dict[str, Set[str]] = {}
+    for name in names:
+        defined = tools.assemble.ProjectClass(source_path(name))
+        references[name] = defined.references & names
+    wanted = set().union(*references.values())
+    ordered: List[str] = []
+
+    def visit(name: str, path: Set[str]):
+        if name in ordered or name in path:
+            return  # (An import cycle fails when assembled)
+        for imported in sorted(references[name]):
+            visit(imported, path | {name})
+        ordered.append(name)
+
+    for name in sorted(wanted):
+        visit(name, set())
+    return ordered
+
+
+def assemble_shared(shared: List[str], tools,
+                    optimize: bool = False) -> Set[str]:
+    """Assemble shared classes into OBJ; returns those that failed.
+    (Without the build cache, which would not notice a change to the
+    assembler itself.)
     """
-    ok = True
+    failed = set()
+    for class_name in shared:
+        obj = pathlib.Path("./OBJ/" + class_name + ".json")
+        try:
+            tools.assemble.assemble_file(source_path(class_name), obj,
+                                         use_cache=False, optimize=optimize)
+        except Exception as e:
+            log.warning(f"Assembler crashed on shared class {class_name}: {e}")
+            failed.add(class_name)
+    return failed
+
+
+def make_scratch(class_name: str, shared: List[str]) -> pathlib.Path:
+    """A fresh directory to assemble and run one case in"""
+    scratch = SCRATCH.joinpath(class_name)
+    shutil.rmtree(scratch, ignore_errors=True)
+    lib = scratch.joinpath("OBJ")
+    lib.mkdir(parents=True)
+    for asmreq in ASMREQS:
+        shutil.copyfile(asmreq, scratch.joinpath(asmreq))
+    for objfile in BUILTINS + [f"{name}.json" for name in shared]:
+        if objfile != f"{class_name}.json":
+            os.symlink(pathlib.Path("OBJ", objfile).resolve(),
+                       lib.joinpath(objfile))
+    return scratch
+
+
+def check_output(result: CaseResult, observed: pathlib.Path):
+    expected = pathlib.Path("expect/" + result.class_name + "_stdout.txt")
+    if not expected.exists():
+        result.fail(FAIL, f"No expected output {expected}")
+    elif not filecmp.cmp(observed, expected, shallow=False):
+        result.fail(FAIL, "Output did not match expectation")
+
+
+def split_options(options: List[str]) -> Tuple[List[str], List[str]]:
+    """Options of a case for the assembler, and for the virtual machine"""
+    return ([option for option in options if option in ASM_OPTIONS],
+            [option for option in options if option not in ASM_OPTIONS])
+
+
+def run_case(class_name: str, action: str, shared: List[str],
+             timeout: float, asm_options: List[str],
+             vm_options: List[str]) -> CaseResult:
+    """Assemble and perhaps run one case in its scratch directory"""
+    result = CaseResult(class_name, action)
+    scratch = make_scratch(class_name, shared)
+    if action == "reject":
+        return reject_project(result, scratch, timeout)
+    src = source_path(class_name).resolve()
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([PY, pathlib.Path(ASM).resolve(), "--no-cache"]
+                              + asm_options + [src, f"OBJ/{class_name}.json"],
+                              cwd=scratch, capture_output=True, text=True,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result.fail(TIMEOUT, f"Assembler took more than {timeout}s")
+        return result
+    finally:
+        result.times["assemble"] = time.perf_counter() - start
+    if proc.returncode != 0:
+        result.fail(ERROR, f"Assembler crashed:\n{proc.stderr}")
+        return result
+    if action == "assemble":
+        return result
     observed_stdout = pathlib.Path("out/" + class_name + "_stdout.txt")
     observed_stderr = pathlib.Path("out/" + class_name + "_stderr.txt")
-    expect_stdout = pathlib.Path("expect/" + class_name + "_stdout.txt")
-    if not assemble(class_name):
-        return False
+    start = time.perf_counter()
     try:
-        std_out = open(observed_stdout, "w")
-        std_err = open(observed_stderr, "w")
-        proc = subprocess.run([VM, class_name], text=True,
-                              stdout=std_out, stderr=std_err)
-        proc.check_returncode() # May throw CalledProcessError
-        if filecmp.cmp(observed_stdout, expect_stdout):
-            log.info(f"OK: {class_name} produced expected output")
-        else:
-            log.info(f"{class_name} output did not match expectation")
-            ok = False
-    except subprocess.CalledProcessError:
-        log.warning(f"Crashed: {proc.args}")
-        ok = False
-    return ok
+        with open(observed_stdout, "w") as std_out, \
+                open(observed_stderr, "w") as std_err:
+            proc = subprocess.run([pathlib.Path(VM).resolve(), "-t"]
+                                  + vm_options + [class_name],
+                                  cwd=scratch, text=True, timeout=timeout,
+                                  stdout=std_out, stderr=std_err)
+    except subprocess.TimeoutExpired:
+        result.fail(TIMEOUT, f"Virtual machine took more than {timeout}s")
+        result.times["run"] = time.perf_counter() - start
+        return result
+    elapsed = time.perf_counter() - start
+    times = TIMES_PAT.search(observed_stderr.read_text())
+    if times:
+        result.times["load"] = float(times.group(1))
+        result.times["run"] = float(times.group(2))
+    else:
+        result.times["run"] = elapsed
+    if proc.returncode != 0:
+        result.fail(ERROR, f"Crashed with status {proc.returncode}:"
+                           f" see {observed_stderr}")
+        return result
+    check_output(result, observed_stdout)
+    return result
+
+
+def reject_project(result: CaseResult, scratch: pathlib.Path,
+                   timeout: float) -> CaseResult:
+    """Assembling the project must fail, writing no object code"""
+    lib = scratch.joinpath("OBJ")
+    before = set(written_objects(lib, set()))
+    src = project_path(result.class_name).resolve()
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([PY, pathlib.Path(ASM).resolve(),
+                               "--project", src, "--no-cache"],
+                              cwd=scratch, capture_output=True, text=True,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result.fail(TIMEOUT, f"Assembler took more than {timeout}s")
+        return result
+    finally:
+        result.times["assemble"] = time.perf_counter() - start
+    written = written_objects(lib, before)
+    if proc.returncode == 0:
+        result.fail(FAIL, "Assembler accepted the project")
+    elif proc.returncode != 1:
+        result.fail(ERROR, f"Assembler crashed:\n{proc.stderr}")
+    elif written:
+        result.fail(FAIL, f"Assembler wrote {', '.join(written)}")
+    return result
+
+
+def run_case_in_process(class_name: str, action: str, tools,
+                        optimize: bool = False) -> CaseResult:
+    """Assemble and perhaps run one case in this process, with the
+    reference interpreter.  Cases share OBJ, and nothing limits
+    how long they run.
+    """
+    result = CaseResult(class_name, action)
+    if action == "reject":
+        return reject_project_in_process(result, tools)
+    obj = pathlib.Path("./OBJ/" + class_name + ".json")
+    start = time.perf_counter()
+    try:
+        tools.assemble.assemble_file(source_path(class_name), obj,
+                                     use_cache=False, optimize=optimize)
+    except Exception as e:
+        result.fail(ERROR, f"Assembler crashed: {e}")
+        return result
+    finally:
+        result.times["assemble"] = time.perf_counter() - start
+    if action == "assemble":
+        return result
+    pyvm = tools.pyvm
+    out = io.StringIO()
+    error = ""
+    start = time.perf_counter()
+    try:
+        vm = pyvm.Machine(pathlib.Path("OBJ"), out=out)
+        vm.ensure_loaded(class_name)
+        loaded = time.perf_counter()
+        result.times["load"] = loaded - start
+        vm.run(class_name)
+        result.times["run"] = time.perf_counter() - loaded
+    except (pyvm.VMError, OSError, ValueError, KeyError) as e:
+        error = f"{e}\n"
+    observed_stdout = pathlib.Path("out/" + class_name + "_stdout.txt")
+    observed_stdout.write_text(out.getvalue())
+    pathlib.Path("out/" + class_name + "_stderr.txt").write_text(error)
+    if error:
+        result.fail(ERROR, f"Crashed: {error.strip()}")
+        return result
+    check_output(result, observed_stdout)
+    return result
+
+
+def reject_project_in_process(result: CaseResult, tools) -> CaseResult:
+    """Assembling the project into OBJ must fail, writing no object code"""
+    lib = pathlib.Path("OBJ")
+    project = project_path(result.class_name)
+    # Left in the shared OBJ by an earlier run, they would go unnoticed
+    for source in tools.assemble.project_sources([str(project)]):
+        for suffix in [".json", ".tvo"]:
+            lib.joinpath(source.stem + suffix).unlink(missing_ok=True)
+    before = set(written_objects(lib, set()))
+    start = time.perf_counter()
+    try:
+        accepted = tools.assemble.assemble_project(
+            [str(project)], use_cache=False)
+    except Exception as e:
+        result.fail(ERROR, f"Assembler crashed: {e}")
+        return result
+    finally:
+        result.times["assemble"] = time.perf_counter() - start
+    written = written_objects(lib, before)
+    if accepted:
+        result.fail(FAIL, "Assembler accepted the project")
+    elif written:
+        result.fail(FAIL, f"Assembler wrote {', '.join(written)}")
+    return result
+
+
+def write_json(results: List[CaseResult], path: pathlib.Path, meta: dict):
+    summary = {status: 0 for status in [PASS, FAIL, ERROR, TIMEOUT]}
+    for result in results:
+        summary[result.status] += 1
+    report = dict(meta, summary=summary,
+                  cases=[result.json() for result in results])
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def write_junit(results: List[CaseResult], path: pathlib.Path, meta: dict):
+    suite = ET.Element("testsuite", name="tiny_vm", tests=str(len(results)),
+                       failures=str(sum(r.status == FAIL for r in results)),
+                       errors=str(sum(r.status in [ERROR, TIMEOUT]
+                                      for r in results)),
+                       time=f"{meta['wall']:.6f}")
+    for result in results:
+        case = ET.SubElement(suite, "testcase", classname=result.action,
+                             name=result.class_name,
+                             time=f"{sum(result.times.values()):.6f}")
+        properties = ET.SubElement(case, "properties")
+        for phase, seconds in result.times.items():
+            ET.SubElement(properties, "property", name=phase,
+                          value=f"{seconds:.6f}")
+        if result.status == FAIL:
+            ET.SubElement(case, "failure", message=result.message)
+        elif result.status != PASS:
+            ET.SubElement(case, "error", type=result.status,
+                          message=result.message)
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(description="Run the test cases")
+    parser.add_argument("cases", nargs="*",
+                        help="Classes to test (default all in TESTS.csv)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Cases to run at once (default one per core)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Seconds allowed to assemble, and to run,"
+                             f" each case (default {DEFAULT_TIMEOUT})")
+    parser.add_argument("--json", type=pathlib.Path, default=None,
+                        help="Write a JSON report to this file")
+    parser.add_argument("--junit", type=pathlib.Path, default=None,
+                        help="Write a JUnit XML report to this file")
+    parser.add_argument("--pyvm", action="store_true",
+                        help="Assemble and run in this process, one case"
+                             " at a time, with the reference interpreter")
+    parser.add_argument("--fast", action="store_true",
+                        help="Run the virtual machine in fast mode (-F)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="Assemble every case with the optimizer (-O)")
+    return parser.parse_args()
 
 
 def main():
-    """Stub"""
+    args = cli()
     install_prereqs()
-    with open("src/TESTS.csv") as cases:
-        case_reader = csv.DictReader(cases)
-        for case in case_reader:
-            class_name = case["Class"]
-            action = case["Action"]
-            if action == "assemble":
-                # Assemble but do not execute
-                log.info(f"Class '{class_name} -- assemble only")
-                ok = assemble(class_name)
-            elif action == "run":
-                log.info(f"Class '{class_name} -- assemble and run")
-                ok = test_class(class_name)
-            else:
-                log.error(f"Unrecognized action '{action}' for class {class_name}")
-            if not ok:
-                print(f"*** Failed test case: {action} {class_name}", file=sys.stderr)
+    tools = import_tools()
+    with open("src/TESTS.csv") as f:
+        cases = list(csv.DictReader(f))
+    for case in cases:
+        if case["Action"] not in ACTIONS:
+            log.error(f"Unrecognized action '{case['Action']}'"
+                      f" for class {case['Class']}")
+    cases = [case for case in cases if case["Action"] in ACTIONS]
+    started = time.perf_counter()
+    shared = shared_classes([case for case in cases
+                             if case["Action"] != "reject"], tools)
+    failed_shared = assemble_shared(shared, tools, args.optimize)
+    if args.cases:
+        cases = [case for case in cases if case["Class"] in args.cases]
+    results: List[Optional[CaseResult]] = [None] * len(cases)
+    options = [split_options(shlex.split(case.get("Options") or ""))
+               for case in cases]
+    if args.optimize:
+        options = [(["-O"], vm_options) for _, vm_options in options]
+    if args.pyvm:
+        for i, case in enumerate(cases):
+            results[i] = run_case_in_process(case["Class"], case["Action"],
+                                             tools, "-O" in options[i][0])
+    else:
+        usable = [name for name in shared if name not in failed_shared]
+        fast = ["-F"] if args.fast else []
+        with concurrent.futures.ThreadPoolExecutor(args.jobs) as pool:
+            futures = {pool.submit(run_case, case["Class"], case["Action"],
+                                   usable, args.timeout, options[i][0],
+                                   options[i][1] + fast): i
+                       for i, case in enumerate(cases)}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+    for result in results:
+        if result.status == PASS:
+            log.info(f"OK: {result.action} {result.class_name}")
+        else:
+            log.info(f"{result.class_name}: {result.message}")
+            print(f"*** Failed test case: {result.action} {result.class_name}"
+                  f" ({result.status})", file=sys.stderr)
+    meta = {"jobs": 1 if args.pyvm else args.jobs,
+            "vm": ("pyvm" if args.pyvm
+                   else "tiny_vm -F" if args.fast else "tiny_vm"),
+            "optimize": args.optimize,
+            "wall": time.perf_counter() - started}
+    if args.json:
+        write_json(results, args.json, meta)
+    if args.junit:
+        write_junit(results, args.junit, meta)
     # FIXME: Add a check for omitted source files
     print("Testing complete")
+    sys.exit(0 if all(result.status == PASS for result in results) else 1)
 
 
 if __name__ == "__main__":
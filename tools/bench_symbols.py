@@ -0,0 +1,85 @@
+"""
+Time the assembler on generated classes with many local
+variables or many methods, to check that assembly time
+grows linearly with the number of symbols.
+
+Run from anywhere; the assembler is imported from the
+parent directory, with its asm.conf and opdefs.txt.
+"""
+
+import argparse
+import io
+import logging
+import os
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+import assemble  # noqa: E402
+
+assemble.log.setLevel(logging.WARNING)
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Benchmark assembler symbol tables")
+    parser.add_argument("sizes", nargs="*", type=int,
+                        default=[1250, 2500, 5000, 10000],
+                        help="Numbers of locals and of methods to try")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Best of this many runs (default 3)")
+    return parser.parse_args()
+
+
+def many_locals(n: int) -> str:
+    """One method that stores and loads each of n locals"""
+    names = [f"v{i}" for i in range(n)]
+    lines = [".class Locals:Obj", ".method $constructor",
+             f".local {','.join(names)}", "    enter"]
+    for name in names:
+        lines += [f"    const {len(name)}", f"    store {name}"]
+    for name in names:
+        lines += [f"    load {name}", "    pop"]
+    lines += ["    load $", "    return 0"]
+    return "\n".join(lines) + "\n"
+
+
+def many_methods(n: int) -> str:
+    """n methods, each calling the one before it and a field"""
+    lines = [".class Methods:Obj", ".field f"]
+    for i in range(n):
+        lines += [f".method m{i}", "    enter",
+                  "    load $", f"    call $:m{max(i - 1, 0)}", "    pop",
+                  "    load $", "    load_field $:f", "    pop",
+                  "    const nothing", "    return 0"]
+    return "\n".join(lines) + "\n"
+
+
+def best_time(source: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        assemble.reset_imports()
+        start = time.perf_counter()
+        assemble.translate(io.StringIO(source))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    args = cli()
+    print(f"{'symbols':>8} {'locals (s)':>11} {'us/local':>9}"
+          f" {'methods (s)':>12} {'us/method':>10}")
+    for n in args.sizes:
+        t_locals = best_time(many_locals(n), args.repeat)
+        t_methods = best_time(many_methods(n), args.repeat)
+        print(f"{n:8d} {t_locals:11.3f} {1e6 * t_locals / n:9.1f}"
+              f" {t_methods:12.3f} {1e6 * t_methods / n:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
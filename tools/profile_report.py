@@ -0,0 +1,102 @@
+"""
+Report on a profile written by the virtual machine with -p:
+
+    bin/tiny_vm -p profile.json Main
+    python3 tools/profile_report.py profile.json -L OBJ
+
+The virtual machine identifies a method by its class and vtable
+slot; the method names are found in the object files of the
+library.  Prints the hottest methods (by self time, with calls,
+operations executed, and time including callees) and the most
+frequently dispatched operations.
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+from typing import Dict, List
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import objfile  # noqa: E402
+
+# The built-in Boolean class is described by Bool.json
+OBJECT_FILE_NAMES = {"Boolean": "Bool"}
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Summarize a tiny vm profile")
+    parser.add_argument("profile", type=pathlib.Path,
+                        help="JSON profile written by tiny_vm -p")
+    parser.add_argument("-L", "--lib", type=pathlib.Path,
+                        default=pathlib.Path("OBJ"),
+                        help="Object code library (default OBJ)")
+    parser.add_argument("-n", "--top", type=int, default=15,
+                        help="Rows in each table (default 15)")
+    parser.add_argument("--sort", default="self_time",
+                        choices=["self_time", "total_time", "calls", "ops"],
+                        help="Order of the methods table (default self_time)")
+    return parser.parse_args()
+
+
+def method_names(lib: pathlib.Path, class_name: str) -> List[str]:
+    """Method names of a class by vtable slot, or [] if its
+    object file cannot be found
+    """
+    name = OBJECT_FILE_NAMES.get(class_name, class_name)
+    path = objfile.find(lib, name)
+    if not path.exists():
+        return []
+    return objfile.load(path).get("methods", [])
+
+
+def method_label(names: Dict[str, List[str]], lib: pathlib.Path,
+                 class_name: str, slot: int) -> str:
+    if slot < 0:
+        return "(main)"
+    if class_name not in names:
+        names[class_name] = method_names(lib, class_name)
+    methods = names[class_name]
+    if slot < len(methods):
+        return f"{class_name}:{methods[slot]}"
+    return f"{class_name}:[{slot}]"
+
+
+def main():
+    args = cli()
+    with open(args.profile) as f:
+        profile = json.load(f)
+    run_time = profile["run_time"] or 1e-12
+    steps = profile["steps"] or 1
+    print(f"{profile['steps']} operations in {profile['run_time']:.6f}s"
+          f" ({profile['steps'] / run_time / 1e6:.2f} Mops/s)")
+
+    names: Dict[str, List[str]] = {}
+    methods = sorted(profile["methods"], key=lambda m: m[args.sort],
+                     reverse=True)
+    print()
+    print(f"{'method':32} {'calls':>9} {'ops':>10} {'self (s)':>10}"
+          f" {'self %':>7} {'total (s)':>10}")
+    for method in methods[:args.top]:
+        label = method_label(names, args.lib, method["class"],
+                             method["slot"])
+        print(f"{label:32} {method['calls']:9d} {method['ops']:10d}"
+              f" {method['self_time']:10.6f}"
+              f" {100 * method['self_time'] / run_time:6.1f}%"
+              f" {method['total_time']:10.6f}")
+
+    opcodes = sorted((op for op in profile["opcodes"] if op["count"]),
+                     key=lambda op: op["count"], reverse=True)
+    print()
+    print(f"{'operation':20} {'count':>10} {'%':>7}")
+    for op in opcodes[:args.top]:
+        print(f"{op['name']:20} {op['count']:10d}"
+              f" {100 * op['count'] / steps:6.1f}%")
+    if profile.get("unknown_ops"):
+        print(f"{'(unknown)':20} {profile['unknown_ops']:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Report on samples written by the virtual machine with -s:
+
+    bin/tiny_vm -s samples.json Main
+    python3 tools/sample_report.py samples.json -L OBJ > main.folded
+    python3 tools/sample_report.py samples.json -L OBJ --annotate src
+
+By default, prints the samples as collapsed stacks, one line per
+distinct stack ("Main:$constructor;Counter:inc 12"), the input of
+flamegraph.pl and similar tools; with --lines each frame also has
+the source line it was executing.  With --annotate, prints each
+assembly source file (found among the given files and directories
+by its .class declaration) with the percentage of samples on each
+line:  "self" where the line was executing, and "total" where it
+was executing or waiting for a call to return.
+
+Each sample address is the method (class and vtable slot) and
+the offset in its code of the next instruction, or of the return
+address in a caller, so we attribute it to the instruction just
+before.  Source lines come from the line tables in object files.
+"""
+
+import argparse
+import collections
+import json
+import pathlib
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import objfile  # noqa: E402
+from profile_report import OBJECT_FILE_NAMES  # noqa: E402
+
+CLASS_PAT = re.compile(r"^\s*\.class\s+(\w+)")
+
+# A frame is (class name, method name, source line or None)
+Frame = Tuple[str, str, Optional[int]]
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Summarize tiny vm samples")
+    parser.add_argument("samples", type=pathlib.Path,
+                        help="JSON samples written by tiny_vm -s")
+    parser.add_argument("-L", "--lib", type=pathlib.Path,
+                        default=pathlib.Path("OBJ"),
+                        help="Object code library (default OBJ)")
+    parser.add_argument("--lines", action="store_true",
+                        help="Include source lines in collapsed stacks")
+    parser.add_argument("--annotate", nargs="+", type=pathlib.Path,
+                        metavar="SOURCE",
+                        help="Annotate these .asm files (or the .asm files"
+                             " in these directories)")
+    return parser.parse_args()
+
+
+class Library:
+    """Method names and line tables from object files"""
+    def __init__(self, lib: pathlib.Path):
+        self.lib = lib
+        self.modules: Dict[str, dict] = {}
+
+    def module(self, class_name: str) -> dict:
+        if class_name not in self.modules:
+            name = OBJECT_FILE_NAMES.get(class_name, class_name)
+            path = objfile.find(self.lib, name)
+            self.modules[class_name] = (objfile.load(path) if path.exists()
+                                        else {})
+        return self.modules[class_name]
+
+    def frame(self, class_name: str, slot: int, offset: int) -> Frame:
+        if slot < 0:
+            return ("", "(main)", None)
+        module = self.module(class_name)
+        methods = module.get("methods", [])
+        name = methods[slot] if slot < len(methods) else f"[{slot}]"
+        line = None
+        for method in module.get("code", []):
+            if method["slot"] == slot:
+                line = objfile.source_line(method.get("lines", []),
+                                           max(offset - 1, 0))
+        return (class_name, name, line)
+
+
+def stacks(samples: dict, library: Library) -> List[List[Frame]]:
+    """Each sample as frames, outermost first"""
+    methods = samples["methods"]
+    result = []
+    for sample in samples["samples"]:
+        frames = []
+        for i in range(0, len(sample), 2):
+            index, offset = sample[i], sample[i + 1]
+            if index < 0:
+                frames.append(("", "(unknown)", None))
+                continue
+            method = methods[index]
+            frames.append(library.frame(method["class"], method["slot"],
+                                        offset))
+        result.append(list(reversed(frames)))
+    return result
+
+
+def frame_label(frame: Frame, lines: bool) -> str:
+    class_name, method, line = frame
+    label = f"{class_name}:{method}" if class_name else method
+    if lines and line is not None:
+        label += f":{line}"
+    return label
+
+
+def collapsed(all_stacks: List[List[Frame]], lines: bool):
+    counts = collections.Counter(
+        ";".join(frame_label(frame, lines) for frame in stack)
+        for stack in all_stacks)
+    for stack, count in sorted(counts.items()):
+        print(f"{stack} {count}")
+
+
+def source_files(paths: List[pathlib.Path]) -> Dict[str, pathlib.Path]:
+    """The source file declaring each class"""
+    files = []
+    for path in paths:
+        files += sorted(path.glob("*.asm")) if path.is_dir() else [path]
+    sources = {}
+    for path in files:
+        with open(path) as f:
+            for line in f:
+                match = CLASS_PAT.match(line)
+                if match:
+                    sources[match.group(1)] = path
+                    break
+    return sources
+
+
+def annotate(all_stacks: List[List[Frame]], paths: List[pathlib.Path]):
+    self_counts = collections.Counter()
+    total_counts = collections.Counter()
+    for stack in all_stacks:
+        located = [(class_name, line) for class_name, _, line in stack
+                   if line is not None]
+        if stack and stack[-1][2] is not None:
+            self_counts[(stack[-1][0], stack[-1][2])] += 1
+        for place in set(located):
+            total_counts[place] += 1
+    n = len(all_stacks) or 1
+    sampled = {class_name for class_name, _ in total_counts}
+    for class_name, path in sorted(source_files(paths).items()):
+        if class_name not in sampled:
+            continue
+        print(f"==> {path} ({class_name})")
+        print(f"{'self':>6} {'total':>6}")
+        with open(path) as f:
+            for line_num, text in enumerate(f, start=1):
+                place = (class_name, line_num)
+                if place in total_counts:
+                    counts = (f"{100 * self_counts[place] / n:5.1f}%"
+                              f" {100 * total_counts[place] / n:5.1f}%")
+                else:
+                    counts = " " * 13
+                print(f"{counts} {line_num:5d}  {text.rstrip()}")
+        print()
+
+
+def main():
+    args = cli()
+    with open(args.samples) as f:
+        samples = json.load(f)
+    all_stacks = stacks(samples, Library(args.lib))
+    if samples.get("dropped"):
+        print(f"{samples['dropped']} samples were dropped", file=sys.stderr)
+    if args.annotate:
+        annotate(all_stacks, args.annotate)
+    else:
+        collapsed(all_stacks, args.lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,32 @@
 
 #include "vm_state.h"
 #include "vm_ops.h"
+#include "vm_fast.h"
 
+#define MAX_FUSED_PARTS 3  // Must match build_bytecode_table.py
+
+/* A superinstruction performs a sequence of (n_parts) other
+ * operations, given by their byte codes in parts, whose operands
+ * are its operands.  For other operations n_parts is 0.
+ */
 typedef struct {
     char *name;
     vm_Instr instr;
     int n_operands;
+    int n_parts;
+    int parts[MAX_FUSED_PARTS];
 } op_tbl_entry;
 
 extern op_tbl_entry vm_op_bytecodes[];
 
+/* The fast version of each operation (see vm_fast.h), by
+ * byte code, generated with the table
+ */
+extern vm_Instr vm_fast_bytecodes[];
+
+/* Like vm_run, but without logging or checking anything
+ * between operations (generated with the table)
+ */
+extern void vm_run_release(void);
+
 #endif //TINY_VM_VM_CODE_TABLE_H
@@ -45,6 +45,7 @@ struct class_header_struct {
     class_ref super;  // Needed for typecase
     int n_fields;     // Redundant but convenient for debugging
     int object_size;  // Malloc this much before calling constructor
+    int n_methods;    // Length of the vtable
 };
 
 
@@ -0,0 +1,243 @@
+/*
+ * Fast versions of the operations, with the top of the stack in
+ * vm_tos (see vm_fast.h).  Each has the stack effect of the
+ * operation of the same name in vm_ops.c.
+ */
+#include "vm_fast.h"
+#include "vm_state.h"
+#include "vm_code_table.h"
+#include "vm_loader.h"
+#include "builtins.h"
+#include "logger.h"
+#include <stdlib.h>
+#include <assert.h>
+
+/* ---------- Unchecked stack primitives ---------- */
+
+static inline vm_Word fetch(void) {
+    return *vm_pc++;
+}
+
+static inline void push(vm_Word w) {
+    *vm_sp = vm_tos;
+    ++vm_sp;
+    vm_tos = w;
+}
+
+static inline vm_Word pop(void) {
+    vm_Word w = vm_tos;
+    --vm_sp;
+    vm_tos = *vm_sp;
+    return w;
+}
+
+/* A local variable or argument may be the top of the stack */
+static inline vm_Word get_local(int index) {
+    vm_addr slot = vm_fp + index;
+    return slot == vm_sp ? vm_tos : *slot;
+}
+
+static inline void set_local(int index, vm_Word w) {
+    vm_addr slot = vm_fp + index;
+    if (slot == vm_sp) {
+        vm_tos = w;
+    } else {
+        *slot = w;
+    }
+}
+
+/* Room needed on entering a method:  its frame header and what
+ * the deepest loaded method pushes (set by vm_run_fast)
+ */
+static int headroom = FAST_FRAME_HEADROOM;
+
+/* The stack bounds check, once per method entry */
+static inline void need_room(int words) {
+    if (vm_sp + words >= vm_frame_stack + FRAME_CAPACITY) {
+        log_error("Frame stack overflow");
+        exit(1);
+    }
+}
+
+/* Push a frame for a call of the method at method_addr, whose
+ * receiver is on top of the stack.  The whole stack is then in
+ * memory, with the saved frame pointer on top.
+ */
+static inline void enter_frame(vm_addr method_addr) {
+    need_room(headroom);
+    *vm_sp = vm_tos;
+    vm_addr new_fp = vm_sp;
+    vm_sp[1] = (vm_Word) {.code_addr = vm_pc};
+    vm_sp[2] = (vm_Word) {.frame_addr = vm_fp};
+    vm_sp += 2;
+    vm_tos = *vm_sp;
+    vm_fp = new_fp;
+    vm_pc = method_addr;
+}
+
+
+/* ---------- Operations ---------- */
+
+void vm_fast_const(void) {
+    push((vm_Word) {.obj = get_const_value(fetch().intval)});
+}
+
+void vm_fast_call(void) {
+    int method_index = fetch().intval;
+    enter_frame(vm_tos.obj->header.clazz->vtable[method_index]);
+}
+
+void vm_fast_call_direct(void) {
+    enter_frame(fetch().code_addr);
+}
+
+void vm_fast_call_native(void) {
+    vm_Native m = fetch().native;
+    push((vm_Word) {.obj = m(*vm_fp)});
+}
+
+void vm_fast_enter(void) {
+}
+
+void vm_fast_return(void) {
+    int arity = fetch().intval;
+    // The return value stays in vm_tos
+    vm_addr fp = vm_fp;
+    vm_pc = fp[1].code_addr;
+    vm_fp = fp[2].frame_addr;
+    vm_sp = fp - arity;
+}
+
+void vm_fast_new(void) {
+    // May collect garbage, which finds the top of the stack in vm_tos
+    obj_ref new_thing = vm_new_obj(fetch().clazz);
+    push((vm_Word) {.obj = new_thing});
+}
+
+void vm_fast_pop(void) {
+    --vm_sp;
+    vm_tos = *vm_sp;
+}
+
+void vm_fast_alloc(void) {
+    int n = fetch().intval;
+    need_room(n + headroom);
+    for (int i = 0; i < n; ++i) {
+        push((vm_Word) {.obj = nothing});
+    }
+}
+
+void vm_fast_load(void) {
+    push(get_local(fetch().intval));
+}
+
+void vm_fast_store(void) {
+    int index = fetch().intval;
+    set_local(index, pop());
+}
+
+void vm_fast_load_field(void) {
+    int field_slot = fetch().intval;
+    vm_tos.obj = vm_tos.obj->fields[field_slot];
+}
+
+void vm_fast_store_field(void) {
+    int field_slot = fetch().intval;
+    obj_ref target_obj = pop().obj;
+    target_obj->fields[field_slot] = pop().obj;
+}
+
+void vm_fast_jump(void) {
+    int span = fetch().intval;
+    vm_pc += span;
+}
+
+void vm_fast_jump_if(void) {
+    int span = fetch().intval;
+    if (pop().obj == lit_true) {
+        vm_pc += span;
+    }
+}
+
+void vm_fast_jump_ifnot(void) {
+    int span = fetch().intval;
+    if (pop().obj == lit_false) {
+        vm_pc += span;
+    }
+}
+
+
+/* ---------- Switching code to the fast operations ---------- */
+
+/* Byte code of an operation from its function, usual or
+ * fast, or -1
+ */
+static int opcode_of(vm_Instr instr) {
+    for (int i = 0; vm_op_bytecodes[i].name; ++i) {
+        if (vm_op_bytecodes[i].instr == instr
+            || vm_fast_bytecodes[i] == instr) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+/* Switch the operations of code from pc to end to their fast
+ * versions, or if end is 0, through the first return or halt.
+ */
+static void translate(vm_addr pc, vm_addr end) {
+    while (end == 0 || pc < end) {
+        int opcode = opcode_of(pc->instr);
+        assert(opcode >= 0);
+        op_tbl_entry *op = &vm_op_bytecodes[opcode];
+        pc->instr = vm_fast_bytecodes[opcode];
+        pc += 1 + op->n_operands;
+        if (end == 0 && (op->instr == vm_op_return
+                         || op->instr == vm_op_halt)) {
+            return;
+        }
+    }
+}
+
+/* The main sequence, loaded methods, and built-in methods
+ * (which are outside the chunks of loaded code).  A built-in
+ * method is a straight line of operations ending with return.
+ */
+static void translate_all(void) {
+    translate(vm_code_block, 0);
+    for (int i = 0; i < vm_n_code_chunks(); ++i) {
+        vm_addr end;
+        vm_addr start = vm_code_chunk(i, &end);
+        if (start == vm_code_block) {
+            start += MAIN_CODE_WORDS;
+        }
+        translate(start, end);
+    }
+    for (int i = 0; i < vm_n_loaded_classes(); ++i) {
+        class_ref clazz = vm_loaded_class(i);
+        for (int slot = 0; slot < clazz->header.n_methods; ++slot) {
+            vm_addr method = clazz->vtable[slot];
+            if (method && ! vm_is_loaded_code(method)) {
+                translate(method, 0);
+            }
+        }
+    }
+}
+
+void vm_run_fast(void) {
+    // The return address and saved frame pointer, then the method
+    int deepest = 2 + vm_max_stack_depth();
+    if (deepest > headroom) {
+        headroom = deepest;
+    }
+    translate_all();
+    vm_tos = *vm_sp;
+    vm_run_state = VM_RUNNING;
+    while (vm_run_state == VM_RUNNING) {
+        vm_Instr instr = vm_pc->instr;
+        ++vm_pc;
+        instr();
+        ++vm_steps;
+    }
+    *vm_sp = vm_tos;
+}
@@ -0,0 +1,54 @@
+/* Fast execution (tiny_vm -F)
+ *
+ * In fast mode the value on top of the evaluation stack is kept
+ * in the register vm_tos rather than at vm_sp, so an operation
+ * that replaces the top (like load_field) or pops it (like
+ * store or jump_if) need not touch the frame stack for it.  The
+ * word at vm_sp is then stale:  vm_tos is its value.
+ *
+ * Each operation has a fast version that keeps the top of the
+ * stack that way.  Those below are written by hand, without
+ * health checks or assertions on the objects they move; the
+ * others are generated (see build_bytecode_table.py) to store
+ * vm_tos at vm_sp, perform the usual operation, and take the new
+ * top back into vm_tos.  Instead of checking the stack pointer
+ * on each push, we check once on entering a method (and on
+ * alloc) that there is room for as many words as the deepest
+ * loaded method pushes (vm_max_stack_depth, from the assembler),
+ * and at least FAST_FRAME_HEADROOM, which covers the built-in
+ * methods and object code that does not give its depth.
+ *
+ * vm_run_fast switches the code of every loaded method, and of
+ * the built-in methods, to the fast versions before running, so
+ * the other run loops cannot be used after it.
+ */
+
+#ifndef TINY_VM_VM_FAST_H
+#define TINY_VM_VM_FAST_H
+
+#include "vm_core.h"
+
+/* Least room checked for on entering a method */
+#define FAST_FRAME_HEADROOM 64
+
+extern void vm_fast_const(void);
+extern void vm_fast_call(void);
+extern void vm_fast_call_direct(void);
+extern void vm_fast_call_native(void);
+extern void vm_fast_enter(void);
+extern void vm_fast_return(void);
+extern void vm_fast_new(void);
+extern void vm_fast_pop(void);
+extern void vm_fast_alloc(void);
+extern void vm_fast_load(void);
+extern void vm_fast_store(void);
+extern void vm_fast_load_field(void);
+extern void vm_fast_store_field(void);
+extern void vm_fast_jump(void);
+extern void vm_fast_jump_if(void);
+extern void vm_fast_jump_ifnot(void);
+
+/* Like vm_run_release, with the fast versions of the operations */
+extern void vm_run_fast(void);
+
+#endif //TINY_VM_VM_FAST_H
@@ -0,0 +1,323 @@
+/*
+ * Managed heap:  bump allocation in chunks, mark-sweep collection.
+ *
+ * Each chunk has two bitmaps with a bit for each granule (the
+ * unit of alignment of objects):  the granules where an object
+ * starts, and, during a collection, the starts of objects found
+ * to be live.  Sweeping clears the start bits of dead objects,
+ * so free space is whatever lies between live objects, and we
+ * allocate by bumping a pointer through one such hole at a
+ * time.  The start bits also tell the collector whether a word
+ * of the frame stack is the address of an object.
+ */
+#include "vm_heap.h"
+#include "vm_state.h"
+#include "builtins.h"
+#include "logger.h"
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+#include <time.h>
+#include <assert.h>
+
+#define GRANULE 8   // Bytes; objects are multiples of this
+#define CHUNK_GRANULES (HEAP_CHUNK_BYTES / GRANULE)
+#define BITMAP_WORDS (CHUNK_GRANULES / 64)
+
+struct chunk {
+    char *base;                     // HEAP_CHUNK_BYTES of objects
+    uint64_t starts[BITMAP_WORDS];  // Granules where an object starts
+    uint64_t marks[BITMAP_WORDS];   // Starts of objects found live
+};
+
+/* Chunks in order of address, so we can find one by bisection */
+static struct chunk **chunks = 0;
+static int n_chunks = 0;
+static int chunks_capacity = 0;
+static size_t max_heap_bytes = DEFAULT_HEAP_BYTES;
+
+/* The hole we are allocating in, and where to look for the next */
+static char *free_ptr = 0;
+static char *free_limit = 0;
+static int alloc_chunk = 0;     // Index in chunks
+static size_t alloc_pos = 0;    // Granule in that chunk
+
+/* Objects found live and not yet traced */
+static obj_ref *mark_stack = 0;
+static size_t mark_depth = 0;
+static size_t mark_capacity = 0;
+
+static struct {
+    long collections;
+    double pause_total;
+    double pause_max;
+    size_t allocated;   // Bytes, over the whole run
+    size_t freed;       // Bytes
+    size_t live;        // Bytes after the last collection
+} stats;
+
+static double seconds(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+}
+
+static size_t round_up(size_t size) {
+    return (size + GRANULE - 1) & ~(size_t) (GRANULE - 1);
+}
+
+static int test_bit(const uint64_t *bits, size_t g) {
+    return (bits[g / 64] >> (g % 64)) & 1;
+}
+
+static void set_bit(uint64_t *bits, size_t g) {
+    bits[g / 64] |= (uint64_t) 1 << (g % 64);
+}
+
+/* First granule at or after g where an object starts,
+ * or CHUNK_GRANULES if none
+ */
+static size_t next_start(struct chunk *c, size_t g) {
+    size_t w = g / 64;
+    if (w >= BITMAP_WORDS) {
+        return CHUNK_GRANULES;
+    }
+    uint64_t bits = c->starts[w] & (~(uint64_t) 0 << (g % 64));
+    while (! bits) {
+        if (++w == BITMAP_WORDS) {
+            return CHUNK_GRANULES;
+        }
+        bits = c->starts[w];
+    }
+    return w * 64 + __builtin_ctzll(bits);
+}
+
+static obj_ref object_at(struct chunk *c, size_t g) {
+    return (obj_ref) (c->base + g * GRANULE);
+}
+
+static size_t object_bytes(obj_ref obj) {
+    return round_up(obj->header.clazz->header.object_size);
+}
+
+static void add_chunk(void) {
+    if (n_chunks == chunks_capacity) {
+        chunks_capacity = chunks_capacity ? 2 * chunks_capacity : 16;
+        chunks = realloc(chunks, chunks_capacity * sizeof(struct chunk *));
+        assert(chunks);
+    }
+    struct chunk *c = calloc(1, sizeof(struct chunk));
+    assert(c);
+    c->base = aligned_alloc(GRANULE, HEAP_CHUNK_BYTES);
+    if (! c->base) {
+        log_error("Out of memory for the heap");
+        exit(1);
+    }
+    int i = n_chunks++;
+    while (i > 0 && chunks[i - 1]->base > c->base) {
+        chunks[i] = chunks[i - 1];
+        --i;
+    }
+    chunks[i] = c;
+    log_debug("Heap grows to %d chunks", n_chunks);
+}
+
+static int can_grow(void) {
+    return (size_t) (n_chunks + 1) * HEAP_CHUNK_BYTES <= max_heap_bytes;
+}
+
+void vm_heap_init(size_t max_bytes) {
+    max_heap_bytes = max_bytes < HEAP_CHUNK_BYTES ? HEAP_CHUNK_BYTES
+                                                  : max_bytes;
+}
+
+/* Move to the next hole of at least size bytes, from where the
+ * last one ended.  Return 0 if there is none.
+ */
+static int find_hole(size_t size) {
+    size_t granules = size / GRANULE;
+    while (alloc_chunk < n_chunks) {
+        struct chunk *c = chunks[alloc_chunk];
+        size_t g = alloc_pos;
+        while (g < CHUNK_GRANULES) {
+            size_t end = next_start(c, g);
+            if (end - g >= granules) {
+                free_ptr = c->base + g * GRANULE;
+                free_limit = c->base + end * GRANULE;
+                alloc_pos = end;
+                return 1;
+            }
+            // Skip the hole (too small) and the object after it
+            g = end < CHUNK_GRANULES
+                ? end + object_bytes(object_at(c, end)) / GRANULE
+                : end;
+        }
+        ++alloc_chunk;
+        alloc_pos = 0;
+    }
+    return 0;
+}
+
+/* Restart the search for holes from the beginning of the heap */
+static void rewind_holes(void) {
+    free_ptr = free_limit = 0;
+    alloc_chunk = 0;
+    alloc_pos = 0;
+}
+
+/* Find room for size bytes, collecting or growing if we must */
+static void refill(size_t size) {
+    if (find_hole(size)) {
+        return;
+    }
+    if (n_chunks == 0) {
+        add_chunk();
+        rewind_holes();
+        if (find_hole(size)) {
+            return;
+        }
+    }
+    vm_gc();
+    // Keep the heap at most half full, so we need not collect often
+    while (can_grow()
+           && 2 * stats.live > (size_t) n_chunks * HEAP_CHUNK_BYTES) {
+        add_chunk();
+    }
+    rewind_holes();
+    while (! find_hole(size)) {
+        if (! can_grow()) {
+            log_error("Heap exhausted: %zu bytes live in %d chunks "
+                      "(use -H for a larger heap)", stats.live, n_chunks);
+            exit(1);
+        }
+        add_chunk();
+        rewind_holes();
+    }
+}
+
+obj_ref vm_heap_alloc(size_t size) {
+    size = round_up(size);
+    assert(size <= HEAP_CHUNK_BYTES);
+    if (free_limit - free_ptr < (ptrdiff_t) size) {
+        refill(size);
+    }
+    char *p = free_ptr;
+    free_ptr += size;
+    struct chunk *c = chunks[alloc_chunk];
+    set_bit(c->starts, (p - c->base) / GRANULE);
+    memset(p, 0, size);
+    stats.allocated += size;
+    return (obj_ref) p;
+}
+
+
+/* ---------- Collection ---------- */
+
+/* The chunk holding an address, or 0 */
+static struct chunk *chunk_of(void *p) {
+    int lo = 0, hi = n_chunks - 1;
+    while (lo <= hi) {
+        int mid = (lo + hi) / 2;
+        char *base = chunks[mid]->base;
+        if ((char *) p < base) {
+            hi = mid - 1;
+        } else if ((char *) p >= base + HEAP_CHUNK_BYTES) {
+            lo = mid + 1;
+        } else {
+            return chunks[mid];
+        }
+    }
+    return 0;
+}
+
+/* If p is the address of an unmarked object, mark it to be traced */
+static void mark(void *p) {
+    struct chunk *c = chunk_of(p);
+    if (! c) {
+        return;  // Not in the heap, like a built-in singleton
+    }
+    size_t offset = (char *) p - c->base;
+    size_t g = offset / GRANULE;
+    if (offset % GRANULE || ! test_bit(c->starts, g)
+        || test_bit(c->marks, g)) {
+        return;
+    }
+    set_bit(c->marks, g);
+    if (mark_depth == mark_capacity) {
+        mark_capacity = mark_capacity ? 2 * mark_capacity : 1024;
+        mark_stack = realloc(mark_stack, mark_capacity * sizeof(obj_ref));
+        assert(mark_stack);
+    }
+    mark_stack[mark_depth++] = (obj_ref) p;
+}
+
+static void trace(void) {
+    while (mark_depth > 0) {
+        obj_ref obj = mark_stack[--mark_depth];
+        int n_fields = obj->header.clazz->header.n_fields;
+        for (int i = 0; i < n_fields; ++i) {
+            mark(obj->fields[i]);
+        }
+    }
+}
+
+/* Release what a dead object owns */
+static void finalize(obj_ref obj) {
+    if (obj->header.clazz == the_class_String) {
+        free(((obj_String) obj)->text);
+    }
+    obj->header.tag = 0;  // Health checks catch references to it
+}
+
+static void sweep(struct chunk *c) {
+    for (size_t w = 0; w < BITMAP_WORDS; ++w) {
+        uint64_t dead = c->starts[w] & ~c->marks[w];
+        uint64_t live = c->starts[w] & c->marks[w];
+        while (dead) {
+            obj_ref obj = object_at(c, w * 64 + __builtin_ctzll(dead));
+            stats.freed += object_bytes(obj);
+            finalize(obj);
+            dead &= dead - 1;
+        }
+        while (live) {
+            stats.live += object_bytes(
+                    object_at(c, w * 64 + __builtin_ctzll(live)));
+            live &= live - 1;
+        }
+        c->starts[w] &= c->marks[w];
+        c->marks[w] = 0;
+    }
+}
+
+void vm_gc(void) {
+    double start = seconds();
+    for (vm_Word *w = vm_frame_stack; w <= vm_sp; ++w) {
+        mark(w->obj);
+    }
+    mark(vm_tos.obj);  // The real top of the stack in fast mode
+    for (int i = 1; i < vm_const_limit(); ++i) {
+        mark(get_const_value(i));
+    }
+    trace();
+    stats.live = 0;
+    for (int i = 0; i < n_chunks; ++i) {
+        sweep(chunks[i]);
+    }
+    rewind_holes();
+    double pause = seconds() - start;
+    stats.collections += 1;
+    stats.pause_total += pause;
+    if (pause > stats.pause_max) {
+        stats.pause_max = pause;
+    }
+    log_debug("Collected garbage in %.6fs, %zu bytes live",
+              pause, stats.live);
+}
+
+void vm_heap_report(FILE *out) {
+    fprintf(out, "gc collections %ld pause %.6f max %.6f heap %zu"
+                 " live %zu allocated %zu freed %zu\n",
+            stats.collections, stats.pause_total, stats.pause_max,
+            (size_t) n_chunks * HEAP_CHUNK_BYTES, stats.live,
+            stats.allocated, stats.freed);
+}
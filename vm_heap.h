@@ -0,0 +1,45 @@
+/* Managed heap (tiny_vm -H size)
+ *
+ * Objects are allocated by bumping a pointer through free space
+ * in chunks of HEAP_CHUNK_BYTES.  When no free space is left, a
+ * mark-sweep collector reclaims the objects that cannot be
+ * reached from the frame stack or the constant pool, and the
+ * heap grows by whole chunks (up to its maximum size) if most
+ * of it is still in use.  Built-in singletons (nothing, true,
+ * false, small integers) are static and never in the heap.
+ *
+ * The frame stack holds saved program counters and frame
+ * pointers as well as object references, so we treat each of
+ * its words as a reference only if it is the address of an
+ * object in the heap (a conservative collector).  Objects are
+ * never moved.
+ */
+
+#ifndef TINY_VM_VM_HEAP_H
+#define TINY_VM_VM_HEAP_H
+
+#include <stddef.h>
+#include <stdio.h>
+#include "vm_core.h"
+
+#define HEAP_CHUNK_BYTES (1 << 20)
+#define DEFAULT_HEAP_BYTES ((size_t) 256 << 20)
+
+/* Limit the heap to max_bytes (at least one chunk).  Without
+ * this, the heap may grow to DEFAULT_HEAP_BYTES.
+ */
+extern void vm_heap_init(size_t max_bytes);
+
+/* Zeroed memory for an object of size bytes, whose header the
+ * caller must set before allocating again.  Exits with an error
+ * if the heap is full of live objects.
+ */
+extern obj_ref vm_heap_alloc(size_t size);
+
+/* Collect garbage now */
+extern void vm_gc(void);
+
+/* One line of collector and heap statistics */
+extern void vm_heap_report(FILE *out);
+
+#endif //TINY_VM_VM_HEAP_H
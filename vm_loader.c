@@ -8,8 +8,13 @@
 #include <cjson/cJSON.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <stdint.h>
 #include <string.h>
 #include <assert.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 
 // Set load library path before loading each class by name.
@@ -17,32 +22,169 @@
 // loads from the class name alone
 static char *PATH_PREFIX = "UNINITIALIZED LOAD PATH";
 
-// Address to load to (pushed forward by each load)
-// Note this is changed in vm_loader_init
-int vm_code_index = 0;  // This actually index, not address
-// And we need the address for methods, so ...
-vm_addr vm_current_address() {
-    return &vm_code_block[vm_code_index];
+/* Code memory, in chunks.  The first chunk is vm_code_block,
+ * which begins with the main sequence; when the code of a method
+ * (or of a whole program image) does not fit in what is left of
+ * the last chunk, we allocate another, of at least
+ * CODE_CHUNK_WORDS.  Code never moves, since the vtables and
+ * call_direct operands hold its addresses, and the code of a
+ * method is never split between chunks, since jumps are relative.
+ */
+struct code_chunk {
+    vm_addr base;
+    int size;   // Words
+    int used;   // Words
+};
+
+/* Chunks in order of address, so we can find one by bisection */
+static struct code_chunk *code_chunks = 0;
+static int n_code_chunks = 0;
+static int code_chunks_capacity = 0;
+static struct code_chunk *last_chunk = 0;  // Where we are loading
+
+static void add_code_chunk(vm_addr base, int size) {
+    if (n_code_chunks == code_chunks_capacity) {
+        code_chunks_capacity = code_chunks_capacity
+                               ? 2 * code_chunks_capacity : 16;
+        code_chunks = realloc(code_chunks,
+                              code_chunks_capacity * sizeof(struct code_chunk));
+        assert(code_chunks);
+    }
+    int i = n_code_chunks++;
+    while (i > 0 && code_chunks[i - 1].base > base) {
+        code_chunks[i] = code_chunks[i - 1];
+        --i;
+    }
+    code_chunks[i] = (struct code_chunk) {.base = base, .size = size};
+    last_chunk = &code_chunks[i];
+    log_debug("Code memory grows to %d chunks", n_code_chunks);
 }
 
+/* Address of room for n_words of code, which the caller
+ * must then fill
+ */
+static vm_addr reserve_code(int n_words) {
+    if (last_chunk->size - last_chunk->used < n_words) {
+        int size = n_words > CODE_CHUNK_WORDS ? n_words : CODE_CHUNK_WORDS;
+        vm_addr base = malloc(size * sizeof(vm_Word));
+        if (! base) {
+            log_error("Out of memory for code");
+            exit(1);
+        }
+        add_code_chunk(base, size);
+    }
+    vm_addr addr = last_chunk->base + last_chunk->used;
+    last_chunk->used += n_words;
+    return addr;
+}
 
+int vm_n_code_chunks(void) {
+    return n_code_chunks;
+}
 
-/* Table of already loaded classes.
- * Note that since each class header contains its name, a simple
- * list of classes references will do; we can look them up by checking
- * the ref->header.name
+vm_addr vm_code_chunk(int i, vm_addr *end) {
+    assert(0 <= i && i < n_code_chunks);
+    *end = code_chunks[i].base + code_chunks[i].used;
+    return code_chunks[i].base;
+}
+
+int vm_is_loaded_code(vm_addr addr) {
+    int lo = 0, hi = n_code_chunks - 1;
+    while (lo <= hi) {
+        int mid = (lo + hi) / 2;
+        if (addr < code_chunks[mid].base) {
+            hi = mid - 1;
+        } else if (addr >= code_chunks[mid].base + code_chunks[mid].used) {
+            lo = mid + 1;
+        } else {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+
+
+/* Greatest depth of the frame stack (above the frame header) of
+ * any loaded method, as the assembler found it
  */
-#define MAX_CLASSES 100   // And we will behave very badly if you have more
-class_ref loaded_classes[MAX_CLASSES];
-static int n_classes_loaded;
+static int max_stack_depth = 0;
+
+static void note_depth(int depth) {
+    if (depth > max_stack_depth) {
+        max_stack_depth = depth;
+    }
+}
+
+int vm_max_stack_depth(void) {
+    return max_stack_depth;
+}
+
+
+
+/* Table of already loaded classes, in the order they were
+ * loaded, which grows as needed.
+ */
+#define INITIAL_CLASSES 64
+static class_ref *loaded_classes = 0;
+static int n_classes_loaded = 0;
+static int loaded_capacity = 0;
+
+/* Hash index of the loaded classes by name, so that finding a
+ * class does not require searching the whole table.  Open
+ * addressing with linear probing; each slot holds a class, or
+ * 0 if empty.  The size is a power of 2 and kept at least twice
+ * the number of classes.  (Like the constant pool in vm_state.c.)
+ */
+static class_ref *class_hash = 0;
+static int class_hash_size = 0;
+
+static unsigned int name_hash(const char *name) {
+    // FNV-1a
+    unsigned int h = 2166136261u;
+    for (const char *p = name; *p; ++p) {
+        h = (h ^ (unsigned char) *p) * 16777619u;
+    }
+    return h;
+}
+
+/* Slot of the hash index holding the class with this name, or
+ * the empty slot where it would be placed.
+ */
+static int class_hash_slot(const char *name) {
+    unsigned int mask = class_hash_size - 1;
+    unsigned int slot = name_hash(name) & mask;
+    while (class_hash[slot]
+           && strcmp(class_hash[slot]->header.class_name, name) != 0) {
+        slot = (slot + 1) & mask;
+    }
+    return slot;
+}
+
+static void grow_loaded_classes(void) {
+    int capacity = loaded_capacity ? 2 * loaded_capacity : INITIAL_CLASSES;
+    loaded_classes = realloc(loaded_classes, capacity * sizeof(class_ref));
+    assert(loaded_classes);
+    loaded_capacity = capacity;
+    // Rebuild the hash index at twice the new capacity
+    free(class_hash);
+    class_hash_size = 2 * capacity;
+    class_hash = calloc(class_hash_size, sizeof(class_ref));
+    assert(class_hash);
+    for (int i = 0; i < n_classes_loaded; ++i) {
+        class_ref c = loaded_classes[i];
+        class_hash[class_hash_slot(c->header.class_name)] = c;
+    }
+}
 
 /* Add a class reference to the table of loaded classes.
  */
 static void set_loaded(class_ref c) {
-    int slot = n_classes_loaded++;
-    assert(n_classes_loaded < MAX_CLASSES);
-    loaded_classes[slot] = c;
-    return;
+    if (n_classes_loaded == loaded_capacity) {
+        grow_loaded_classes();
+    }
+    loaded_classes[n_classes_loaded++] = c;
+    class_hash[class_hash_slot(c->header.class_name)] = c;
 }
 
 /* Initialize loader
@@ -59,9 +201,11 @@ void vm_loader_init(char *load_path_prefix) {
     set_loaded(the_class_Boolean);
     set_loaded(the_class_Int);
     set_loaded(the_class_Nothing);
+    init_small_ints();
     // We'll leave a little room for a "main" code sequence
-    // at the beginning
-    vm_code_index = 16;
+    // at the beginning of the first chunk of code
+    add_code_chunk(vm_code_block, CODE_CHUNK_WORDS);
+    last_chunk->used = MAIN_CODE_WORDS;
     // And place a dummy sequence there for now ...
     int no_main = str_literal_const("No main program loaded!\n");
     vm_code_block[0] = (vm_Word) {.instr = vm_op_const};
@@ -71,9 +215,9 @@ void vm_loader_init(char *load_path_prefix) {
     vm_code_block[4] = (vm_Word) {.instr = vm_op_halt};
     //
     // The named constant literals
-    create_const_value("$nothing", nothing);
-    create_const_value("$true", lit_true);
-    create_const_value("$false", lit_false);
+    create_const_value('n', "$nothing", nothing);
+    create_const_value('n', "$true", lit_true);
+    create_const_value('n', "$false", lit_false);
 }
 
 /* When everything is loaded, we can patch in a call to the
@@ -96,12 +240,19 @@ void vm_loader_set_main(char *main_class_name) {
  * or return 0 indicating class is not loaded.
  */
 class_ref find_loaded(char *name) {
-    for (int i=0; i < n_classes_loaded; ++i) {
-        if (strcmp(loaded_classes[i]->header.class_name, name) == 0) {
-            return loaded_classes[i];
-        }
+    if (class_hash_size == 0) {
+        return 0;
     }
-    return 0;
+    return class_hash[class_hash_slot(name)];
+}
+
+int vm_n_loaded_classes(void) {
+    return n_classes_loaded;
+}
+
+class_ref vm_loaded_class(int i) {
+    assert(0 <= i && i < n_classes_loaded);
+    return loaded_classes[i];
 }
 
 class_ref ensure_loaded(char *class_name) {
@@ -118,35 +269,31 @@ class_ref ensure_loaded(char *class_name) {
 
 
 
-// Capacity limit:  For simplicity we read into a
-// buffer of 20k bytes.
-//
-#define FILE_BUFFER_CAPACITY (1024 * 100 * sizeof(char))
 
-
-/* read_file_fd
- * returns 0 (failure) or 1 (success)
+/* Read a whole file into a freshly allocated, null-terminated buffer.
+ * Returns 0 on failure.  Caller must free the buffer.
  */
-int read_file_fd(FILE *fd, char *file_buffer) {
-    int pos = 0;
-    char ch;
-    /* Simple, not efficient. */
-    while (1) {
-        ch = fgetc(fd);
-        if (feof(fd)) {
-            break;
-        } else if (ferror(fd)) {
-            perror("Error reading file");
-            break;
-        }
-        file_buffer[pos++] = ch;
+static char *read_file(FILE *fd) {
+    if (fseek(fd, 0, SEEK_END) != 0) {
+        perror("Error reading file");
+        return 0;
     }
-    // Do we need to add the null byte?  Maybe.
-    file_buffer[pos] = 0;
-    return 1;
+    long size = ftell(fd);
+    rewind(fd);
+    char *file_buffer = malloc(size + 1);
+    assert(file_buffer);
+    size_t n_read = fread(file_buffer, 1, size, fd);
+    if (ferror(fd)) {
+        perror("Error reading file");
+        free(file_buffer);
+        return 0;
+    }
+    file_buffer[n_read] = 0;
+    return file_buffer;
 }
 
-vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]);
+static vm_Word *translate_method_code(int n_words, const int ops[],
+                                      int const_map[], class_ref class_map[]);
 
 /*
  * Constants in a class file (.json) are referenced as small
@@ -158,6 +305,18 @@ vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[
  * (Java, in contrast, maintains a separate constant pool for each
  * class at run-time.)
  */
+static int intern_constant(char kind, char *literal) {
+    int internal = 0;
+    if (kind == 'i') {
+        internal = int_literal_const(literal);
+    } else if (kind == 's') {
+        internal = str_literal_const(strdup(literal));
+    } else {
+        perror("Constant of unknown type");
+    }
+    return internal;
+}
+
 static int remap_constants(int map[], cJSON *tree, int capacity) {
     cJSON *constants = cJSON_GetObjectItemCaseSensitive(tree,
                                            "constants");
@@ -172,19 +331,12 @@ static int remap_constants(int map[], cJSON *tree, int capacity) {
         cJSON *value_el = cJSON_GetObjectItemCaseSensitive(el, "value");
         char *kind = kind_el->valuestring;
         char *literal = value_el->valuestring;
-        int internal;
-        if (kind[0] == 'i') {
-            internal = int_literal_const(literal);
-        } else if (kind[0] == 's') {
-            internal = str_literal_const(strdup(literal));
-        } else {
-            perror("Constant of unknown type");
-        }
+        int internal = intern_constant(kind[0], literal);
+        assert(literal_count < capacity);
         map[literal_count] = internal;
         log_debug("Literal %s internal %d remapped to %d",
                   literal, literal_count, internal);
         ++literal_count;
-        assert(literal_count < capacity);
     }
     return literal_count; // Actually it's the count - 1
 }
@@ -215,50 +367,28 @@ static int map_classes(class_ref class_map[], cJSON *tree, int capacity) {
     return class_count; // Actually it's the count - 1
 }
 
-
-static int load_json(char buf[]) {
-    cJSON *tree = NULL; // Tree as a whole
-    cJSON *val = NULL;  // Named value in tree
-    cJSON *el = NULL;   // Element of value
-    tree = cJSON_Parse(buf);  // Must free at end
-    if (tree == NULL) {
-        perror("load_json in vm_loader.c: Failed to parse buffer. ");
-        assert(tree);  // Will definitely abort
-    }
-
-    /* module constant index -> global constant index */
-    int constant_renumber_map[30];
-    int n_consts = remap_constants(constant_renumber_map, tree, 30);
-
-    // Mapping imported classes was here; moving AFTER we
-    // create and index this class so that it can reference itself
-
-    // Create and initialize a class object
-    // push_log_level(DEBUG);
-    char *class_name = cJSON_GetStringValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
-    char *super_name = cJSON_GetStringValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "super"));
-    log_info("Class %s extends %s", class_name, super_name);
-    // Counts of methods and fields; I'm letting the assembler do the work here.
-    int n_fields = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_fields"));
-    int n_methods = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_methods"));
+/* Create and initialize a class object, with inherited method
+ * pointers copied from its superclass, and add it to the table of
+ * loaded classes.  The class must be in the table before its
+ * methods are loaded, because they may refer to the class itself.
+ */
+static class_ref create_class_of(char *class_name, class_ref the_super,
+                                 int n_fields, int n_methods, int n_inherited) {
+    log_info("Class %s extends %s", class_name,
+             the_super->header.class_name);
     log_info("Class %s has %d methods and %d fields",
              class_name, n_methods, n_fields);
     size_t class_obj_size =
             sizeof(struct class_header_struct)
             + n_methods * sizeof(vm_Word);
     size_t obj_size = sizeof(struct obj_header_struct) + n_fields * sizeof(vm_Word);
-    class_ref the_super = ensure_loaded(super_name);
-    assert(the_super); // Error if we can't find the superclass
     class_ref the_class = (class_ref) malloc(class_obj_size);
     the_class->header = (struct class_header_struct) {
             .class_name = strdup(class_name),
             .healthy_class_tag = HEALTHY,
             .n_fields = n_fields,
             .object_size = obj_size,
+            .n_methods = n_methods,
             .super = the_super
     };
     log_debug("Class %s class object size %d with %d methods",
@@ -268,22 +398,59 @@ static int load_json(char buf[]) {
     log_debug("Size of object header alone is %d bytes\n",
              sizeof(struct obj_header_struct));
     // Copy inherited method pointers into vtable
-    int n_inherited = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_inherited"));
     for (int i = 0; i < n_inherited; ++i) {
         the_class->vtable[i] = the_super->vtable[i];
     }
-    //pop_log_level();
-
     set_loaded(the_class);
-    // We want the class in the "loaded classes" table before loading
-    // methods, because the methods might have references to the current class.
+    return the_class;
+}
+
+static class_ref create_class(char *class_name, char *super_name,
+                              int n_fields, int n_methods, int n_inherited) {
+    class_ref the_super = ensure_loaded(super_name);
+    assert(the_super); // Error if we can't find the superclass
+    return create_class_of(class_name, the_super,
+                           n_fields, n_methods, n_inherited);
+}
+
+static int load_json(cJSON *tree) {
+    cJSON *el = NULL;   // Element of value
+
+    /* module constant index -> global constant index */
+    int n_consts = cJSON_GetArraySize(
+            cJSON_GetObjectItemCaseSensitive(tree, "constants"));
+    int *constant_renumber_map = malloc(n_consts * sizeof(int) + 1);
+    assert(constant_renumber_map);
+    remap_constants(constant_renumber_map, tree, n_consts);
+
+    // Mapping imported classes was here; moving AFTER we
+    // create and index this class so that it can reference itself
+
+    // Create and initialize a class object
+    // push_log_level(DEBUG);
+    char *class_name = cJSON_GetStringValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
+    char *super_name = cJSON_GetStringValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "super"));
+    // Counts of methods and fields; I'm letting the assembler do the work here.
+    int n_fields = (int) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "n_fields"));
+    int n_methods = (int) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "n_methods"));
+    int n_inherited = (int) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "n_inherited"));
+    class_ref the_class = create_class(class_name, super_name,
+                                       n_fields, n_methods, n_inherited);
+    //pop_log_level();
 
     /* module class index -> class reference,
     * with potential side effect of loading more class files.
     */
-    class_ref class_map[30];
-    int n_classes = map_classes(class_map, tree, 30);
+    int n_imports = cJSON_GetArraySize(
+            cJSON_GetObjectItemCaseSensitive(tree, "imports"));
+    class_ref *class_map = malloc(n_imports * sizeof(class_ref) + 1);
+    assert(class_map);
+    map_classes(class_map, tree, n_imports);
 
 
     cJSON *code_table = cJSON_GetObjectItemCaseSensitive(tree, "code");
@@ -295,99 +462,467 @@ static int load_json(char buf[]) {
         int method_slot = (int) cJSON_GetNumberValue(
                 cJSON_GetObjectItemCaseSensitive(el, "slot"));
         cJSON *ops = cJSON_GetObjectItemCaseSensitive(el, "code");
+        assert (cJSON_IsArray(ops));
+        assert(0 <= method_slot && method_slot < n_methods);
+        int n_words = cJSON_GetArraySize(ops);
+        int *words = malloc(n_words * sizeof(int) + 1);
+        int i = 0;
+        cJSON *op;
+        cJSON_ArrayForEach(op, ops) {
+            assert(cJSON_IsNumber(op));
+            words[i++] = op->valueint;
+        }
         vm_Word *method_start_addr =
-                translate_method_code(ops, constant_renumber_map, class_map);
+                translate_method_code(n_words, words,
+                                      constant_renumber_map, class_map);
+        free(words);
         the_class->vtable[method_slot] = method_start_addr;
+        cJSON *depth = cJSON_GetObjectItemCaseSensitive(el, "depth");
+        if (cJSON_IsNumber(depth)) {
+            note_depth(depth->valueint);
+        }
     }
-    cJSON_Delete(tree);
+    free(constant_renumber_map);
+    free(class_map);
     return 1;
 }
 
-vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]) {
-    // Translating code.  Constants must be renumbered since local
-    // constant number is not global constant number.
-    assert (cJSON_IsArray(ops));
-    cJSON *el = ops->child;
-    vm_Word *method_start_address = vm_current_address();
-    while (el) {
-        assert(cJSON_IsNumber(el));
-        int opcode = el->valueint;
-        log_debug("[%d] Op: %d (%s)",
-               vm_current_address() - vm_code_block,
-               opcode, vm_op_bytecodes[opcode].name);
-        vm_code_block[vm_code_index++] = (vm_Word)
-                {.instr = vm_op_bytecodes[opcode].instr};
-
-        if (vm_op_bytecodes[opcode].n_operands) {
-            // Max is 1 operand!
-            el = el->next;
-            int operand = el->valueint;
-            log_debug("[%d] Operand: %d",
-                      vm_current_address() - vm_code_block,
-                      operand);
-            if (vm_op_bytecodes[opcode].instr == vm_op_const) {
-                int const_index;
-                if (operand == CODE_FALSE) {
-                    const_index = lookup_const_index("$false");
-                } else if (operand == CODE_TRUE) {
-                    const_index = lookup_const_index("$true");
-                } else if (operand == CODE_NOTHING) {
-                    const_index = lookup_const_index("$nothing");
-                } else {
-                    assert(operand >= 0);
-                    const_index = const_map[operand];
-                }
-                assert(const_index);
-                check_health_object(get_const_value(const_index));
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.intval=  const_index};
-            } else if(vm_op_bytecodes[opcode].instr == vm_op_new
-                      || vm_op_bytecodes[opcode].instr == vm_op_is_instance) {
-                class_ref clazz = class_map[operand];
-                log_debug("Translating allocation of new '%s'",
-                          clazz->header.class_name);
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.clazz = clazz};
-            } else {
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.intval = operand};
+/* Translating code.  Constants must be renumbered since local
+ * constant number is not global constant number, and classes
+ * are referred to by index in the imports list.
+ */
+/* Translate an operand of an operation (or of one operation
+ * of a superinstruction).  The operand of call_direct is an
+ * offset from the start of the code being translated.
+ */
+static vm_Word translate_operand(vm_Instr instr, int operand,
+                                 int const_map[], class_ref class_map[],
+                                 vm_addr code_start) {
+    if (instr == vm_op_const) {
+        int const_index;
+        if (operand == CODE_FALSE) {
+            const_index = lookup_const_index('n', "$false");
+        } else if (operand == CODE_TRUE) {
+            const_index = lookup_const_index('n', "$true");
+        } else if (operand == CODE_NOTHING) {
+            const_index = lookup_const_index('n', "$nothing");
+        } else {
+            assert(operand >= 0);
+            const_index = const_map[operand];
+        }
+        assert(const_index);
+        check_health_object(get_const_value(const_index));
+        return (vm_Word) {.intval = const_index};
+    }
+    if (instr == vm_op_new || instr == vm_op_is_instance) {
+        class_ref clazz = class_map[operand];
+        log_debug("Translating allocation of new '%s'",
+                  clazz->header.class_name);
+        return (vm_Word) {.clazz = clazz};
+    }
+    if (instr == vm_op_call_direct) {
+        assert(operand >= 0);
+        return (vm_Word) {.code_addr = code_start + operand};
+    }
+    return (vm_Word) {.intval = operand};
+}
+
+static vm_Word *translate_method_code(int n_words, const int ops[],
+                                      int const_map[], class_ref class_map[]) {
+    // Each word of object code becomes one word of code
+    vm_Word *method_start_address = reserve_code(n_words);
+    vm_Word *code = method_start_address;
+    int pos = 0;
+    while (pos < n_words) {
+        int opcode = ops[pos++];
+        op_tbl_entry *op = &vm_op_bytecodes[opcode];
+        log_debug("[%p] Op: %d (%s)", code, opcode, op->name);
+        *code++ = (vm_Word) {.instr = op->instr};
+        // Operands of a superinstruction are those of its parts, in order
+        int n_parts = op->n_parts ? op->n_parts : 1;
+        for (int i = 0; i < n_parts; ++i) {
+            op_tbl_entry *part = op->n_parts ? &vm_op_bytecodes[op->parts[i]] : op;
+            for (int j = 0; j < part->n_operands; ++j) {
+                assert(pos < n_words);
+                int operand = ops[pos++];
+                log_debug("[%p] Operand: %d", code, operand);
+                *code++ = translate_operand(part->instr, operand,
+                                            const_map, class_map,
+                                            method_start_address);
             }
         }
-        el = el->next;
     }
     return method_start_address;
 }
 
 
+/* ---------- Binary object files (.tvo) -----------
+ *
+ * The binary format holds the same information as the .json
+ * format as little-endian 32-bit words, laid out so that
+ * we can load it directly from a memory-mapped file.
+ * The layout is described in objfile.py, which writes it.
+ */
+#define TVO_MAGIC "TVMO"
+#define TVO_VERSION 1
+#define TVO_HEADER_WORDS 12
+
+struct tvo_reader {
+    const unsigned char *base;  // Start of mapped file
+    size_t size;                // Size of mapped file in bytes
+    size_t pos;                 // Byte offset of next word
+    /* String table: offsets of null-terminated strings in string data */
+    size_t string_offsets;      // Byte offset of the offsets
+    const char *string_data;
+    int n_strings;
+};
+
+static int le32(const unsigned char *p) {
+    return (int) ((uint32_t) p[0] | (uint32_t) p[1] << 8
+                  | (uint32_t) p[2] << 16 | (uint32_t) p[3] << 24);
+}
+
+/* Word at a byte offset, which must lie within the file */
+static int tvo_word_at(struct tvo_reader *r, size_t pos) {
+    assert(pos + 4 <= r->size);  // Truncated or corrupt object file
+    return le32(r->base + pos);
+}
+
+/* Next word of the file */
+static int tvo_next(struct tvo_reader *r) {
+    int word = tvo_word_at(r, r->pos);
+    r->pos += 4;
+    return word;
+}
+
+/* String by index in the string table, used in place */
+static char *tvo_string(struct tvo_reader *r, int i) {
+    assert(0 <= i && i < r->n_strings);
+    return (char *) r->string_data + tvo_word_at(r, r->string_offsets + 4 * i);
+}
 
-/* Load an "object" file (json format) from
- * a class name.
+/* Optional sections at the end of a file, which we skip
+ * except for the stack depths of methods
+ */
+#define TVO_DEPTHS_TAG "DPTH"
+
+static void read_sections(struct tvo_reader *r) {
+    while (r->pos + 8 <= r->size) {
+        const unsigned char *tag = r->base + r->pos;
+        r->pos += 4;
+        int n_words = tvo_next(r);
+        if (memcmp(tag, TVO_DEPTHS_TAG, 4) == 0) {
+            for (int i = 0; i < n_words; ++i) {
+                note_depth(tvo_next(r));
+            }
+        } else {
+            r->pos += 4 * (size_t) n_words;
+        }
+    }
+}
+
+/* Copy the next n words of the file into host integers */
+static int *tvo_next_words(struct tvo_reader *r, int n) {
+    int *words = malloc(n * sizeof(int) + 1);
+    assert(words);
+    for (int i = 0; i < n; ++i) {
+        words[i] = tvo_next(r);
+    }
+    return words;
+}
+
+static int load_tvo(struct tvo_reader *r) {
+    if (r->size < TVO_HEADER_WORDS * 4
+        || memcmp(r->base, TVO_MAGIC, 4) != 0) {
+        log_error("Not a binary object file");
+        return 0;
+    }
+    r->pos = 4;
+    int version = tvo_next(r);
+    if (version != TVO_VERSION) {
+        log_error("Binary object file version %d, expected %d",
+                  version, TVO_VERSION);
+        return 0;
+    }
+    int class_name_index = tvo_next(r);
+    int super_name_index = tvo_next(r);
+    int n_fields = tvo_next(r);
+    int n_methods = tvo_next(r);
+    int n_inherited = tvo_next(r);
+    int n_strings = tvo_next(r);
+    int string_bytes = tvo_next(r);
+    int n_constants = tvo_next(r);
+    int n_imports = tvo_next(r);
+    int n_code_blocks = tvo_next(r);
+
+    r->string_offsets = r->pos;
+    r->n_strings = n_strings;
+    r->pos += 4 * n_strings;
+    r->string_data = (const char *) r->base + r->pos;
+    assert(r->pos + string_bytes <= r->size);
+    assert(string_bytes == 0 || r->string_data[string_bytes - 1] == 0);
+    r->pos += string_bytes;
+
+    // Method and field names are for the assembler; skip them
+    r->pos += 4 * (n_methods + n_fields);
+
+    /* module constant index -> global constant index */
+    int *constant_renumber_map = malloc(n_constants * sizeof(int) + 1);
+    assert(constant_renumber_map);
+    for (int i = 0; i < n_constants; ++i) {
+        char kind = (char) tvo_next(r);
+        char *literal = tvo_string(r, tvo_next(r));
+        constant_renumber_map[i] = intern_constant(kind, literal);
+        log_debug("Literal %s internal %d remapped to %d",
+                  literal, i, constant_renumber_map[i]);
+    }
+
+    class_ref the_class = create_class(tvo_string(r, class_name_index),
+                                       tvo_string(r, super_name_index),
+                                       n_fields, n_methods, n_inherited);
+
+    /* module class index -> class reference,
+     * with potential side effect of loading more class files.
+     */
+    class_ref *class_map = malloc(n_imports * sizeof(class_ref) + 1);
+    assert(class_map);
+    for (int i = 0; i < n_imports; ++i) {
+        class_map[i] = ensure_loaded(tvo_string(r, tvo_next(r)));
+    }
+
+    for (int i = 0; i < n_code_blocks; ++i) {
+        int method_name_index = tvo_next(r);
+        int method_slot = tvo_next(r);
+        int n_words = tvo_next(r);
+        assert(0 <= method_slot && method_slot < n_methods);
+        log_debug("Loading method %s", tvo_string(r, method_name_index));
+        int *words = tvo_next_words(r, n_words);
+        the_class->vtable[method_slot] =
+                translate_method_code(n_words, words,
+                                      constant_renumber_map, class_map);
+        free(words);
+    }
+    read_sections(r);
+    free(constant_renumber_map);
+    free(class_map);
+    return 1;
+}
+
+/* Map a whole file into memory for reading, or return 0 */
+static void *map_file(char *path, size_t *size) {
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
+        perror("Failed to open file");
+        return 0;
+    }
+    struct stat st;
+    if (fstat(fd, &st) != 0 || st.st_size == 0) {
+        perror("Failed to read file");
+        close(fd);
+        return 0;
+    }
+    void *mapped = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (mapped == MAP_FAILED) {
+        perror("Failed to map file");
+        return 0;
+    }
+    *size = st.st_size;
+    return mapped;
+}
+
+static int load_tvo_path(char *path) {
+    size_t size;
+    void *mapped = map_file(path, &size);
+    if (! mapped) {
+        return 0;
+    }
+    struct tvo_reader reader = {.base = mapped, .size = size, .pos = 0};
+    int ok = load_tvo(&reader);
+    munmap(mapped, size);
+    return ok;
+}
+
+static int load_json_path(char *path) {
+    FILE *fd = fopen(path, "r");
+    if (! fd) {
+        perror("Failed to open file");
+        return 0;
+    }
+    char *file_buffer = read_file(fd);
+    fclose(fd);
+    if (! file_buffer) {
+        return 0;
+    }
+    cJSON *tree = cJSON_Parse(file_buffer);  // Must free at end
+    free(file_buffer);
+    if (tree == NULL) {
+        log_error("Failed to parse %s", path);
+        assert(tree);  // Will definitely abort
+    }
+    int ok = load_json(tree);
+    cJSON_Delete(tree);
+    return ok;
+}
+
+static int has_suffix(char *s, char *suffix) {
+    size_t s_len = strlen(s);
+    size_t suffix_len = strlen(suffix);
+    return s_len >= suffix_len
+           && strcmp(s + s_len - suffix_len, suffix) == 0;
+}
+
+
+/* Load an "object" file from a class name,
+ * preferring binary (.tvo) to json format.
  */
 #define PATHBUFSIZE 4096
 extern int vm_load_class(char *classname) {
     char load_path[PATHBUFSIZE];
     // Use printf for multi-concat
-    snprintf(load_path, PATHBUFSIZE, "%s/%s.json", PATH_PREFIX, classname);
+    snprintf(load_path, PATHBUFSIZE, "%s/%s.tvo", PATH_PREFIX, classname);
+    if (access(load_path, R_OK) != 0) {
+        snprintf(load_path, PATHBUFSIZE, "%s/%s.json", PATH_PREFIX, classname);
+    }
     log_info("Loading %s", load_path);
     return vm_load_from_path(load_path);
 }
 
 
 int vm_load_from_path(char *path) {
-    char file_buffer[FILE_BUFFER_CAPACITY];
-    FILE *fd = fopen(path, "r");
-    if (! fd) {
-        perror("Failed to open file");
+    if (has_suffix(path, ".tvo")) {
+        return load_tvo_path(path);
+    }
+    return load_json_path(path);
+}
+
+
+/* ---------------- Program images ---------------------
+ * A program image (.tvi), produced by link.py, holds a main
+ * class and every class it uses, already laid out:  one pool of
+ * constants, classes in an order where each follows its
+ * superclass, vtables giving the offset of each method in one
+ * block of code.  We can load it in a single pass, without
+ * finding and parsing an object file for each class.
+ */
+#define TVI_MAGIC "TVMI"
+#define TVI_VERSION 1
+#define TVI_HEADER_WORDS 8
+#define TVI_BUILTIN 1      // Class flag
+#define TVI_INHERITED (-1)  // Vtable entry
+
+static int load_image(struct tvo_reader *r, char **main_class_name) {
+    if (r->size < TVI_HEADER_WORDS * 4
+        || memcmp(r->base, TVI_MAGIC, 4) != 0) {
+        log_error("Not a program image");
         return 0;
     }
-    int ok;
-    ok = read_file_fd(fd, file_buffer);
-    if (ok) {
-        cJSON *jobj = cJSON_Parse(file_buffer);
-        ok = (jobj != NULL);
+    r->pos = 4;
+    int version = tvo_next(r);
+    if (version != TVI_VERSION) {
+        log_error("Program image version %d, expected %d",
+                  version, TVI_VERSION);
+        return 0;
     }
-    assert(ok);
-    ok = load_json(file_buffer);
-    fclose(fd);
+    int n_strings = tvo_next(r);
+    int string_bytes = tvo_next(r);
+    int n_constants = tvo_next(r);
+    int n_classes = tvo_next(r);
+    int n_code_words = tvo_next(r);
+    int main_class = tvo_next(r);
+    assert(0 <= main_class && main_class < n_classes);
+
+    r->string_offsets = r->pos;
+    r->n_strings = n_strings;
+    r->pos += 4 * n_strings;
+    r->string_data = (const char *) r->base + r->pos;
+    assert(r->pos + string_bytes <= r->size);
+    assert(string_bytes == 0 || r->string_data[string_bytes - 1] == 0);
+    r->pos += string_bytes;
+
+    /* image constant index -> global constant index */
+    int *constant_renumber_map = malloc(n_constants * sizeof(int) + 1);
+    assert(constant_renumber_map);
+    for (int i = 0; i < n_constants; ++i) {
+        char kind = (char) tvo_next(r);
+        char *literal = tvo_string(r, tvo_next(r));
+        constant_renumber_map[i] = intern_constant(kind, literal);
+    }
+
+    /* Create the classes.  We fill in their vtables after
+     * loading the code, so we note where each vtable is.
+     */
+    class_ref *class_map = malloc(n_classes * sizeof(class_ref) + 1);
+    size_t *vtable_pos = malloc(n_classes * sizeof(size_t) + 1);
+    assert(class_map && vtable_pos);
+    for (int i = 0; i < n_classes; ++i) {
+        char *class_name = tvo_string(r, tvo_next(r));
+        int flags = tvo_next(r);
+        int super_index = tvo_next(r);
+        int n_fields = tvo_next(r);
+        int n_methods = tvo_next(r);
+        int n_inherited = tvo_next(r);
+        vtable_pos[i] = r->pos;
+        r->pos += 4 * n_methods;
+        if (flags & TVI_BUILTIN) {
+            class_map[i] = find_loaded(class_name);
+            if (! class_map[i]) {
+                log_error("No built-in class %s", class_name);
+                return 0;
+            }
+            continue;
+        }
+        assert(0 <= super_index && super_index < i);
+        class_map[i] = create_class_of(class_name, class_map[super_index],
+                                       n_fields, n_methods, n_inherited);
+    }
+
+    int *words = tvo_next_words(r, n_code_words);
+    vm_Word *code = translate_method_code(n_code_words, words,
+                                          constant_renumber_map, class_map);
+    free(words);
+    read_sections(r);
+
+    /* Superclasses come first, so their vtables are
+     * complete when we copy inherited methods.
+     */
+    for (int i = 0; i < n_classes; ++i) {
+        class_ref clazz = class_map[i];
+        size_t pos = vtable_pos[i];
+        int n_methods = tvo_word_at(r, pos - 8);
+        int n_inherited = tvo_word_at(r, pos - 4);
+        for (int slot = 0; slot < n_methods; ++slot) {
+            int offset = tvo_word_at(r, pos + 4 * slot);
+            if (offset != TVI_INHERITED) {
+                assert(0 <= offset && offset < n_code_words);
+                clazz->vtable[slot] = code + offset;
+            } else if (slot < n_inherited) {
+                clazz->vtable[slot] = clazz->header.super->vtable[slot];
+            } else {
+                clazz->vtable[slot] = 0;  // Declared but never defined
+            }
+        }
+    }
+    *main_class_name = class_map[main_class]->header.class_name;
+    free(constant_renumber_map);
+    free(class_map);
+    free(vtable_pos);
+    return 1;
+}
+
+int vm_is_image(char *path) {
+    return has_suffix(path, ".tvi");
+}
+
+int vm_load_image(char *path, char **main_class_name) {
+    log_info("Loading program image %s", path);
+    size_t size;
+    void *mapped = map_file(path, &size);
+    if (! mapped) {
+        return 0;
+    }
+    struct tvo_reader reader = {.base = mapped, .size = size, .pos = 0};
+    int ok = load_image(&reader, main_class_name);
+    munmap(mapped, size);
     return ok;
 }
@@ -5,10 +5,23 @@
 
 #include "vm_core.h"
 
-/* Loading normally starts at address 0,
- * but may be controlled through vm_code_index.
+/* Words at the beginning of the code block reserved for the
+ * main sequence (see vm_loader_set_main); code is loaded after.
  */
-extern int vm_code_index;
+#define MAIN_CODE_WORDS 16
+
+/* Loaded code is in chunks of memory, the first of which is
+ * vm_code_block (including the main sequence).  Chunk i holds
+ * code from vm_code_chunk(i, &end) up to end, and the chunks are
+ * in order of address.
+ */
+extern int vm_n_code_chunks(void);
+extern vm_addr vm_code_chunk(int i, vm_addr *end);
+
+/* Is this the address of loaded code (or the main sequence),
+ * rather than, say, of a built-in method?
+ */
+extern int vm_is_loaded_code(vm_addr addr);
 
 /* Initialize loader (loads built-in classes)
  */
@@ -19,11 +32,23 @@ extern void vm_loader_init(char *load_path_prefix);
  */
 void vm_loader_set_main(char *main_class_name);
 
+/* Greatest number of words any loaded method pushes on the
+ * frame stack above its frame header (locals included), from
+ * the object code, or 0 where the object code does not say
+ */
+extern int vm_max_stack_depth(void);
+
 /* Get loaded class reference by class name,
  * or return 0 indicating class is not loaded.
  */
 extern class_ref find_loaded(char *name);
 
+/* Loaded classes, in the order they were loaded,
+ * for i from 0 to vm_n_loaded_classes() - 1.
+ */
+extern int vm_n_loaded_classes(void);
+extern class_ref vm_loaded_class(int i);
+
 /* Load an "object" file (json format) from
  * a class name.
  */
@@ -34,6 +59,17 @@ extern int vm_load_class(char *classname);
  */
 extern int vm_load_from_path(char *path);
 
+/* Is this the path of a program image (.tvi) from link.py,
+ * rather than the name of a class?
+ */
+extern int vm_is_image(char *path);
+
+/* Load a program image, which contains a main class and all
+ * the classes it uses.  Sets *main_class_name to the name
+ * of the main class.  Return 1 = success, 0 = failure.
+ */
+extern int vm_load_image(char *path, char **main_class_name);
+
 /* Constants in method bytecode will be small non-negative
  * integers corresponding to the "constants" list in the
  * object code json, or chosen from this fixed set of
@@ -5,9 +5,11 @@
 #include "vm_ops.h"
 #include "vm_state.h"
 #include "builtins.h"  // For literals lit_true, lit_false, nothing
+#include "vm_heap.h"
 #include "logger.h"
 #include <stdlib.h>
 #include <stdio.h>
+#include <string.h>
 #include <assert.h>
 
 /*  Push inline constant (by constant table index).
@@ -88,6 +90,47 @@ extern void vm_op_methodcall(void) {
     return;
 }
 
+/* The linker writes call_direct in place of call where every
+ * class the receiver could belong to has the same method, so
+ * we need neither the receiver's class nor health checks.
+ */
+extern void vm_op_call_direct(void) {
+    vm_addr method_addr = vm_fetch_next().code_addr;
+    vm_addr new_fp = vm_sp;
+    vm_frame_push_word((vm_Word) {.code_addr = vm_pc});
+    vm_frame_push_word((vm_Word) {.frame_addr = vm_fp});
+    vm_fp = new_fp;
+    vm_pc = method_addr;
+}
+
+/* A call that would be followed by return.  Instead of pushing
+ * a frame, we slide the receiver and arguments of the called
+ * method down over those of the caller (and whatever the caller
+ * had on its stack), and give the new frame the caller's return
+ * address and saved frame pointer, so the frame stack does not
+ * grow in a chain of calls in tail position.
+ */
+extern void vm_op_tail_call(void) {
+    int method_index = vm_fetch_next().intval;
+    int caller_arity = vm_fetch_next().intval;
+    int callee_arity = vm_fetch_next().intval;
+    vm_Word return_pc = *(vm_fp + 1);
+    vm_Word saved_fp = *(vm_fp + 2);
+    // Arguments, then receiver, are on top of the stack
+    vm_addr args = vm_sp - callee_arity;
+    vm_addr dest = vm_fp - caller_arity;
+    memmove(dest, args, (callee_arity + 1) * sizeof(vm_Word));
+    vm_fp = dest + callee_arity;
+    vm_sp = vm_fp;
+    vm_frame_push_word(return_pc);
+    vm_frame_push_word(saved_fp);
+    obj_ref receiver = (*vm_fp).obj;
+    check_health_object(receiver);
+    class_ref clazz = receiver->header.clazz;
+    check_health_class(clazz);
+    vm_pc = clazz->vtable[method_index];
+}
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
@@ -154,7 +197,7 @@ extern void vm_op_return() {
 extern obj_ref vm_new_obj(class_ref clazz) {
     check_health_class(clazz);
     log_debug("Allocating a new object of type %s\n", clazz->header.class_name);
-    obj_ref new_thing = (obj_ref) malloc(clazz->header.object_size);
+    obj_ref new_thing = vm_heap_alloc(clazz->header.object_size);
     new_thing->header.clazz = clazz;
     new_thing->header.tag = GOOD_OBJ_TAG;
     for (int i=0; i < clazz->header.n_fields; ++i) {
@@ -25,6 +25,27 @@ extern void vm_op_halt(void);
  */
 extern void vm_op_methodcall(void);
 
+/* Call a method whose code address is known (see link.py),
+ * without looking in the vtable of the receiver's class.
+ * Next word is the code address.
+ *
+ * vm_op_call_direct(addr): [arg, arg, ...,  receiver] -> [result]
+ */
+extern void vm_op_call_direct(void);
+
+/* Call a method in place of the calling method, whose result
+ * would be returned at once (call then return), reusing the
+ * caller's activation record:  the arguments and receiver of the
+ * called method replace those of the caller, and it returns
+ * directly to the caller's caller.  Next words are the method
+ * index, the arity of the caller, and the arity of the method
+ * called.
+ *
+ * vm_op_tail_call(m_index, caller_arity, callee_arity):
+ *     [arg, arg, ...,  receiver] -> [result]
+ */
+extern void vm_op_tail_call(void);
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
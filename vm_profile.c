@@ -0,0 +1,460 @@
+/*
+ * Execution profiling.  We keep a shadow stack of the methods
+ * being executed, pushing a method when an operation moves the
+ * frame pointer up (a call) and popping it when an operation
+ * moves it down (a return).  The method is the one that
+ * vm_op_methodcall found:  the slot of the receiver's vtable
+ * holding the new program counter.  A tail call may move the
+ * frame pointer either way, or not at all, so we recognize it
+ * by its operation and replace the method on top of the stack.
+ */
+#include "vm_profile.h"
+#include "vm_state.h"
+#include "vm_code_table.h"
+#include "vm_loader.h"
+#include "cJSON.h"
+#include "logger.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+#include <time.h>
+#include <signal.h>
+#include <sys/time.h>
+#include <assert.h>
+
+#define MAX_OPCODES 256
+#define MAX_DEPTH FRAME_CAPACITY  // Every frame is more than one word
+
+/* Time and operations, by class of receiver and vtable slot */
+struct method_profile {
+    class_ref clazz;   // 0 for the main program sequence
+    int slot;
+    long calls;
+    long ops;          // Dispatched in this method itself
+    double self_time;  // Seconds in this method itself
+    double total_time; // Seconds including methods it called
+    int active;        // Activations on the shadow stack
+};
+
+static struct method_profile *methods = 0;
+static int n_methods = 0;
+static int methods_capacity = 0;
+
+static long op_counts[MAX_OPCODES];
+static long unknown_ops = 0;
+static double run_time = 0;
+
+struct activation {
+    int method;       // Index in methods
+    double entered;
+};
+
+static struct activation shadow[MAX_DEPTH];
+static int depth = 0;
+
+static double seconds(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+}
+
+/* Byte codes of the operations by function, so that counting
+ * an operation does not search vm_op_bytecodes.  Open addressing
+ * with linear probing; the size is a power of 2, at least twice
+ * the number of operations.
+ */
+#define OPCODE_HASH_SIZE (2 * MAX_OPCODES)
+
+static struct {
+    vm_Instr instr;   // 0 if empty
+    int opcode;
+} opcode_hash[OPCODE_HASH_SIZE];
+
+static unsigned int instr_slot(vm_Instr instr) {
+    unsigned int mask = OPCODE_HASH_SIZE - 1;
+    // Functions are aligned, so the low bits carry little
+    unsigned int slot = (unsigned int) ((uintptr_t) instr >> 4) & mask;
+    while (opcode_hash[slot].instr && opcode_hash[slot].instr != instr) {
+        slot = (slot + 1) & mask;
+    }
+    return slot;
+}
+
+static void index_opcodes(void) {
+    for (int i = 0; vm_op_bytecodes[i].name && i < MAX_OPCODES; ++i) {
+        unsigned int slot = instr_slot(vm_op_bytecodes[i].instr);
+        opcode_hash[slot].instr = vm_op_bytecodes[i].instr;
+        opcode_hash[slot].opcode = i;
+    }
+}
+
+/* Byte code of an operation, or -1 */
+static int opcode_of(vm_Instr instr) {
+    unsigned int slot = instr_slot(instr);
+    return opcode_hash[slot].instr ? opcode_hash[slot].opcode : -1;
+}
+
+/* A new profile of a method; returns its index */
+static int new_profile(class_ref clazz, int slot) {
+    if (n_methods == methods_capacity) {
+        methods_capacity = methods_capacity ? 2 * methods_capacity : 64;
+        methods = realloc(methods,
+                          methods_capacity * sizeof(struct method_profile));
+        assert(methods);
+    }
+    methods[n_methods] = (struct method_profile) {
+            .clazz = clazz, .slot = slot};
+    return n_methods++;
+}
+
+/* The vtable slot through which we just called the method at vm_pc */
+static int called_slot(class_ref clazz) {
+    int n_slots = clazz->header.n_methods;
+    for (int slot = 0; slot < n_slots; ++slot) {
+        if (clazz->vtable[slot] == vm_pc) {
+            return slot;
+        }
+    }
+    return -1;
+}
+
+/* Profiles by class of receiver and address of the method, so
+ * that a call finds its profile without searching the vtable or
+ * the profiles.  Open addressing with linear probing, like
+ * opcode_hash; the size is a power of 2, kept at least twice the
+ * number of profiles.
+ */
+struct method_key {
+    class_ref clazz;
+    vm_addr entry;    // 0 if empty
+    int method;       // Index in methods
+};
+
+static struct method_key *method_hash = 0;
+static unsigned int method_hash_size = 0;
+
+static unsigned int method_slot(class_ref clazz, vm_addr entry) {
+    unsigned int mask = method_hash_size - 1;
+    // Code words and class structures are aligned
+    uintptr_t hash = ((uintptr_t) entry >> 3) * 31 + ((uintptr_t) clazz >> 4);
+    unsigned int slot = (unsigned int) hash & mask;
+    while (method_hash[slot].entry && (method_hash[slot].entry != entry
+                                       || method_hash[slot].clazz != clazz)) {
+        slot = (slot + 1) & mask;
+    }
+    return slot;
+}
+
+static void grow_method_hash(void) {
+    struct method_key *old = method_hash;
+    unsigned int old_size = method_hash_size;
+    method_hash_size = old_size ? 2 * old_size : 128;
+    method_hash = calloc(method_hash_size, sizeof(struct method_key));
+    assert(method_hash);
+    for (unsigned int i = 0; i < old_size; ++i) {
+        if (old[i].entry) {
+            method_hash[method_slot(old[i].clazz, old[i].entry)] = old[i];
+        }
+    }
+    free(old);
+}
+
+/* Index of the profile of the method just called (at vm_pc)
+ * on an instance of clazz, created if necessary
+ */
+static int called_method(class_ref clazz) {
+    if (2 * (n_methods + 1) > (int) method_hash_size) {
+        grow_method_hash();
+    }
+    unsigned int slot = method_slot(clazz, vm_pc);
+    if (! method_hash[slot].entry) {
+        method_hash[slot] = (struct method_key) {
+                .clazz = clazz, .entry = vm_pc,
+                .method = new_profile(clazz, called_slot(clazz))};
+    }
+    return method_hash[slot].method;
+}
+
+static void enter(int method, double now) {
+    assert(depth < MAX_DEPTH);
+    shadow[depth++] = (struct activation) {.method = method, .entered = now};
+    methods[method].calls += 1;
+    methods[method].active += 1;
+}
+
+static void leave(double now) {
+    assert(depth > 0);
+    struct activation *top = &shadow[--depth];
+    struct method_profile *m = &methods[top->method];
+    m->active -= 1;
+    if (m->active == 0) {
+        // Outermost activation of a recursive method
+        m->total_time += now - top->entered;
+    }
+}
+
+void vm_run_profiled(void) {
+    index_opcodes();
+    double start = seconds();
+    double last = start;
+    enter(new_profile(0, -1), start);
+    vm_run_state = VM_RUNNING;
+    while (vm_run_state == VM_RUNNING) {
+        struct method_profile *current = &methods[shadow[depth - 1].method];
+        // Dispatch as vm_run_release does, so that the time of
+        // each method is what it would be in a release run
+        vm_Instr instr = vm_fetch_next().instr;
+        int opcode = opcode_of(instr);
+        if (opcode >= 0) {
+            ++op_counts[opcode];
+        } else {
+            ++unknown_ops;
+        }
+        ++current->ops;
+        vm_addr fp_before = vm_fp;
+        int tail_call = instr == vm_op_tail_call;
+        instr();
+        ++vm_steps;
+        if (vm_fp == fp_before && ! tail_call) {
+            continue;
+        }
+        double now = seconds();
+        current->self_time += now - last;
+        last = now;
+        if (tail_call) {
+            leave(now);
+            class_ref clazz = vm_fp->obj->header.clazz;
+            enter(called_method(clazz), now);
+        } else if (vm_fp > fp_before) {
+            class_ref clazz = vm_fp->obj->header.clazz;
+            enter(called_method(clazz), now);
+        } else if (depth > 1) {
+            leave(now);
+        }
+    }
+    double now = seconds();
+    methods[shadow[depth - 1].method].self_time += now - last;
+    while (depth > 0) {
+        leave(now);
+    }
+    run_time = now - start;
+}
+
+int vm_profile_write(char *path) {
+    cJSON *profile = cJSON_CreateObject();
+    cJSON_AddNumberToObject(profile, "version", 1);
+    cJSON_AddNumberToObject(profile, "steps", (double) vm_steps);
+    cJSON_AddNumberToObject(profile, "run_time", run_time);
+    cJSON *ops = cJSON_AddArrayToObject(profile, "opcodes");
+    for (int i = 0; vm_op_bytecodes[i].name && i < MAX_OPCODES; ++i) {
+        cJSON *op = cJSON_CreateObject();
+        cJSON_AddStringToObject(op, "name", vm_op_bytecodes[i].name);
+        cJSON_AddNumberToObject(op, "code", i);
+        cJSON_AddNumberToObject(op, "count", (double) op_counts[i]);
+        cJSON_AddItemToArray(ops, op);
+    }
+    cJSON_AddNumberToObject(profile, "unknown_ops", (double) unknown_ops);
+    cJSON *profiled = cJSON_AddArrayToObject(profile, "methods");
+    for (int i = 0; i < n_methods; ++i) {
+        struct method_profile *m = &methods[i];
+        cJSON *method = cJSON_CreateObject();
+        cJSON_AddStringToObject(method, "class",
+                                m->clazz ? m->clazz->header.class_name : "");
+        cJSON_AddNumberToObject(method, "slot", m->slot);
+        cJSON_AddNumberToObject(method, "calls", (double) m->calls);
+        cJSON_AddNumberToObject(method, "ops", (double) m->ops);
+        cJSON_AddNumberToObject(method, "self_time", m->self_time);
+        cJSON_AddNumberToObject(method, "total_time", m->total_time);
+        cJSON_AddItemToArray(profiled, method);
+    }
+    char *text = cJSON_Print(profile);
+    cJSON_Delete(profile);
+    FILE *f = fopen(path, "w");
+    if (! f) {
+        perror("Cannot write profile");
+        free(text);
+        return 0;
+    }
+    fprintf(f, "%s\n", text);
+    fclose(f);
+    free(text);
+    log_info("Wrote profile to %s", path);
+    return 1;
+}
+
+
+/* ---------------- Sampling ----------------
+ *
+ * The signal handler only copies addresses into buffers
+ * allocated before the timer starts; addresses are matched
+ * to methods when the samples are written.  The frame chain
+ * may be half updated when the signal arrives (in the middle
+ * of a call or return), so we follow saved frame pointers only
+ * while they stay within the frame stack and move toward its
+ * bottom.
+ */
+#define MAX_SAMPLES 100000
+#define MAX_SAMPLE_DEPTH 64     // Innermost frames kept in a sample
+#define SAMPLE_WORDS (1 << 20)  // Addresses in all samples
+
+static vm_addr *sample_pcs = 0;   // Innermost first in each sample
+static int *sample_end = 0;       // Index in sample_pcs after each sample
+static int n_samples = 0;
+static int n_sample_words = 0;
+static long dropped_samples = 0;
+
+static void take_sample(int signum) {
+    (void) signum;
+    if (n_samples == MAX_SAMPLES
+        || n_sample_words + MAX_SAMPLE_DEPTH > SAMPLE_WORDS) {
+        ++dropped_samples;
+        return;
+    }
+    vm_addr *out = &sample_pcs[n_sample_words];
+    int n = 0;
+    out[n++] = vm_pc;
+    vm_addr fp = vm_fp;
+    vm_addr stack_end = vm_frame_stack + FRAME_CAPACITY;
+    while (n < MAX_SAMPLE_DEPTH && fp > vm_frame_stack && fp + 2 < stack_end) {
+        out[n++] = (fp + 1)->code_addr;   // Return address
+        vm_addr caller_fp = (fp + 2)->frame_addr;
+        if (caller_fp >= fp || caller_fp < vm_frame_stack) {
+            break;
+        }
+        fp = caller_fp;
+    }
+    n_sample_words += n;
+    sample_end[n_samples++] = n_sample_words;
+}
+
+void vm_sample_start(void) {
+    sample_pcs = malloc(SAMPLE_WORDS * sizeof(vm_addr));
+    sample_end = malloc(MAX_SAMPLES * sizeof(int));
+    assert(sample_pcs && sample_end);
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_handler = take_sample;
+    action.sa_flags = SA_RESTART;
+    sigemptyset(&action.sa_mask);
+    sigaction(SIGPROF, &action, 0);
+    struct itimerval timer = {
+            .it_interval = {.tv_sec = 0, .tv_usec = SAMPLE_INTERVAL_US},
+            .it_value = {.tv_sec = 0, .tv_usec = SAMPLE_INTERVAL_US}};
+    setitimer(ITIMER_PROF, &timer, 0);
+}
+
+void vm_sample_stop(void) {
+    struct itimerval off = {{0, 0}, {0, 0}};
+    setitimer(ITIMER_PROF, &off, 0);
+    signal(SIGPROF, SIG_DFL);
+}
+
+/* Where each method's code begins.  The main program
+ * sequence at the start of vm_code_block is (class 0, slot -1).
+ */
+struct method_start {
+    vm_addr addr;
+    class_ref clazz;
+    int slot;
+};
+
+static int compare_starts(const void *a, const void *b) {
+    uintptr_t x = (uintptr_t) ((const struct method_start *) a)->addr;
+    uintptr_t y = (uintptr_t) ((const struct method_start *) b)->addr;
+    return (x > y) - (x < y);
+}
+
+/* Methods defined (not inherited) in each loaded class,
+ * in order of address.  Returns the number of methods.
+ */
+static int method_starts(struct method_start **starts) {
+    int capacity = 1;
+    int n_classes = vm_n_loaded_classes();
+    for (int i = 0; i < n_classes; ++i) {
+        capacity += vm_loaded_class(i)->header.n_methods;
+    }
+    struct method_start *table = malloc(capacity * sizeof(struct method_start));
+    assert(table);
+    int n = 0;
+    table[n++] = (struct method_start) {
+            .addr = vm_code_block, .clazz = 0, .slot = -1};
+    for (int i = 0; i < n_classes; ++i) {
+        class_ref clazz = vm_loaded_class(i);
+        class_ref super = clazz->header.super;
+        for (int slot = 0; slot < clazz->header.n_methods; ++slot) {
+            vm_addr addr = clazz->vtable[slot];
+            int inherited = super && slot < super->header.n_methods
+                            && super->vtable[slot] == addr;
+            if (addr && ! inherited) {
+                table[n++] = (struct method_start) {
+                        .addr = addr, .clazz = clazz, .slot = slot};
+            }
+        }
+    }
+    qsort(table, n, sizeof(struct method_start), compare_starts);
+    *starts = table;
+    return n;
+}
+
+/* Index of the method containing an address (the last
+ * to start at or before it), or -1
+ */
+static int method_containing(struct method_start *starts, int n, vm_addr pc) {
+    int lo = 0, hi = n;   // starts[lo..hi) may start after pc
+    while (lo < hi) {
+        int mid = (lo + hi) / 2;
+        if ((uintptr_t) starts[mid].addr <= (uintptr_t) pc) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo - 1;
+}
+
+int vm_samples_write(char *path) {
+    struct method_start *starts;
+    int n_starts = method_starts(&starts);
+    cJSON *profile = cJSON_CreateObject();
+    cJSON_AddNumberToObject(profile, "version", 1);
+    cJSON_AddNumberToObject(profile, "interval", SAMPLE_INTERVAL_US / 1e6);
+    cJSON_AddNumberToObject(profile, "dropped", (double) dropped_samples);
+    cJSON *methods_list = cJSON_AddArrayToObject(profile, "methods");
+    for (int i = 0; i < n_starts; ++i) {
+        cJSON *method = cJSON_CreateObject();
+        cJSON_AddStringToObject(method, "class", starts[i].clazz ?
+                                starts[i].clazz->header.class_name : "");
+        cJSON_AddNumberToObject(method, "slot", starts[i].slot);
+        cJSON_AddItemToArray(methods_list, method);
+    }
+    // Each sample is [method, offset, method, offset, ...],
+    // innermost first; the method is an index in "methods".
+    cJSON *samples = cJSON_AddArrayToObject(profile, "samples");
+    int pairs[2 * MAX_SAMPLE_DEPTH];
+    int begin = 0;
+    for (int i = 0; i < n_samples; ++i) {
+        int n = 0;
+        for (int w = begin; w < sample_end[i]; ++w) {
+            int method = method_containing(starts, n_starts, sample_pcs[w]);
+            pairs[n++] = method;
+            pairs[n++] = method < 0 ? 0 : (int) (sample_pcs[w] - starts[method].addr);
+        }
+        cJSON_AddItemToArray(samples, cJSON_CreateIntArray(pairs, n));
+        begin = sample_end[i];
+    }
+    free(starts);
+    char *text = cJSON_PrintUnformatted(profile);
+    cJSON_Delete(profile);
+    FILE *f = fopen(path, "w");
+    if (! f) {
+        perror("Cannot write samples");
+        free(text);
+        return 0;
+    }
+    fprintf(f, "%s\n", text);
+    fclose(f);
+    free(text);
+    log_info("Wrote %d samples to %s", n_samples, path);
+    return 1;
+}
@@ -0,0 +1,42 @@
+/* Execution profiling (tiny_vm -p profile.json)
+ *
+ * The profiling loop counts the operations dispatched, by
+ * operation code and by method, and the time spent in each
+ * method.  It is a separate loop from vm_run, so a run that
+ * is not profiled pays nothing for it.
+ */
+
+#ifndef TINY_VM_VM_PROFILE_H
+#define TINY_VM_VM_PROFILE_H
+
+/* Like vm_run_release, but counting as we go */
+extern void vm_run_profiled(void);
+
+/* Write the profile as JSON.  A method is identified by the
+ * name of the class of the receiver and its slot in the vtable
+ * (tools/profile_report.py finds method names in object files).
+ * Return 1 = success, 0 = failure.
+ */
+extern int vm_profile_write(char *path);
+
+/* Sampling (tiny_vm -s samples.json)
+ *
+ * While sampling, a profiling timer interrupts the virtual
+ * machine every SAMPLE_INTERVAL_US microseconds of CPU time
+ * to record vm_pc and the return address in each frame on the
+ * frame stack.  This works with any dispatch loop, and costs
+ * little more than the interrupts.
+ */
+#define SAMPLE_INTERVAL_US 1000
+
+extern void vm_sample_start(void);
+extern void vm_sample_stop(void);
+
+/* Write the samples as JSON, with each address as a method
+ * (class name and vtable slot) and an offset in its code.
+ * tools/sample_report.py maps offsets to source lines.
+ * Return 1 = success, 0 = failure.
+ */
+extern int vm_samples_write(char *path);
+
+#endif //TINY_VM_VM_PROFILE_H
@@ -9,13 +9,15 @@
 #include "builtins.h"  // For debugging only
 #include <assert.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
 
 /* The concrete data structures live here */
 
-vm_Word vm_code_block[CODE_CAPACITY];
+vm_Word vm_code_block[CODE_CHUNK_WORDS];
 vm_addr vm_pc =   &vm_code_block[0];
 int vm_run_state = VM_RUNNING;
+long vm_steps = 0;
 enum LOG_LEVEL vm_logging = INFO;
 
 char *guess_description(vm_Word w);
@@ -26,14 +28,17 @@ char *guess_description(vm_Word w);
  */
 vm_Word vm_fetch_next(void) {
     vm_Word cur = (*vm_pc);
-    if (vm_pc >= vm_code_block && vm_pc < vm_code_block + CODE_CAPACITY) {
-        // Looks like we are executing an instruction in the main
-        // code memory
-        int word_number = vm_pc - vm_code_block;
-        log_debug("Fetched [%d] (%p : %s)", word_number, cur.native,
-                  guess_description(cur));
-    } else {
-        log_debug("Fetched %p (%s)", cur.native, guess_description(cur));
+    // Describing the word is costly, so only when it will be logged
+    if (LOGGING <= DEBUG) {
+        if (vm_pc >= vm_code_block && vm_pc < vm_code_block + CODE_CHUNK_WORDS) {
+            // Looks like we are executing an instruction in the main
+            // code memory
+            int word_number = vm_pc - vm_code_block;
+            log_debug("Fetched [%d] (%p : %s)", word_number, cur.native,
+                      guess_description(cur));
+        } else {
+            log_debug("Fetched %p (%s)", cur.native, guess_description(cur));
+        }
     }
     vm_pc ++;
     return cur;
@@ -59,6 +64,7 @@ vm_Word vm_frame_stack[FRAME_CAPACITY];
 
 vm_Word *vm_fp = vm_frame_stack;    // Frame pointer, points to "this" object
 vm_Word *vm_sp = vm_frame_stack;    // Stack pointer, points to top item
+vm_Word vm_tos;                     // Top item, in fast mode only
 /* Evaluation stack is at end of activation record. */
 
 
@@ -106,9 +112,7 @@ obj_ref vm_eval_pop() {
  */
 void vm_roll(int n) {
     vm_Word ob = *(vm_sp - n);
-    for (int i=n; i > 0; --i) {
-        *(vm_sp - i) = *(vm_sp + 1 - i);
-    }
+    memmove(vm_sp - n, vm_sp - n + 1, n * sizeof(vm_Word));
     *(vm_sp) = ob;
 }
 
@@ -116,6 +120,7 @@ void vm_roll(int n) {
 /* --------------------- Constant pool --------------- */
 
 struct constant_pool_entry {
+    char kind;   // 'i' (int), 's' (string), or 'n' (named literal)
     char* name;
     obj_ref const_object;
 };
@@ -128,32 +133,88 @@ struct constant_pool_entry {
  * indexes are remapped while the module is loaded.
  */
 
-/* The global pool */
-static struct constant_pool_entry vm_constant_pool[CONST_POOL_CAPACITY];
+/* The global pool, which grows as needed */
+static struct constant_pool_entry *vm_constant_pool = NULL;
+static int vm_const_capacity = 0;
 static int vm_next_const = 1; // Skip index 0 so that it can be failure signal
 
-/* lookup_const_index("literal string") returns index
+/* Hash index of the pool, so that interning a literal does not
+ * require searching the whole pool.  Open addressing with linear
+ * probing; each slot holds a pool index, or 0 if empty.  The
+ * size is a power of 2 and kept at least twice the pool size.
+ */
+static int *vm_const_hash = NULL;
+static int vm_const_hash_size = 0;
+
+static unsigned int const_hash(char kind, const char *literal) {
+    // FNV-1a
+    unsigned int h = 2166136261u;
+    h = (h ^ (unsigned char) kind) * 16777619u;
+    for (const char *p = literal; *p; ++p) {
+        h = (h ^ (unsigned char) *p) * 16777619u;
+    }
+    return h;
+}
+
+/* Slot of the hash index holding (kind, literal), or
+ * the empty slot where it would be placed.
+ */
+static int const_hash_slot(char kind, const char *literal) {
+    unsigned int mask = vm_const_hash_size - 1;
+    unsigned int slot = const_hash(kind, literal) & mask;
+    while (vm_const_hash[slot]) {
+        struct constant_pool_entry *entry =
+                &vm_constant_pool[vm_const_hash[slot]];
+        if (entry->kind == kind && strcmp(literal, entry->name) == 0) {
+            break;
+        }
+        slot = (slot + 1) & mask;
+    }
+    return slot;
+}
+
+static void grow_constant_pool(void) {
+    int capacity = vm_const_capacity ? 2 * vm_const_capacity
+                                     : CONST_POOL_CAPACITY;
+    vm_constant_pool = realloc(vm_constant_pool,
+                               capacity * sizeof(struct constant_pool_entry));
+    assert(vm_constant_pool);
+    vm_const_capacity = capacity;
+    // Rebuild the hash index at twice the new capacity
+    free(vm_const_hash);
+    vm_const_hash_size = 2 * capacity;
+    vm_const_hash = calloc(vm_const_hash_size, sizeof(int));
+    assert(vm_const_hash);
+    for (int i=1; i < vm_next_const; ++i) {
+        struct constant_pool_entry *entry = &vm_constant_pool[i];
+        vm_const_hash[const_hash_slot(entry->kind, entry->name)] = i;
+    }
+}
+
+/* lookup_const_index('s', "literal string") returns index
  * OR zero to indicate not present
  */
-extern int lookup_const_index(char *literal) {
+extern int lookup_const_index(char kind, char *literal) {
     // We start with index 1, not 0, so that we can use 0 as failure
-    for (int i=1; i < vm_next_const; ++i) {
-        if (strcmp(literal, vm_constant_pool[i].name) == 0) {
-            return i;
-        }
+    if (vm_const_hash_size == 0) {
+        return 0;
     }
-    // Not present in constant table
-    return 0;
+    return vm_const_hash[const_hash_slot(kind, literal)];
 }
 
 /* create_const_value returns a positive index of the
  * entry the new constant object will have in the constant pool.
  */
-extern int create_const_value(char *literal, obj_ref value) {
+extern int create_const_value(char kind, char *literal, obj_ref value) {
+    if (vm_next_const >= vm_const_capacity) {
+        grow_constant_pool();
+    }
     int const_index = vm_next_const;
     vm_next_const += 1;
+    vm_constant_pool[const_index].kind = kind;
     vm_constant_pool[const_index].name = strdup(literal);
     vm_constant_pool[const_index].const_object = value;
+    vm_const_hash[const_hash_slot(kind, literal)] = const_index;
     return const_index;
 }
 
@@ -165,6 +226,10 @@ extern obj_ref get_const_value(int index) {
     return vm_constant_pool[index].const_object;
 }
 
+extern int vm_const_limit(void) {
+    return vm_next_const;
+}
+
 /* Debugging support */
 extern void dump_constants(void) {
     for (int i=1; i < vm_next_const; ++i) {
@@ -253,6 +318,9 @@ char *guess_description(vm_Word w) {
 }
 
 void stack_dump(int n_words) {
+    if (LOGGING > DEBUG) {
+        return;
+    }
     const char* fp_ind = "-fp->";
     const char* not_fp = "     ";
     log_debug("===");
@@ -283,8 +351,9 @@ void stack_dump(int n_words) {
 /* One execution step, at current PC */
 void vm_step() {
     vm_Instr instr = vm_fetch_next().instr;
-    char *name = guess_description((vm_Word) instr);
-    log_debug("Step:  %s",name );
+    if (LOGGING <= DEBUG) {
+        log_debug("Step:  %s", guess_description((vm_Word) instr));
+    }
     (*instr)();
     health_check_builtins();
     stack_dump(8);
@@ -296,6 +365,7 @@ void vm_run() {
     // push_log_level(DEBUG);
     while (vm_run_state == VM_RUNNING) {
         vm_step();
+        ++vm_steps;
     }
     // pop_log_level();
 }
@@ -13,9 +13,9 @@
 #ifndef TINY_VM_VM_STATE_H
 #define TINY_VM_VM_STATE_H
 
-#define CODE_CAPACITY    1024  // Max # instruction words
+#define CODE_CHUNK_WORDS 16384 // Code memory grows by at least this
 #define FRAME_CAPACITY   1024    // Procedure call stack words
-#define CONST_POOL_CAPACITY 128  // Constant objects, created during loading
+#define CONST_POOL_CAPACITY 128  // Initial constant pool size; grows as needed
 
 /* Core definitions shared with
  * builtins.h
@@ -29,6 +29,8 @@
  * rather than an index so that we can create blocks code
  * outside the vm_code_block, which is convenient for
  * creating native methods with trampolines.
+ * vm_code_block is the first chunk of code memory;
+ * the loader adds more as needed (see vm_loader.h).
  * Program counter always points at next instruction
  * word (not currently executing word).
  */
@@ -55,6 +57,7 @@ extern void vm_relative_jump(int n);
 #define VM_HALTED 0
 #define VM_SINGLE_STEP 2
 extern int vm_run_state;
+extern long vm_steps;  // Operations executed by vm_run
 extern  enum LOG_LEVEL vm_logging;
 
 /* Evaluation stack, separate from activation record
@@ -76,6 +79,10 @@ extern obj_ref vm_eval_pop();
 extern vm_Word vm_frame_stack[FRAME_CAPACITY];
 extern vm_addr vm_sp;   // Stack pointer  (next free location on stack)
 extern vm_addr vm_fp;   // Frame pointer  (locals and return address are relative to this)
+/* In fast mode (vm_fast.h), the value on top of the stack is kept
+ * here rather than at vm_sp; otherwise it is not used.
+ */
+extern vm_Word vm_tos;
 
 /* Single word push/pop */
 extern void vm_frame_push_word(vm_Word val);
@@ -99,23 +106,33 @@ extern char *guess_description(vm_Word w);
  * Constant values are object references.
  */
 
-/* lookup_const_index("literal string") returns index
+/* Constants are identified by kind and literal text, so that
+ * the integer 5 and the string "5" are distinct constants.
+ * Kind is 'i' (integer), 's' (string), or 'n' (named literal,
+ * like $true).
+ */
+
+/* lookup_const_index('s', "literal string") returns index
  * OR zero to indicate not present
  */
-extern int lookup_const_index(char *literal);
+extern int lookup_const_index(char kind, char *literal);
 
 /* create_const_value returns a positive index of the
  * entry the new constant object will have in the constant pool.
  */
-extern int create_const_value(char *literal, obj_ref value);
+extern int create_const_value(char kind, char *literal, obj_ref value);
 
 /* get_const_value returns an object reference corresponding
  * to the provided index.
  */
 extern obj_ref get_const_value(int index);
 
+/* Constants have indexes from 1 up to (not including) this */
+extern int vm_const_limit(void);
+
 
 /* Execution control */
+void vm_step();
 void vm_run();
 
 #endif //TINY_VM_VM_STATE_H